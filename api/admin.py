@@ -1,6 +1,41 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import User, Teacher, Student,Course,Certificate,Enrollment,Assignment,Progress,Announcement,CourseFile
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
+from .models import User, Teacher, Student,Course,Certificate,Enrollment,Assignment,Progress,Announcement,CourseFile,LessonCompletion,WaitlistEntry
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that uses the Postgres planner estimate instead of COUNT(*) for
+    big unfiltered tables. Filtered lists and small tables still get an exact count.
+    """
+    estimate_threshold = 100000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if isinstance(queryset, QuerySet) and not queryset.query.where:
+            connection = connections[queryset.db]
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                        [queryset.model._meta.db_table],
+                    )
+                    row = cursor.fetchone()
+                if row and row[0] >= self.estimate_threshold:
+                    return row[0]
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Base admin for tables that grow with every student (no exact full-table counts)."""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 100
 
 class CustomUserAdmin(UserAdmin):
     model = User
@@ -10,47 +45,79 @@ class CustomUserAdmin(UserAdmin):
 
 class TeacherAdmin(admin.ModelAdmin):
     list_display = ['user', 'experience', 'qualifications', 'subjects_taught', 'joining_date']
+    list_select_related = ['user']
     search_fields = ['user__username', 'qualifications', 'subjects_taught']
     
-class StudentAdmin(admin.ModelAdmin):
+class StudentAdmin(LargeTableAdmin):
     list_display = ['user', 'enrollment_year', 'grade', 'section', 'parent_contact']
+    list_select_related = ['user']
     search_fields = ['user__username', 'grade', 'section']
+    raw_id_fields = ['user']
     
 
 # Course Admin
-class CourseAdmin(admin.ModelAdmin):
-    list_display = ('title', 'teacher', 'start_date', 'end_date','total_lessons')
+class CourseAdmin(LargeTableAdmin):
+    list_display = ('title', 'teacher', 'start_date', 'end_date','total_lessons', 'seat_limit', 'seats_taken')
+    list_select_related = ('teacher__user',)
     search_fields = ('title', 'teacher__user__username')
+    raw_id_fields = ('teacher',)
+    readonly_fields = ('seats_taken', 'waitlist_count')
 
 # Enrollment Admin
-class EnrollmentAdmin(admin.ModelAdmin):
+# Search uses case-sensitive prefix lookups so Postgres can use the *_like btree indexes
+class EnrollmentAdmin(LargeTableAdmin):
     list_display = ('student', 'course', 'enrollment_date')
-    search_fields = ('student__user__username', 'course__title')
+    list_select_related = ('student__user', 'course__teacher__user')
+    search_fields = ('student__user__username__startswith', 'course__title__startswith')
+    raw_id_fields = ('student', 'course')
+
+# WaitlistEntry Admin
+class WaitlistEntryAdmin(LargeTableAdmin):
+    list_display = ('student', 'course', 'position', 'created_at')
+    list_select_related = ('student__user', 'course__teacher__user')
+    search_fields = ('student__user__username__startswith', 'course__title__startswith')
+    raw_id_fields = ('student', 'course')
 
 # Assignment Admin
-class AssignmentAdmin(admin.ModelAdmin):
+class AssignmentAdmin(LargeTableAdmin):
     list_display = ('title', 'course', 'due_date')
+    list_select_related = ('course__teacher__user',)
     search_fields = ('title', 'course__title')
+    raw_id_fields = ('course',)
 
 # Announcement Admin
-class AnnouncementAdmin(admin.ModelAdmin):
+class AnnouncementAdmin(LargeTableAdmin):
     list_display = ('title', 'course', 'created_at')
+    list_select_related = ('course__teacher__user',)
     search_fields = ('title', 'course__title')
+    raw_id_fields = ('course',)
 
 # CourseFile Admin
-class CourseFileAdmin(admin.ModelAdmin):
+class CourseFileAdmin(LargeTableAdmin):
     list_display = ('title', 'course', 'uploaded_at')
+    list_select_related = ('course__teacher__user',)
     search_fields = ('title', 'course__title')
+    raw_id_fields = ('course',)
 
 # Progress Admin
-class ProgressAdmin(admin.ModelAdmin):
+class ProgressAdmin(LargeTableAdmin):
     list_display = ('student', 'course', 'completed_lessons', 'total_lessons', 'is_completed', 'completion_date')
-    search_fields = ('student__user__username', 'course__title')
+    list_select_related = ('student__user', 'course__teacher__user')
+    search_fields = ('student__user__username__startswith', 'course__title__startswith')
+    raw_id_fields = ('student', 'course')
+
+# LessonCompletion Admin
+class LessonCompletionAdmin(LargeTableAdmin):
+    list_display = ('progress', 'lesson_number', 'completed_at')
+    list_select_related = ('progress__student__user', 'progress__course')
+    raw_id_fields = ('progress',)
 
 # Certificate Admin
-class CertificateAdmin(admin.ModelAdmin):
+class CertificateAdmin(LargeTableAdmin):
     list_display = ('student', 'course', 'date_issued')
-    search_fields = ('student__user__username', 'course__title')
+    list_select_related = ('student__user', 'course__teacher__user')
+    search_fields = ('student__user__username__startswith', 'course__title__startswith')
+    raw_id_fields = ('student', 'course')
 
 # Register models
 
@@ -62,9 +129,11 @@ admin.site.register(Student, StudentAdmin)
 
 admin.site.register(Course, CourseAdmin)
 admin.site.register(Enrollment, EnrollmentAdmin)
+admin.site.register(WaitlistEntry, WaitlistEntryAdmin)
 admin.site.register(Assignment, AssignmentAdmin)
 admin.site.register(Announcement, AnnouncementAdmin)
 
 admin.site.register(CourseFile, CourseFileAdmin)
 admin.site.register(Progress, ProgressAdmin)
+admin.site.register(LessonCompletion, LessonCompletionAdmin)
 admin.site.register(Certificate, CertificateAdmin)
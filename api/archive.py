@@ -0,0 +1,125 @@
+"""
+Cold storage for ended courses.
+
+archive_course() moves the per-student and per-course rows of a course (see
+ARCHIVED_MODELS) into a gzip-compressed JSONL file in media storage
+(CourseArchive.data) and deletes them from the hot tables. The rows are
+deleted without per-row signals: the archive keeps the course's counters and
+rollups as they were. Course and Certificate rows are kept, so certificate
+lookups, downloads and media access don't change.
+
+archived_rows() rehydrates an archive on demand as unsaved, read-only model
+instances. Nothing is ever written back.
+"""
+import gzip
+import json
+import tempfile
+
+from django.core.files import File
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, router, transaction
+
+from api.cache import bump_model_version
+
+from api.models import (
+    Announcement, Assignment, CourseArchive, Enrollment, LessonCompletion,
+    Progress, ProgressBucket, WaitlistEntry
+)
+
+# Model -> lookup to the course; children before parents, in deletion order. The rows are
+# deleted without cascading, so every model that points at one of these must be listed too
+ARCHIVED_MODELS = {
+    LessonCompletion: 'progress__course_id',
+    Progress: 'course_id',
+    Enrollment: 'course_id',
+    WaitlistEntry: 'course_id',
+    Assignment: 'course_id',
+    Announcement: 'course_id',
+}
+
+
+class ArchivedRowError(Exception):
+    pass
+
+
+def _read_only(self, *args, **kwargs):
+    raise ArchivedRowError(f"{self._meta.label} rows rehydrated from an archive are read-only.")
+
+
+def archive_course(course):
+    """Move the course's rows into a CourseArchive. Returns the archive."""
+    counts, raw_bytes = {}, 0
+    with tempfile.TemporaryFile() as spool, transaction.atomic(using=router.db_for_write(CourseArchive)):
+        with gzip.GzipFile(fileobj=spool, mode='wb', mtime=0) as archive:
+            for model, lookup in ARCHIVED_MODELS.items():
+                label = model._meta.label_lower
+                columns = [field.attname for field in model._meta.concrete_fields]
+                counts[label] = 0
+                rows = model.objects.filter(**{lookup: course.pk}).order_by('pk').values_list(*columns)
+                for row in rows.iterator(chunk_size=2000):
+                    line = json.dumps({'model': label, 'fields': dict(zip(columns, row))}, cls=DjangoJSONEncoder)
+                    line = line.encode() + b'\n'
+                    archive.write(line)
+                    raw_bytes += len(line)
+                    counts[label] += 1
+
+        course_archive = CourseArchive(course=course, row_counts=counts, raw_bytes=raw_bytes)
+        course_archive.data.save(f"course-{course.pk}.jsonl.gz", File(spool), save=False)
+        try:
+            course_archive.save()
+            for model, lookup in ARCHIVED_MODELS.items():
+                rows = model.objects.filter(**{lookup: course.pk})
+                rows._raw_delete(rows.db)
+            ProgressBucket.objects.filter(course=course).delete()
+        except Exception:
+            course_archive.data.delete(save=False)  # Nothing points at it once the transaction rolls back
+            raise
+    for model in ARCHIVED_MODELS:
+        bump_model_version(model)  # What post_delete would have done for the cached models
+    return course_archive
+
+
+def archived_rows(course_archive, model=None):
+    """Rehydrate archived rows (of one model, or all) as unsaved read-only instances."""
+    models = {model._meta.label_lower: model for model in ARCHIVED_MODELS}
+    wanted = model._meta.label_lower if model is not None else None
+    with course_archive.data.open('rb') as data, gzip.GzipFile(fileobj=data) as archive:
+        for line in archive:
+            record = json.loads(line)
+            if wanted is not None and record['model'] != wanted:
+                continue
+            model_class = models[record['model']]
+            fields = {
+                field.attname: field.to_python(record['fields'][field.attname])
+                for field in model_class._meta.concrete_fields
+            }
+            instance = model_class(**fields)
+            instance._state.adding = False
+            instance.save = instance.delete = _read_only.__get__(instance)
+            yield instance
+
+
+def table_sizes(models):
+    """{table: (rows, data bytes, index bytes)} for the hot tables of `models` (None when unknown)."""
+    sizes = {}
+    for model in models:
+        connection = connections[router.db_for_write(model)]  # The tenant's database while one is active
+        table = model._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM {connection.ops.quote_name(table)}')
+            rows = cursor.fetchone()[0]
+            data = index = None
+            if connection.vendor == 'postgresql':
+                cursor.execute('SELECT pg_relation_size(%s), pg_indexes_size(%s)', [table, table])
+                data, index = cursor.fetchone()
+            elif connection.vendor == 'sqlite':
+                try:
+                    cursor.execute('SELECT name, SUM(pgsize) FROM dbstat GROUP BY name')
+                    pages = dict(cursor.fetchall())
+                    cursor.execute('SELECT name FROM sqlite_master WHERE type = %s AND tbl_name = %s', ['index', table])
+                    data = pages.get(table, 0)
+                    index = sum(pages.get(name, 0) for name, in cursor.fetchall())
+                except Exception:  # SQLite built without dbstat
+                    pass
+            sizes[table] = (rows, data, index)
+    return sizes
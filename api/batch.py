@@ -0,0 +1,29 @@
+"""
+Per-batch identity map: while a /batch/ request runs its sub-requests,
+objects loaded through get_object() are shared instead of queried again.
+Outside a batch get_object() is a plain lookup.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_identity_map = ContextVar('batch_identity_map', default=None)
+
+
+@contextmanager
+def identity_map():
+    token = _identity_map.set({})
+    try:
+        yield
+    finally:
+        _identity_map.reset(token)
+
+
+def get_object(queryset, pk):
+    """queryset.filter(pk=pk).first(), reusing the object if this batch already loaded it."""
+    objects = _identity_map.get()
+    if objects is None:
+        return queryset.filter(pk=pk).first()
+    key = (queryset.model, str(pk))
+    if key not in objects:
+        objects[key] = queryset.filter(pk=pk).first()
+    return objects[key]
@@ -0,0 +1,174 @@
+"""
+Caching for API read models.
+
+Reads are cached with cache-aside helpers. Every key carries the version
+tokens of the models it was built from, and a write replaces the token with a
+fresh one from post_save/post_delete (see signals.py), so stale entries are
+never read again and simply age out of the cache. The tokens only invalidate what shares the
+cache they live in: with more than one process, use a shared backend ('file'
+or 'redis'); `manage.py check --deploy` warns about a per-process one.
+"""
+import pickle
+import uuid
+from collections import Counter
+from threading import Lock
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.locmem import LocMemCache
+
+_sizes = {}
+_stats = {}
+
+_read_stats = Counter()
+_read_stats_lock = Lock()
+
+_missing = object()
+
+
+class LRUMemoryCache(LocMemCache):
+    """
+    LocMemCache bounded by the pickled size of its values (OPTIONS['MAX_BYTES']),
+    evicting the least recently used entries first. Keeps hit/miss/eviction stats.
+    """
+
+    def __init__(self, name, params):
+        super().__init__(name, params)
+        options = params.get('OPTIONS', {})
+        self._max_bytes = int(options.get('MAX_BYTES', 32 * 1024 * 1024))
+        self._sizes = _sizes.setdefault(name, {})
+        self._stats = _stats.setdefault(name, Counter())
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, _missing, version=version)
+        with self._lock:
+            self._stats['hits' if value is not _missing else 'misses'] += 1
+        return default if value is _missing else value
+
+    def _set(self, key, value, timeout=DEFAULT_TIMEOUT):
+        self._delete(key)
+        size = len(value)
+        # LocMemCache keeps the most recently used keys at the front
+        while self._cache and self._stats['bytes'] + size > self._max_bytes:
+            self._evict_oldest()
+        super()._set(key, value, timeout)
+        self._sizes[key] = size
+        self._stats['bytes'] += size
+
+    def incr(self, key, delta=1, version=None):
+        new_value = super().incr(key, delta, version=version)
+        key = self.make_and_validate_key(key, version=version)
+        with self._lock:
+            if key in self._sizes:
+                size = len(pickle.dumps(new_value, self.pickle_protocol))
+                self._stats['bytes'] += size - self._sizes[key]
+                self._sizes[key] = size
+        return new_value
+
+    def _evict_oldest(self):
+        key, _ = self._cache.popitem()
+        self._expire_info.pop(key, None)
+        self._stats['bytes'] -= self._sizes.pop(key, 0)
+        self._stats['evictions'] += 1
+
+    def _cull(self):
+        if self._cull_frequency == 0:
+            self._clear()
+        else:
+            for _ in range(len(self._cache) // self._cull_frequency):
+                self._evict_oldest()
+
+    def _delete(self, key):
+        deleted = super()._delete(key)
+        if deleted:
+            self._stats['bytes'] -= self._sizes.pop(key, 0)
+        return deleted
+
+    def _clear(self):
+        self._cache.clear()
+        self._expire_info.clear()
+        self._sizes.clear()
+        self._stats['bytes'] = 0
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, entries=len(self._cache), max_bytes=self._max_bytes)
+        lookups = stats.get('hits', 0) + stats.get('misses', 0)
+        stats['hit_rate'] = stats.get('hits', 0) / lookups if lookups else 0.0
+        return stats
+
+
+@checks.register(checks.Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    if isinstance(caches[DEFAULT_CACHE_ALIAS], LocMemCache):
+        return [checks.Warning(
+            "The default cache is per process, so a write in one worker doesn't invalidate cached API reads in the others.",
+            hint="Set CACHE_BACKEND to 'file' or 'redis' when running more than one worker.",
+            id='api.W001',
+        )]
+    return []
+
+
+def _version_key(model):
+    return f"model-version:{model._meta.label_lower}"
+
+
+def _new_version():
+    # Unique across workers and hosts, so no two writes ever leave the same version behind
+    return uuid.uuid4().hex
+
+
+def model_versions(*models):
+    """Current version token of each model, in one cache round trip."""
+    keys = [_version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, _new_version(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_model_version(model):
+    """Invalidate every cached read built from `model`."""
+    # A plain set, not incr(): FileBasedCache's incr is a read then a write, so two
+    # workers bumping at once could both write the same value and lose a bump
+    cache.set(_version_key(model), _new_version(), timeout=None)
+
+
+def cached_read(name, models, compute, *parts, timeout=None):
+    """
+    Cache-aside read: return the cached value for `name` + `parts` if the
+    versions of `models` haven't changed, otherwise call compute() and store it,
+    unless one of the versions moved while compute() was reading.
+    """
+    current = model_versions(*models)
+    versions = '.'.join(str(version) for version in current)
+    key = ':'.join([name, versions, *(str(part) for part in parts)])
+
+    value = cache.get(key, _missing)
+    with _read_stats_lock:
+        _read_stats['hits' if value is not _missing else 'misses'] += 1
+    if value is _missing:
+        value = compute()
+        # A write landed meanwhile: what compute() read (e.g. on a replica) may predate it
+        if model_versions(*models) == current:
+            cache.set(key, value, timeout if timeout is not None else settings.API_CACHE_TIMEOUT)
+    return value
+
+
+def cache_stats():
+    """Hit rate of cached_read in this process, plus backend stats when available."""
+    with _read_stats_lock:
+        stats = dict(_read_stats)
+    lookups = stats.get('hits', 0) + stats.get('misses', 0)
+    stats['hit_rate'] = stats.get('hits', 0) / lookups if lookups else 0.0
+    if hasattr(cache, 'stats'):
+        stats['backend'] = cache.stats()
+    return stats
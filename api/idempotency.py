@@ -0,0 +1,144 @@
+"""
+Idempotency-Key support for POST requests.
+
+The first POST with a given key (per credentials and path) runs the view and
+its response is stored for IDEMPOTENCY_TTL seconds. Retries get the stored
+response back, marked with Idempotent-Replayed, without running the view or
+reading the request body. A retry that arrives while the first request is still
+running waits for it (up to IDEMPOTENCY_WAIT_SECONDS); one that arrives after
+the first request's IDEMPOTENCY_LEASE_SECONDS ran out (its worker was killed)
+runs the view itself. Only 2xx responses and deterministic client errors
+(STORED_CLIENT_ERRORS) are stored: a retry after a 5xx, a 429 or an auth
+failure runs the view again.
+"""
+import hashlib
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, router, transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils.timezone import now
+
+from api.models import IdempotencyRecord
+
+REPLAYED_HEADERS = ('Content-Type', 'Location')
+# Client errors that a retry of the same request would get again; others (401, 403, 429...)
+# depend on credentials or timing, so the retry runs the view
+STORED_CLIENT_ERRORS = {400, 404, 409, 422}
+
+
+def request_identity(request):
+    """Who sent the request: the user id from the session or JWT (no DB query), else the client IP."""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f"user:{user.pk}"
+    from rest_framework.exceptions import AuthenticationFailed
+    from rest_framework_simplejwt.authentication import JWTAuthentication
+    from rest_framework_simplejwt.settings import api_settings as jwt_settings
+    authentication = JWTAuthentication()
+    header = authentication.get_header(request)
+    raw_token = authentication.get_raw_token(header) if header else None
+    if raw_token is not None:
+        try:
+            token = authentication.get_validated_token(raw_token)
+            return f"user:{token[jwt_settings.USER_ID_CLAIM]}"
+        except (AuthenticationFailed, KeyError):
+            pass
+    return f"anonymous:{request.META.get('REMOTE_ADDR', '')}"
+
+
+def record_key(request, key):
+    """Keys are per sender and path, so one client can't replay another's response."""
+    return hashlib.sha256('\n'.join([request_identity(request), request.path, key]).encode()).hexdigest()
+
+
+def request_fingerprint(request):
+    """What a retry must match: method, path, body type and size (the body itself isn't read)."""
+    return '|'.join([
+        request.method, request.path,
+        request.headers.get('Content-Type', '').split(';')[0], request.headers.get('Content-Length', '0'),
+    ])[:255]
+
+
+def replay(record):
+    response = HttpResponse(bytes(record.body), status=record.status_code)
+    for header, value in record.headers.items():
+        response[header] = value
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+class IdempotencyMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        key = request.headers.get(settings.IDEMPOTENCY_HEADER)
+        if request.method != 'POST' or key is None:
+            return self.get_response(request)
+        if not key or len(key) > 255:
+            return JsonResponse({"error": f"{settings.IDEMPOTENCY_HEADER} must be 1-255 characters."}, status=400)
+
+        digest, fingerprint = record_key(request, key), request_fingerprint(request)
+        claimed, record = self.claim(digest, fingerprint)
+        if claimed is None:
+            return self.wait_and_replay(record, fingerprint)
+
+        # Filtered on our own in-progress row: if our lease ran out and a retry took the key over,
+        # its record is left alone
+        ours = IdempotencyRecord.objects.filter(pk=claimed.pk, completed=False)
+        try:
+            response = self.get_response(request)
+        except Exception:
+            ours.delete()
+            raise
+
+        status_code = response.status_code
+        if response.streaming or not (200 <= status_code < 300 or status_code in STORED_CLIENT_ERRORS):
+            ours.delete()  # Let a retry run again
+        else:
+            ours.update(
+                completed=True, status_code=response.status_code, body=response.content,
+                headers={header: response[header] for header in REPLAYED_HEADERS if response.has_header(header)},
+                expires_at=now() + timedelta(seconds=settings.IDEMPOTENCY_TTL),
+            )
+        return response
+
+    def claim(self, digest, fingerprint):
+        """
+        (our new in-progress record, None), or (None, the live record) when the key is taken.
+        In-progress records expire after IDEMPOTENCY_LEASE_SECONDS, so a key whose worker
+        was killed mid-request can be claimed again.
+        """
+        for _ in range(2):
+            existing = IdempotencyRecord.objects.filter(key=digest).first()
+            if existing is not None:
+                if existing.expires_at > now():
+                    return None, existing
+                IdempotencyRecord.objects.filter(pk=existing.pk, expires_at__lte=now()).delete()
+            try:
+                with transaction.atomic(using=router.db_for_write(IdempotencyRecord)):
+                    return IdempotencyRecord.objects.create(
+                        key=digest, fingerprint=fingerprint,
+                        expires_at=now() + timedelta(seconds=settings.IDEMPOTENCY_LEASE_SECONDS),
+                    ), None
+            except IntegrityError:
+                continue  # A parallel request claimed it first
+        return None, IdempotencyRecord.objects.filter(key=digest).first()
+
+    def wait_and_replay(self, record, fingerprint):
+        if record is None:
+            return JsonResponse({"error": "The original request failed, retry it."}, status=409)
+        if record.fingerprint != fingerprint:
+            return JsonResponse({"error": "This Idempotency-Key was already used for a different request."}, status=422)
+
+        deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+        while not record.completed:
+            if time.monotonic() >= deadline:
+                return JsonResponse({"error": "A request with this Idempotency-Key is still in progress."}, status=409)
+            time.sleep(settings.IDEMPOTENCY_POLL_INTERVAL)
+            record = IdempotencyRecord.objects.filter(pk=record.pk).first()
+            if record is None:
+                return JsonResponse({"error": "The original request failed, retry it."}, status=409)
+        return replay(record)
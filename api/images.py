@@ -0,0 +1,173 @@
+"""
+Upload pipeline for user images (course thumbnails, profile pictures).
+
+Django streams uploads bigger than FILE_UPLOAD_MAX_MEMORY_SIZE to a temp file.
+ValidatedImageField then checks the byte size, format and dimensions from the
+image header only (Pillow decodes pixels lazily), so oversized images and
+decompression bombs are rejected before anything is decoded. The full decode
+(EXIF orientation, metadata stripping, downscaling) runs after commit in a
+small thread pool, and the result is stored under a new name since media URLs
+are cached as immutable. When the pool's queue is full the upload is kept as is.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from rest_framework import serializers
+
+from api.cache import bump_model_version
+from api.tenants import current_tenant, use_tenant
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_slots = None
+_pool_lock = threading.Lock()
+
+
+def _pillow():
+    # Pillow is imported on first use, not at startup
+    from PIL import Image
+    Image.MAX_IMAGE_PIXELS = settings.IMAGE_MAX_PIXELS
+    return Image
+
+
+def read_image_header(file):
+    """(width, height, format) of an uploaded image, without decoding its pixels."""
+    Image = _pillow()
+    file.seek(0)
+    try:
+        with Image.open(file) as image:
+            return image.width, image.height, image.format
+    finally:
+        file.seek(0)
+
+
+class ValidatedImageField(serializers.ImageField):
+    """ImageField that enforces IMAGE_UPLOAD_MAX_BYTES, IMAGE_MAX_PIXELS and IMAGE_FORMATS."""
+
+    default_error_messages = {
+        'too_large': 'Images may be at most {max_bytes} bytes.',
+        'too_many_pixels': 'Images may be at most {max_pixels} pixels.',
+        'bad_format': 'Unsupported image format, use one of: {formats}.',
+    }
+
+    def to_internal_value(self, data):
+        file = serializers.FileField.to_internal_value(self, data)
+        if file.size > settings.IMAGE_UPLOAD_MAX_BYTES:
+            self.fail('too_large', max_bytes=settings.IMAGE_UPLOAD_MAX_BYTES)
+
+        Image = _pillow()
+        try:
+            width, height, image_format = read_image_header(file)
+        except Image.DecompressionBombError:
+            self.fail('too_many_pixels', max_pixels=settings.IMAGE_MAX_PIXELS)
+        except Exception:
+            self.fail('invalid_image')
+
+        if width * height > settings.IMAGE_MAX_PIXELS:
+            self.fail('too_many_pixels', max_pixels=settings.IMAGE_MAX_PIXELS)
+        if image_format not in settings.IMAGE_FORMATS:
+            self.fail('bad_format', formats=', '.join(settings.IMAGE_FORMATS))
+
+        # Django's check (Image.verify) walks the file structure without decoding pixels
+        django_field = self._DjangoImageField()
+        django_field.error_messages = self.error_messages
+        return django_field.clean(file)
+
+
+def validate_image(file):
+    """Validate an uploaded image outside a serializer (None passes through)."""
+    if file is None:
+        return None
+    return ValidatedImageField().run_validation(file)
+
+
+def normalize_image(model, pk, field_name, using=None):
+    """
+    Re-encode the image in `field_name` upright, without EXIF/XMP metadata and at
+    most IMAGE_MAX_SIDE pixels per side, then point the row (in database `using`)
+    at the new file.
+    """
+    Image = _pillow()
+    from PIL import ImageOps
+
+    manager = model._default_manager.db_manager(using)
+    instance = manager.filter(pk=pk).only(field_name).first()
+    field_file = getattr(instance, field_name, None)
+    if not field_file:
+        return None
+    old_name = field_file.name
+    max_side = settings.IMAGE_MAX_SIDE
+
+    with field_file.open('rb'), Image.open(field_file) as image:
+        image_format = image.format
+        if getattr(image, 'is_animated', False):
+            return None  # Re-encoding would drop the animation
+        image.draft(None, (max_side, max_side))  # JPEG: decode at a reduced scale
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_side, max_side))
+        for key in ('exif', 'xmp', 'XML:com.adobe.xmp', 'comment'):
+            image.info.pop(key, None)
+        if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        output = BytesIO()
+        image.save(output, format=image_format, optimize=True)
+
+    storage = field_file.storage
+    new_name = storage.save(old_name, ContentFile(output.getvalue()))
+    # Only swap if the row still points at the file we processed
+    updated = manager.filter(pk=pk, **{field_name: old_name}).update(**{field_name: new_name})
+    storage.delete(old_name if updated else new_name)
+    if not updated:
+        return None
+    bump_model_version(model)
+    return new_name
+
+
+def _run(model, pk, field_name, tenant, using):
+    close_old_connections()
+    try:
+        # Worker threads don't inherit the request's tenant (cache keys, routing)
+        with use_tenant(tenant, using):
+            normalize_image(model, pk, field_name, using=using)
+    except Exception:
+        logger.exception("Normalizing %s %s.%s failed", model.__name__, pk, field_name)
+    finally:
+        close_old_connections()
+
+
+def _release(future):
+    _pool_slots.release()
+
+
+def submit_image(model, pk, field_name, tenant=None, using=None):
+    """
+    Queue normalize_image. When the pool and its queue are full the original
+    image is kept (it already passed validation) rather than decoding it in
+    the request worker.
+    """
+    global _pool, _pool_slots
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=settings.IMAGE_WORKERS, thread_name_prefix='image')
+            _pool_slots = threading.BoundedSemaphore(settings.IMAGE_WORKERS + settings.IMAGE_QUEUE_SIZE)
+
+    if not _pool_slots.acquire(blocking=False):
+        logger.warning(
+            "Image queue full, keeping %s %s.%s (database %s) as uploaded", model.__name__, pk, field_name, using
+        )
+        return
+    _pool.submit(_run, model, pk, field_name, tenant, using).add_done_callback(_release)
+
+
+def process_image_later(instance, field_name):
+    """Normalize instance.<field_name> in the background once the transaction commits."""
+    if not getattr(instance, field_name):
+        return
+    model, pk, using, tenant = type(instance), instance.pk, instance._state.db, current_tenant()
+    transaction.on_commit(lambda: submit_image(model, pk, field_name, tenant=tenant, using=using), using=using)
@@ -0,0 +1,78 @@
+import json
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, router
+from django.utils.timezone import now
+
+from api.archive import ARCHIVED_MODELS, archive_course, archived_rows, table_sizes
+from api.models import Course, CourseArchive
+
+
+def format_bytes(size):
+    return "?" if size is None else f"{size / 1024:,.0f} KB"
+
+
+class Command(BaseCommand):
+    help = (
+        "Move Enrollment/Progress/Assignment/Announcement rows of courses that ended long ago "
+        "into compressed CourseArchive rows, printing table and index sizes before and after"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=settings.ARCHIVE_AFTER_DAYS,
+                            help="Archive courses whose end_date is at least this many days ago")
+        parser.add_argument('--course', type=int, action='append', dest='courses', help="Only this course id (repeatable)")
+        parser.add_argument('--dry-run', action='store_true')
+        parser.add_argument('--show', type=int, metavar='COURSE_ID',
+                            help="Print an archived course's rows as JSONL instead (read-only)")
+        parser.add_argument('--model', help="With --show: only this model, e.g. progress")
+
+    def handle(self, *args, **options):
+        if options['show']:
+            return self.show(options['show'], options['model'])
+
+        courses = Course.objects.filter(
+            end_date__lte=now().date() - timedelta(days=options['older_than_days']), archive__isnull=True
+        ).only('id', 'title')
+        if options['courses']:
+            courses = courses.filter(id__in=options['courses'])
+        courses = list(courses)
+        self.stdout.write(f"{len(courses)} course(s) to archive")
+        if options['dry_run'] or not courses:
+            return
+
+        before = table_sizes(ARCHIVED_MODELS)
+        raw = compressed = 0
+        for course in courses:
+            course_archive = archive_course(course)
+            raw += course_archive.raw_bytes
+            compressed += course_archive.data.size
+            self.stdout.write(f"  {course.id} {course.title}: {sum(course_archive.row_counts.values())} rows")
+
+        connection = connections[router.db_for_write(CourseArchive)]
+        if connection.vendor == 'sqlite' and not connection.in_atomic_block:
+            connection.cursor().execute('VACUUM')  # Give the freed pages back so sizes are comparable
+        after = table_sizes(ARCHIVED_MODELS)
+
+        self.stdout.write(f"{'table':<24}{'rows':>20}{'data':>28}{'indexes':>28}")
+        for table, (rows, data, index) in before.items():
+            rows_after, data_after, index_after = after[table]
+            self.stdout.write(
+                f"{table:<24}{rows:>10,} -> {rows_after:<8,}"
+                f"{format_bytes(data):>14} -> {format_bytes(data_after):<12}"
+                f"{format_bytes(index):>14} -> {format_bytes(index_after):<12}"
+            )
+        self.stdout.write(f"Archived JSONL: {format_bytes(raw)} raw, {format_bytes(compressed)} compressed")
+
+    def show(self, course_id, model_name):
+        course_archive = CourseArchive.objects.filter(course_id=course_id).first()
+        if course_archive is None:
+            raise CommandError(f"Course {course_id} is not archived.")
+        model = apps.get_model('api', model_name) if model_name else None
+        for instance in archived_rows(course_archive, model):
+            fields = {field.attname: getattr(instance, field.attname) for field in instance._meta.concrete_fields}
+            self.stdout.write(json.dumps({'model': instance._meta.label_lower, 'fields': fields}, cls=DjangoJSONEncoder))
@@ -0,0 +1,17 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from api.models import rebuild_daily_stats
+
+
+class Command(BaseCommand):
+    help = "Recount the daily enrollment/completion rollups (per course and per teacher) from the source rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='start', type=date.fromisoformat, help="First day (YYYY-MM-DD)")
+        parser.add_argument('--to', dest='end', type=date.fromisoformat, help="Last day (YYYY-MM-DD)")
+
+    def handle(self, *args, **options):
+        rows = rebuild_daily_stats(options['start'], options['end'])
+        self.stdout.write(f"Stored {rows} course-day rows")
@@ -0,0 +1,68 @@
+import gzip
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from api.middleware import brotli
+from api.models import Course
+from api.renderers import FastJSONRenderer, orjson
+from api.serializers import CourseSerializer
+
+
+def best_of(repeat, func):
+    """Fastest of `repeat` runs in ms, and the last result."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+class Command(BaseCommand):
+    help = "Benchmark rendering and compressing the course catalog (no database needed)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--courses', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        request = Request(RequestFactory().get('/courses/', HTTP_HOST='localhost'))
+        courses = [
+            Course(
+                id=i, teacher_id=i % 50 + 1, title=f"Course {i}: Introduction to Topic {i}",
+                description="Learn the fundamentals step by step with weekly lessons and quizzes. " * 4,
+                start_date=date(2024, 1, 1), end_date=date(2024, 6, 30), total_lessons=24,
+                thumbnail=f"course_thumbnails/course_{i}.jpg",
+            )
+            for i in range(options['courses'])
+        ]
+
+        ms, data = best_of(repeat, lambda: CourseSerializer(courses, many=True, context={'request': request}).data)
+        self.stdout.write(f"{len(courses)} courses, best of {repeat} runs")
+        self.stdout.write(f"  serializer .data           {ms:9.1f} ms")
+
+        renderers = [('stdlib json', JSONRenderer())]
+        if orjson is not None:
+            renderers.append(('orjson', FastJSONRenderer()))
+        else:
+            self.stdout.write("  (orjson not installed, FastJSONRenderer uses stdlib json)")
+        for name, renderer in renderers:
+            ms, body = best_of(repeat, lambda: renderer.render(data))
+            self.stdout.write(f"  render {name:<19} {ms:9.1f} ms  {len(body):>10} bytes")
+
+        self.stdout.write("Bytes on the wire:")
+        self.stdout.write(f"  identity                   {'':>12}  {len(body):>10} bytes")
+        ms, compressed = best_of(repeat, lambda: gzip.compress(body, compresslevel=6, mtime=0))
+        self.stdout.write(f"  gzip level 6               {ms:9.1f} ms  {len(compressed):>10} bytes")
+        if brotli is not None:
+            ms, compressed = best_of(repeat, lambda: brotli.compress(body, quality=5))
+            self.stdout.write(f"  brotli quality 5           {ms:9.1f} ms  {len(compressed):>10} bytes")
+        else:
+            self.stdout.write("  (brotli not installed)")
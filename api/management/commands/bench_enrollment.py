@@ -0,0 +1,83 @@
+import statistics
+import threading
+import time
+import uuid
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api.models import User, Teacher, Student, Course, Enrollment, WaitlistEntry, enroll_student
+
+
+class Command(BaseCommand):
+    help = "Benchmark concurrent enrollment into one hot course (creates and removes its own rows)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=1000)
+        parser.add_argument('--seats', type=int, default=500)
+        parser.add_argument('--threads', type=int, default=16)
+
+    def handle(self, *args, **options):
+        run = uuid.uuid4().hex[:8]
+        users = User.objects.bulk_create([
+            User(username=f"bench-{run}-{i}", email=f"bench-{run}-{i}@example.com", mobile_number=f"b{run}{i}")
+            for i in range(options['students'] + 1)
+        ])
+        try:
+            teacher = Teacher.objects.create(user=users[0])
+            course = Course.objects.create(
+                teacher=teacher, title=f"Bench course {run}", start_date=date.today(), end_date=date.today(),
+                total_lessons=10, seat_limit=options['seats'],
+            )
+            students = Student.objects.bulk_create([
+                Student(user=user, enrollment_year=date.today().year, grade="bench") for user in users[1:]
+            ])
+            self.run_benchmark(course, students, options['threads'])
+        finally:
+            Course.objects.filter(title=f"Bench course {run}").delete()
+            User.objects.filter(username__startswith=f"bench-{run}-").delete()
+
+    def run_benchmark(self, course, students, thread_count):
+        pending = list(students)
+        lock = threading.Lock()
+        latencies, errors = [], []
+
+        def worker():
+            try:
+                while True:
+                    with lock:
+                        if not pending:
+                            return
+                        student = pending.pop()
+                    start = time.perf_counter()
+                    try:
+                        enroll_student(student, course.id)
+                    except Exception as exc:
+                        errors.append(exc)
+                    latencies.append((time.perf_counter() - start) * 1000)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(thread_count)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        course.refresh_from_db()
+        enrolled = Enrollment.objects.filter(course=course).count()
+        waitlisted = WaitlistEntry.objects.filter(course=course).count()
+        latencies.sort()
+
+        self.stdout.write(f"{len(students)} students, {thread_count} threads, {course.seat_limit} seats ({connection.vendor})")
+        self.stdout.write(f"  throughput      {len(students) / elapsed:10.1f} enrollments/s ({elapsed:.2f} s)")
+        self.stdout.write(f"  latency p50     {statistics.median(latencies):10.2f} ms")
+        self.stdout.write(f"  latency p99     {latencies[int(len(latencies) * 0.99) - 1]:10.2f} ms")
+        self.stdout.write(f"  enrolled        {enrolled:10d} (seats_taken={course.seats_taken})")
+        self.stdout.write(f"  waitlisted      {waitlisted:10d} (last ticket #{course.waitlist_count})")
+        self.stdout.write(f"  errors          {len(errors):10d}")
+        if errors:
+            self.stdout.write(f"  first error: {errors[0]!r}")
@@ -0,0 +1,74 @@
+import os
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+from django.db import connections, router, transaction
+
+from api.models import OutboxEvent
+from api.outbox import FileSink, HttpSink, relay
+
+
+class NullSink:
+    def send(self, messages):
+        pass
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = "Benchmark outbox writes and relay throughput to null, file and local HTTP sinks (removes its own rows)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=20000)
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        run = uuid.uuid4().hex[:8]
+        count = options['events']
+        events = OutboxEvent.objects.filter(topic=f"bench.{run}")
+        payload = {'progress_id': 1, 'student_id': 1, 'course_id': 1,
+                   'completed_lessons': 3, 'total_lessons': 10, 'is_completed': False}
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        path = os.path.join(tempfile.mkdtemp(), 'outbox.jsonl')
+        sinks = [
+            ('null', NullSink()),
+            ('file', FileSink(path)),
+            ('http', HttpSink(f"http://127.0.0.1:{server.server_address[1]}/events")),
+        ]
+
+        self.stdout.write(f"{count} events, pages of {options['batch_size']} ({connections[router.db_for_write(OutboxEvent)].vendor})")
+        try:
+            # One transaction per event, like the receivers writing next to their own change
+            start = time.perf_counter()
+            for i in range(count):
+                with transaction.atomic(using=router.db_for_write(OutboxEvent)):
+                    OutboxEvent.objects.create(topic=f"bench.{run}", aggregate=f"progress:{i}", payload=payload)
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f"  write           {count / elapsed:10.1f} events/s ({elapsed:.2f} s)")
+
+            for name, sink in sinks:
+                events.update(delivered_at=None)
+                start = time.perf_counter()
+                sent = relay(sink, options['batch_size'], events=events)
+                elapsed = time.perf_counter() - start
+                self.stdout.write(f"  relay {name:<10}{sent / elapsed:10.1f} events/s ({elapsed:.2f} s)")
+        finally:
+            server.shutdown()
+            events.delete()
+            if os.path.exists(path):
+                os.remove(path)
+            os.rmdir(os.path.dirname(path))
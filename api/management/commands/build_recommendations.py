@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Rebuild the co-enrollment course recommendations (needs numpy and scipy)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=10)
+        parser.add_argument('--completed-weight', type=float, default=2.0,
+                            help="Weight of a completed course relative to an enrollment")
+
+    def handle(self, *args, **options):
+        try:
+            import numpy, scipy  # noqa: F401
+        except ImportError:
+            raise CommandError("build_recommendations needs numpy and scipy: pip install numpy scipy")
+
+        from api.recommendations import build_recommendations
+
+        start = time.perf_counter()
+        stored = build_recommendations(top_k=options['top_k'], completed_weight=options['completed_weight'])
+        self.stdout.write(f"Stored {stored} recommendations in {time.perf_counter() - start:.1f}s")
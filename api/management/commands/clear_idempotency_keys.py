@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+
+from api.models import IdempotencyRecord
+
+
+class Command(BaseCommand):
+    help = "Delete stored Idempotency-Key responses whose TTL has passed (run periodically)"
+
+    def handle(self, *args, **options):
+        deleted, _ = IdempotencyRecord.objects.filter(expires_at__lte=now()).delete()
+        self.stdout.write(f"Deleted {deleted} expired idempotency records")
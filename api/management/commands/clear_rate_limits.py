@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+
+from api.models import RateLimitCounter
+
+
+class Command(BaseCommand):
+    help = "Delete rate limit counters of windows that no longer count (run periodically)"
+
+    def handle(self, *args, **options):
+        deleted, _ = RateLimitCounter.objects.filter(expires_at__lte=now()).delete()
+        self.stdout.write(f"Deleted {deleted} expired rate limit counters")
@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Create or update the tables of every tenant database (or only --tenant)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tenant', action='append', dest='tenants', help="Only this school (repeatable)")
+
+    def handle(self, *args, **options):
+        tenants = options['tenants'] or list(settings.TENANTS)
+        unknown = set(tenants) - set(settings.TENANTS)
+        if unknown:
+            raise CommandError(f"Unknown tenants: {', '.join(sorted(unknown))}")
+        for tenant in tenants:
+            self.stdout.write(f"Migrating {tenant} ({settings.TENANTS[tenant]})")
+            call_command(
+                'migrate', database=settings.TENANTS[tenant], run_syncdb=True, interactive=False,
+                verbosity=options['verbosity'], stdout=self.stdout,
+            )
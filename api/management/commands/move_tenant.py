@@ -0,0 +1,118 @@
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.admin.utils import NestedObjects
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from api.models import User
+from api.tenants import use_tenant
+
+
+class Command(BaseCommand):
+    help = (
+        "Move a school's users and everything they own (courses, enrollments, progress, ...) "
+        "to another database, keeping primary keys"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('tenant')
+        parser.add_argument('--to', dest='target', required=True, help="Database alias to move to")
+        parser.add_argument('--from', dest='source', help="Database alias to move from (default: the tenant's current one)")
+        parser.add_argument('--keep-source', action='store_true', help="Copy only, leave the source rows")
+        parser.add_argument('--force', action='store_true',
+                            help="Delete the source rows even when some of them can't be copied")
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        tenant = options['tenant']
+        source = options['source'] or settings.TENANTS.get(tenant, DEFAULT_DB_ALIAS)
+        target = options['target']
+        for alias in (source, target):
+            if alias not in connections:
+                raise CommandError(f"Unknown database {alias!r}")
+        if source == target:
+            raise CommandError("Source and target are the same database")
+
+        users = User.objects.using(source).filter(tenant=tenant)
+        if not users.exists():
+            raise CommandError(f"No users of {tenant!r} in {source!r}")
+
+        rows, skipped = self.collect(users, source)
+        for model, instances in rows:
+            self.stdout.write(f"  {model._meta.label:<28}{len(instances):8d}")
+        for label, count in sorted(skipped.items()):
+            self.stdout.write(f"  {label:<28}{count:8d} skipped: they reference another school or another app")
+        if options['dry_run']:
+            return
+        if skipped and not (options['keep_source'] or options['force']):
+            # Deleting the users would cascade through the rows that weren't copied
+            raise CommandError(
+                f"{sum(skipped.values())} rows can't be copied and would be lost with the source rows; "
+                "use --keep-source, or --force to lose them"
+            )
+
+        # Copy first, then delete: a failure in between leaves duplicates, never a lost school
+        with transaction.atomic(using=target):
+            for model, instances in rows:
+                model._base_manager.using(target).bulk_create(instances)
+            reset = connections[target].ops.sequence_reset_sql(no_style(), [model for model, _ in rows])
+            with connections[target].cursor() as cursor:
+                for sql in reset:
+                    cursor.execute(sql)
+        self.stdout.write(f"Copied {sum(len(instances) for _, instances in rows)} rows of {tenant} to {target}")
+
+        if not options['keep_source']:
+            # Delete receivers (seat counts, histograms, caches) must see the source database
+            with use_tenant(tenant, database=source), transaction.atomic(using=source):
+                users.delete()
+            self.stdout.write(f"Deleted them from {source}; point TENANT_DATABASES[{tenant}] at {target}")
+
+    def collect(self, users, source):
+        """
+        [(model, instances)] in insertion order: every api row that cascades
+        from the users. Rows pointing at a row that isn't moved (another
+        school's student, auth groups) are left out, with their dependants.
+        """
+        collector = NestedObjects(using=source)
+        collector.collect(users)
+
+        kept, rows, skipped = {}, [], Counter()
+        for model in self.insertion_order(collector.data):
+            instances = collector.data[model]
+            if model._meta.app_label != 'api':
+                skipped[model._meta.label] += len(instances)
+                continue
+            foreign_keys = [field for field in model._meta.concrete_fields if field.is_relation]
+            moved = []
+            for instance in sorted(instances, key=lambda instance: instance.pk):
+                if all(
+                    getattr(instance, field.attname) is None
+                    or getattr(instance, field.attname) in kept.get(field.related_model._meta.concrete_model, ())
+                    for field in foreign_keys
+                ):
+                    moved.append(instance)
+                else:
+                    skipped[model._meta.label] += 1
+            kept[model] = {instance.pk for instance in moved}
+            if moved:
+                rows.append((model, moved))
+        return rows, skipped
+
+    def insertion_order(self, models):
+        """Models ordered so every model comes after the models its foreign keys point to."""
+        def parents(model):
+            return {
+                field.related_model._meta.concrete_model for field in model._meta.concrete_fields
+                if field.is_relation and field.related_model is not model
+            } & set(models)
+
+        ordered, remaining = [], list(models)
+        while remaining:
+            ready = [model for model in remaining if parents(model) <= set(ordered)]
+            if not ready:
+                raise CommandError(f"Circular foreign keys between {', '.join(m._meta.label for m in remaining)}")
+            ordered += ready
+            remaining = [model for model in remaining if model not in ready]
+        return ordered
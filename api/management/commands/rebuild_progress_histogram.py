@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from api.models import ProgressBucket
+
+
+class Command(BaseCommand):
+    help = "Recount the per-course completed_lessons histogram (ProgressBucket) from Progress"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--course', type=int, action='append', dest='courses',
+                            help="Only this course id (repeatable)")
+
+    def handle(self, *args, **options):
+        buckets = ProgressBucket.objects.rebuild(options['courses'])
+        self.stdout.write(f"Stored {buckets} histogram buckets")
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from api.models import recount_seats
+
+
+class Command(BaseCommand):
+    help = "Recount Course.seats_taken from the enrollments"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--course', type=int, action='append', dest='courses',
+                            help="Only this course id (repeatable)")
+
+    def handle(self, *args, **options):
+        fixed = recount_seats(options['courses'])
+        self.stdout.write(f"Corrected seats_taken on {fixed} courses")
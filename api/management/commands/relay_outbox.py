@@ -0,0 +1,41 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+
+from api.models import OutboxEvent
+from api.outbox import get_sink, relay
+
+
+class Command(BaseCommand):
+    help = "Deliver pending outbox events (enrollments, progress, certificates) to a sink, in id order"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sink', default=settings.OUTBOX_SINK,
+                            help="stdout, file:<path>, http(s)://<url> or a dotted sink class")
+        parser.add_argument('--batch-size', type=int, default=settings.OUTBOX_BATCH_SIZE)
+        parser.add_argument('--follow', action='store_true', help="Keep polling for new events")
+        parser.add_argument('--purge-days', type=int, default=settings.OUTBOX_RETENTION_DAYS,
+                            help="Delete events delivered more than this many days ago (0 keeps them)")
+
+    def handle(self, *args, **options):
+        sink = get_sink(options['sink'], stdout=self.stdout)
+        try:
+            while True:
+                sent = relay(sink, options['batch_size'])
+                if sent:
+                    self.stderr.write(f"Delivered {sent} outbox events")
+                if not options['follow']:
+                    break
+                if not sent:
+                    time.sleep(settings.OUTBOX_POLL_INTERVAL)
+        except KeyboardInterrupt:
+            pass
+
+        if options['purge_days']:
+            cutoff = now() - timedelta(days=options['purge_days'])
+            deleted, _ = OutboxEvent.objects.filter(delivered_at__lt=cutoff).delete()
+            if deleted:
+                self.stderr.write(f"Purged {deleted} delivered events")
@@ -0,0 +1,72 @@
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+IMPORT_TIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+# What the first request adds to the cold start: loading the URLconf (and the views)
+FIRST_REQUEST = "from django.urls import get_resolver; get_resolver().url_patterns"
+
+
+def profile_imports(module='cms_backend.wsgi', then=''):
+    """
+    Import `module` in a fresh interpreter with -X importtime, then run the `then` statement.
+    Returns (wall time in ms, list of (module, self ms, cumulative ms, depth), modules loaded).
+    """
+    code = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        f"import {module}\n"
+        f"{then}\n"
+        "print((time.perf_counter() - start) * 1000)\n"
+        "print(' '.join(sorted(sys.modules)))\n"
+    )
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'cms_backend.settings'))
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+
+    imports = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            imports.append((name, int(self_us) / 1000, int(cumulative_us) / 1000, (len(indent) - 1) // 2))
+
+    wall_ms, loaded = result.stdout.splitlines()[-2:]
+    return float(wall_ms), imports, set(loaded.split())
+
+
+class Command(BaseCommand):
+    help = "Report per-module import cost of the WSGI entry point (cold start)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--module', default='cms_backend.wsgi', help="Module to import")
+        parser.add_argument('--limit', type=int, default=25, help="Number of rows per table")
+        parser.add_argument('--first-request', action='store_true',
+                            help="Also load the URLconf, as the first request does")
+
+    def handle(self, *args, **options):
+        wall_ms, imports, _ = profile_imports(options['module'], FIRST_REQUEST if options['first_request'] else '')
+        limit = options['limit']
+
+        self.stdout.write(f"Importing {options['module']}{' and the URLconf' if options['first_request'] else ''} took {wall_ms:.1f} ms ({len(imports)} modules)\n")
+
+        self.stdout.write("Slowest modules (cumulative ms, self ms):")
+        for name, self_ms, cumulative_ms, depth in sorted(imports, key=lambda row: -row[2])[:limit]:
+            self.stdout.write(f"  {cumulative_ms:9.1f} {self_ms:9.1f}  {name}")
+
+        # Self time summed per top-level package shows which dependency costs the most
+        packages = defaultdict(float)
+        for name, self_ms, _, _ in imports:
+            packages[name.split('.')[0]] += self_ms
+        self.stdout.write("\nSelf time per package (ms):")
+        for package, total in sorted(packages.items(), key=lambda item: -item[1])[:limit]:
+            self.stdout.write(f"  {total:9.1f}  {package}")
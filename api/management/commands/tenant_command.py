@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from api.tenants import use_tenant
+
+
+class Command(BaseCommand):
+    help = "Run a management command for one school, e.g. `tenant_command north relay_outbox --sink stdout`"
+
+    def add_arguments(self, parser):
+        parser.add_argument('tenant')
+        parser.add_argument('command')
+        parser.add_argument('args', nargs='...')
+
+    def handle(self, *args, **options):
+        if options['tenant'] not in settings.TENANTS:
+            raise CommandError(f"Unknown tenant {options['tenant']!r}")
+        with use_tenant(options['tenant']):
+            call_command(options['command'], *args, stdout=self.stdout, stderr=self.stderr)
@@ -1,16 +1,21 @@
 # Django built-in imports
-from django.db import models
+from django.conf import settings
+from django.db import IntegrityError, models, router, transaction
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
 from django.contrib.auth.models import AbstractUser
 from django.utils.timezone import now
-from django.db.models.signals import post_save
-from django.dispatch import receiver
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver, Signal
 from django.utils.text import slugify
 
-# Image processing
-from PIL import Image, ImageDraw, ImageFont
+# App
+from api.tenants import current_tenant
 
 # System / utilities
 import os
+from collections import Counter
 
 
 class User(AbstractUser):
@@ -18,9 +23,16 @@ class User(AbstractUser):
     mobile_number = models.CharField(max_length=15, unique=True)
     profile_pic = models.ImageField(upload_to='profile_pics/', blank=True, null=True)
     bio = models.TextField(blank=True, null=True)
+    # School the account belongs to (api.tenants); its courses belong to the same school
+    tenant = models.CharField(max_length=50, blank=True, default='', db_index=True)
     
     def __str__(self):
         return self.username
+
+    def save(self, *args, **kwargs):
+        if self._state.adding and not self.tenant:
+            self.tenant = current_tenant() or ''
+        super().save(*args, **kwargs)
     
 
 class Teacher(models.Model):
@@ -46,28 +58,147 @@ class Student(models.Model):
 class Course(models.Model):
     teacher = models.ForeignKey(Teacher, on_delete=models.CASCADE, related_name='courses')
     students = models.ManyToManyField(Student, related_name='courses', blank=True)
-    title = models.CharField(max_length=255)
+    title = models.CharField(max_length=255, db_index=True)  # Prefix search in admin
     description = models.TextField(blank=True, null=True)
     start_date = models.DateField()
     end_date = models.DateField()
     total_lessons = models.PositiveIntegerField(null=False)
     thumbnail = models.ImageField(upload_to='course_thumbnails/', blank=True, null=True)  # ✅ Add this field
+    # Capacity: seat_limit None means unlimited. seats_taken is kept by enroll_student()
+    # and the Enrollment post_delete receiver, so checking capacity never counts Enrollment rows
+    # (`manage.py recount_seats` sets it from the enrollments, e.g. for courses created before it).
+    seat_limit = models.PositiveIntegerField(blank=True, null=True)
+    seats_taken = models.PositiveIntegerField(default=0)
+    waitlist_count = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return f"{self.title} by {self.teacher.user.username}"
 
+    COUNTER_FIELDS = ('seats_taken', 'waitlist_count')
+
+    def save(self, *args, **kwargs):
+        # Counters only change through F() updates; saving an edited course must not write back stale values
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTER_FIELDS and field.attname not in deferred
+            ]
+        super().save(*args, **kwargs)
+
 class Enrollment(models.Model):
     student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='enrollments')
     course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='enrollments')
     enrollment_date = models.DateField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['student', 'course'], name='unique_enrollment'),
+        ]
+
     def __str__(self):
         return f"{self.student.user.username} enrolled in {self.course.title}"
 
+    def save(self, *args, **kwargs):
+        # The post_save receivers (Progress row, outbox event) commit or roll back with the enrollment
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
+
+class WaitlistEntry(models.Model):
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='waitlist')
+    student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='waitlist_entries')
+    position = models.PositiveIntegerField()  # Ticket number from Course.waitlist_count
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['course', 'student'], name='unique_waitlist_entry'),
+        ]
+        indexes = [models.Index(fields=['course', 'position'])]
+
+    def __str__(self):
+        return f"{self.student.user.username} waiting for {self.course.title} (#{self.position})"
+
+
+class CourseFull(Exception):
+    pass
+
+
+def enroll_student(student, course_id):
+    """
+    Enroll `student`, claiming a seat with one conditional UPDATE on Course.seats_taken.
+    Returns the Enrollment, or the student's WaitlistEntry when the course is full
+    (release_seat enrolls the head of the waitlist when a seat is freed).
+    Raises IntegrityError if the student is already enrolled.
+    """
+    using = router.db_for_write(Course)  # The tenant's database while one is active
+    try:
+        with transaction.atomic(using=using):
+            has_seat = models.Q(seat_limit__isnull=True) | models.Q(seats_taken__lt=F('seat_limit'))
+            if not Course.objects.filter(pk=course_id).filter(has_seat).update(seats_taken=F('seats_taken') + 1):
+                raise CourseFull
+            WaitlistEntry.objects.filter(course_id=course_id, student=student).delete()  # No longer waiting
+            return Enrollment.objects.create(student=student, course_id=course_id)
+    except CourseFull:
+        pass
+
+    entry = WaitlistEntry.objects.filter(course_id=course_id, student=student).first()
+    if entry:
+        return entry
+    try:
+        with transaction.atomic(using=using):
+            # Write first: the UPDATE holds the course row lock, so the SELECT reads our own ticket number
+            Course.objects.filter(pk=course_id).update(waitlist_count=F('waitlist_count') + 1)
+            position = Course.objects.filter(pk=course_id).values_list('waitlist_count', flat=True).get()
+            return WaitlistEntry.objects.create(course_id=course_id, student=student, position=position)
+    except IntegrityError:  # Waitlisted by a parallel request
+        return WaitlistEntry.objects.get(course_id=course_id, student=student)
+
+
+@receiver(post_delete, sender=Enrollment)
+def release_seat(sender, instance, origin=None, **kwargs):
+    """The freed seat goes to the head of the waitlist, or back to the course when nobody waits."""
+    if isinstance(origin, Course):
+        return  # The whole course is being deleted
+    using = instance._state.db
+    with transaction.atomic(using=using):
+        head = (
+            WaitlistEntry.objects.using(using).select_for_update()
+            .filter(course_id=instance.course_id).exclude(student_id=instance.student_id)
+            .order_by('position').first()
+        )
+        if head is None:
+            Course.objects.using(using).filter(pk=instance.course_id, seats_taken__gt=0).update(seats_taken=F('seats_taken') - 1)
+            return
+        head.delete()
+        # seats_taken stays: the seat changes hands
+        Enrollment.objects.using(using).create(student_id=head.student_id, course_id=instance.course_id)
+
+def recount_seats(course_ids=None):
+    """
+    Set Course.seats_taken to the number of enrollments (all courses, or only
+    `course_ids`), e.g. after enrollments were added or removed without the
+    counter. Returns how many courses were off.
+    """
+    courses = Course.objects.all() if course_ids is None else Course.objects.filter(pk__in=course_ids)
+    enrolled = Coalesce(Subquery(
+        Enrollment.objects.filter(course=OuterRef('pk')).order_by().values('course').annotate(count=Count('pk')).values('count')
+    ), 0)
+    with transaction.atomic(using=router.db_for_write(Course)):
+        # Locked first: enroll_student() updates the course row before it adds the enrollment
+        list(courses.select_for_update().values_list('pk', flat=True))
+        return courses.annotate(enrolled=enrolled).exclude(seats_taken=F('enrolled')).update(seats_taken=enrolled)
+
 # ✅ Move the signal function outside the model class
 @receiver(post_save, sender=Enrollment)
 def create_progress_for_enrollment(sender, instance, created, **kwargs):
     if created:
+        OutboxEvent.objects.record(
+            'enrollment.created', instance,
+            enrollment_id=instance.pk, student_id=instance.student_id,
+            course_id=instance.course_id, enrollment_date=instance.enrollment_date,
+        )
         Progress.objects.create(
             student=instance.student,
             course=instance.course,
@@ -95,12 +226,106 @@ class Announcement(models.Model):
 class CourseFile(models.Model):
     course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='files')
     title = models.CharField(max_length=255)
-    file = models.FileField(upload_to='course_files/')
+    file = models.FileField(upload_to='course_files/', db_index=True)  # Looked up by path in serve_media
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return f"{self.title} ({self.course.title})"
 
+# Sent once per Progress row when it goes from incomplete to complete
+# (kwargs: progress_id, student_id, course_id, completion_date)
+progress_completed = Signal()
+
+
+class ProgressQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        """Bulk updates skip save(), so pick up rows that crossed total_lessons here."""
+        if not any(name in kwargs for name in ('completed_lessons', 'total_lessons', 'is_completed')):
+            return super().update(**kwargs)
+        with transaction.atomic(using=self.db):
+            before = {
+                pk: (course_id, state)
+                for pk, course_id, *state in self.select_for_update().values_list(
+                    'pk', 'course_id', 'completed_lessons', 'total_lessons', 'is_completed'
+                )
+            }
+            rows = super().update(**kwargs)
+            updated = self.model.objects.db_manager(self.db).filter(pk__in=before)
+            after = list(
+                updated.values_list('pk', 'student_id', 'course_id', 'completed_lessons', 'total_lessons', 'is_completed')
+            )
+            if 'completed_lessons' in kwargs:
+                # Keep the per-course histogram in step: compare each row before and after
+                changes = Counter()
+                for course_id, (lessons, _, _) in before.values():
+                    changes[course_id, lessons] -= 1
+                for _, _, course_id, lessons, _, _ in after:
+                    changes[course_id, lessons] += 1
+                ProgressBucket.objects.db_manager(self.db).shift(changes)
+            # Bulk updates don't send post_save, so the outbox events are written here
+            OutboxEvent.objects.db_manager(self.db).bulk_create(OutboxEvent.objects.progress_events(
+                row for row in after if list(row[3:]) != before[row[0]][1]
+            ))
+            if 'completed_lessons' in kwargs or 'total_lessons' in kwargs:
+                # Only the rows this update touched can have crossed total_lessons
+                updated.complete_pending()
+        return rows
+
+    def add_completed_lesson(self):
+        """
+        Count one more completed lesson with a conditional UPDATE on locked rows
+        (safe under concurrency, never goes past total_lessons).
+        """
+        with transaction.atomic(using=self.db):
+            not_finished = list(
+                self.filter(completed_lessons__lt=F('total_lessons'))
+                .select_for_update()
+                .values_list('pk', 'student_id', 'course_id', 'completed_lessons', 'total_lessons', 'is_completed')
+            )
+            if not not_finished:
+                return 0
+            # QuerySet.update directly: the row that may have just completed is handled below,
+            # so the sweep in update() isn't needed
+            rows = super(ProgressQuerySet, self.filter(pk__in=[row[0] for row in not_finished])).update(
+                completed_lessons=F('completed_lessons') + 1
+            )
+            changes = Counter()
+            for _, _, course_id, lessons, _, _ in not_finished:
+                changes[course_id, lessons] -= 1
+                changes[course_id, lessons + 1] += 1
+            ProgressBucket.objects.db_manager(self.db).shift(changes)
+            OutboxEvent.objects.db_manager(self.db).bulk_create(OutboxEvent.objects.progress_events(
+                (pk, student_id, course_id, lessons + 1, total, completed)
+                for pk, student_id, course_id, lessons, total, completed in not_finished
+            ))
+        self.complete_pending()
+        return rows
+
+    def complete_pending(self):
+        """Mark rows that reached total_lessons as completed and send progress_completed for each."""
+        with transaction.atomic(using=self.db):
+            pending = list(
+                self.filter(is_completed=False, completed_lessons__gte=F('total_lessons'))
+                .select_for_update()
+                .values_list('pk', 'student_id', 'course_id', 'completed_lessons', 'total_lessons')
+            )
+            if not pending:
+                return 0
+            today = now().date()
+            # QuerySet.update directly: the events for these rows are written below
+            super(ProgressQuerySet, self.filter(pk__in=[row[0] for row in pending])).update(
+                is_completed=True, completion_date=today
+            )
+            OutboxEvent.objects.db_manager(self.db).bulk_create(OutboxEvent.objects.progress_events(
+                row + (True,) for row in pending
+            ))
+        for pk, student_id, course_id, _, _ in pending:
+            progress_completed.send(
+                sender=self.model, progress_id=pk, student_id=student_id, course_id=course_id, completion_date=today
+            )
+        return len(pending)
+
+
 class Progress(models.Model):
     student = models.ForeignKey('Student', on_delete=models.CASCADE, related_name='progress')
     course = models.ForeignKey('Course', on_delete=models.CASCADE, related_name='progress')
@@ -109,27 +334,187 @@ class Progress(models.Model):
     is_completed = models.BooleanField(default=False)
     completion_date = models.DateField(blank=True, null=True)
 
+    objects = ProgressQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Sorted class view (CourseRankingView)
+            models.Index(fields=['course', '-completed_lessons'], name='progress_course_rank_idx'),
+        ]
+
     def __str__(self):
         return f"{self.student.user.username} - {self.course.title} Progress"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # What the histogram counts this row under, and what the last outbox event said (see save())
+        instance._saved_completed_lessons = instance.__dict__.get('completed_lessons')
+        instance._saved_state = instance.outbox_state()
+        return instance
+
+    def outbox_state(self):
+        return tuple(self.__dict__.get(name) for name in ('completed_lessons', 'total_lessons', 'is_completed'))
+
     def save(self, *args, **kwargs):
-        if self.completed_lessons >= self.total_lessons:
+        # is_completed is the edge state: only the incomplete -> complete save does the work
+        just_completed = not self.is_completed and self.completed_lessons >= self.total_lessons
+        if just_completed:
             self.is_completed = True
-            self.completion_date = now().date()
-        super().save(*args, **kwargs)
+            self.completion_date = self.completion_date or now().date()
+
+        update_fields = kwargs.get('update_fields')
+        saved = getattr(self, '_saved_completed_lessons', None)
+        locked = False  # The old bucket is read under a row lock inside the transaction
+        if self._state.adding:
+            changes = Counter({(self.course_id, self.completed_lessons): 1})
+        elif update_fields is not None and 'completed_lessons' not in update_fields:
+            changes = Counter()
+        elif update_fields is None and saved is not None and saved == self.completed_lessons:
+            # Unchanged here: don't write back a value another request may have moved since it was loaded
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'completed_lessons' and field.attname not in deferred
+            ]
+            changes = Counter()
+        else:
+            changes, locked = None, True
+
+        # The post_save receiver only writes an outbox event when the progress actually changed
+        state = self.outbox_state()
+        self._outbox_pending = self._state.adding or state != getattr(self, '_saved_state', None)
+
+        if locked or any(changes.values()) or self._outbox_pending:
+            using = kwargs.get('using') or router.db_for_write(Progress, instance=self)
+            with transaction.atomic(using=using):
+                if locked:
+                    current = (
+                        Progress.objects.using(using).select_for_update()
+                        .filter(pk=self.pk).values_list('completed_lessons', flat=True).first()
+                    )
+                    changes = Counter({(self.course_id, current): -1}) if current is not None else Counter()
+                    changes[self.course_id, self.completed_lessons] += 1
+                super().save(*args, **kwargs)
+                ProgressBucket.objects.shift(changes)
+        else:
+            super().save(*args, **kwargs)  # Neither the histogram nor the outbox moves
+        self._saved_completed_lessons = self.completed_lessons
+        self._saved_state = state
+
+        if just_completed:
+            progress_completed.send(
+                sender=Progress, progress_id=self.pk, student_id=self.student_id,
+                course_id=self.course_id, completion_date=self.completion_date
+            )
+
+@receiver(post_delete, sender=Progress)
+def remove_from_progress_histogram(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Course):
+        return  # The course's buckets are deleted with it
+    ProgressBucket.objects.shift(Counter({(instance.course_id, instance.completed_lessons): -1}))
+
+
+def upsert_counter(rows, changes, values, create=True):
+    """
+    Apply `changes` (F() expressions) to the counter row in `rows`, or create it
+    from `values` if there is none yet (and `create` allows it).
+    Returns True if this call created the row.
+    """
+    if rows.update(**changes) or not create:
+        return False
+    try:
+        with transaction.atomic(using=router.db_for_write(rows.model)):
+            rows.create(**values)
+    except IntegrityError:  # Created by a parallel transaction
+        rows.update(**changes)
+        return False
+    return True
+
+
+class ProgressBucketManager(models.Manager):
+    def shift(self, changes):
+        """Apply {(course_id, completed_lessons): delta} to the histogram."""
+        for (course_id, lessons), delta in changes.items():
+            if not delta:
+                continue
+            upsert_counter(
+                self.filter(course_id=course_id, completed_lessons=lessons),
+                {'count': F('count') + delta},
+                {'course_id': course_id, 'completed_lessons': lessons, 'count': delta},
+                # No bucket to take from: the course is being deleted with its histogram
+                create=delta > 0,
+            )
+
+    def rebuild(self, course_ids=None):
+        """Recount the histogram from Progress (all courses, or only `course_ids`)."""
+        progress = Progress.objects.all()
+        buckets = self.all()
+        if course_ids is not None:
+            progress = progress.filter(course_id__in=course_ids)
+            buckets = buckets.filter(course_id__in=course_ids)
+        with transaction.atomic(using=self.db):
+            buckets.delete()
+            rows = progress.values('course_id', 'completed_lessons').annotate(count=Count('pk')).order_by()
+            return len(self.bulk_create(ProgressBucket(**row) for row in rows))
+
+
+class ProgressBucket(models.Model):
+    """
+    Histogram of Progress.completed_lessons per course: `count` students of the
+    course have completed exactly `completed_lessons` lessons. Kept in step by
+    Progress.save(), ProgressQuerySet and the Progress post_delete receiver, so
+    rank and percentile queries read at most total_lessons + 1 rows.
+    """
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='progress_buckets')
+    completed_lessons = models.IntegerField()
+    count = models.IntegerField(default=0)
+
+    objects = ProgressBucketManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['course', 'completed_lessons'], name='unique_progress_bucket'),
+        ]
+
+    def __str__(self):
+        return f"Course {self.course_id}: {self.count} at {self.completed_lessons} lessons"
+
+
+class LessonCompletion(models.Model):
+    progress = models.ForeignKey(Progress, on_delete=models.CASCADE, related_name='lesson_completions')
+    lesson_number = models.PositiveIntegerField()
+    completed_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            # Completing the same lesson twice is a no-op
+            models.UniqueConstraint(fields=['progress', 'lesson_number'], name='unique_lesson_completion'),
+        ]
+
+    def __str__(self):
+        return f"Lesson {self.lesson_number} completed (progress {self.progress_id})"
 
 # ✅
 class Certificate(models.Model):
     student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='certificates')
     course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='certificates')
     date_issued = models.DateField(auto_now_add=True)
-    certificate_file = models.ImageField(upload_to='certificates/', blank=True, null=True)
+    certificate_file = models.ImageField(upload_to='certificates/', blank=True, null=True, db_index=True)  # Looked up by path in serve_media
 
     def __str__(self):
         return f"Certificate for {self.student.user.username} - {self.course.title}"
 
+    def save(self, *args, **kwargs):
+        # Keeps the certificate.issued outbox event (post_save) in the same transaction
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
     def generate_certificate(self):
         """Generates a certificate image when the student completes the course."""
+        # Pillow is only needed here, so it isn't imported at startup
+        from PIL import Image, ImageDraw, ImageFont
+
         # Define certificate size and background
         img = Image.new('RGB', (800, 600), color=(255, 255, 255))
         draw = ImageDraw.Draw(img)
@@ -146,9 +531,246 @@ class Certificate(models.Model):
 
         # Save the certificate
         filename = f"cert_{slugify(self.student.user.username)}_{slugify(self.course.title)}.png"
-        cert_path = os.path.join('media/certificates', filename)
-        img.save(cert_path)
+        cert_dir = os.path.join(settings.MEDIA_ROOT, 'certificates')
+        os.makedirs(cert_dir, exist_ok=True)
+        img.save(os.path.join(cert_dir, filename))
 
         # Save file path to model
         self.certificate_file = f"certificates/{filename}"
         self.save()
+
+
+class RateLimitCounter(models.Model):
+    """Requests seen for one throttle key in one fixed window (see api.throttling)."""
+    key = models.CharField(max_length=255)
+    window = models.BigIntegerField()  # Window start // window length
+    count = models.PositiveIntegerField(default=0)
+    expires_at = models.DateTimeField(db_index=True)  # End of the next window, when this one stops counting
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['key', 'window'], name='unique_rate_limit_window'),
+        ]
+
+    def __str__(self):
+        return f"{self.key} @ {self.window}: {self.count}"
+
+
+class CourseRecommendation(models.Model):
+    """Top-K "students who took this also took" neighbours, rebuilt by `build_recommendations`."""
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='recommendations')
+    recommended = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            # Also the index the recommendations endpoint reads with
+            models.UniqueConstraint(fields=['course', 'rank'], name='unique_recommendation_rank'),
+        ]
+
+    def __str__(self):
+        return f"#{self.rank} for course {self.course_id}: {self.recommended_id} ({self.score:.3f})"
+
+
+class CourseArchive(models.Model):
+    """
+    Enrollment, Progress, LessonCompletion, WaitlistEntry, Assignment and
+    Announcement rows of an ended course, moved out of the hot tables by
+    `archive_courses` into a gzip-compressed JSONL file (see api.archive). The
+    course and its certificates stay where they are.
+    """
+    course = models.OneToOneField(Course, on_delete=models.CASCADE, related_name='archive')
+    archived_at = models.DateTimeField(auto_now_add=True)
+    row_counts = models.JSONField(default=dict)
+    raw_bytes = models.PositiveBigIntegerField(default=0)
+    data = models.FileField(upload_to='course_archives/')  # Not served under /media/, read through CourseArchiveView
+
+    def __str__(self):
+        return f"Archive of course {self.course_id} ({sum(self.row_counts.values())} rows)"
+
+
+class IdempotencyRecord(models.Model):
+    """Stored response of a POST sent with an Idempotency-Key header (see api.idempotency)."""
+    key = models.CharField(max_length=64, unique=True)  # sha256 of credentials, path and the client's key
+    fingerprint = models.CharField(max_length=255)
+    completed = models.BooleanField(default=False)
+    status_code = models.PositiveSmallIntegerField(null=True)
+    headers = models.JSONField(default=dict)
+    body = models.BinaryField(default=b'')
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)  # Lease end while in progress, then end of the TTL
+
+    def __str__(self):
+        return f"{self.key[:12]} ({'done' if self.completed else 'in progress'})"
+
+
+class OutboxEventManager(models.Manager):
+    def record(self, topic, instance, **payload):
+        """Queue an event about `instance`; call inside the transaction that changed it."""
+        return self.create(topic=topic, aggregate=f"{instance._meta.model_name}:{instance.pk}", payload=payload)
+
+    def progress_events(self, rows, topic='progress.updated'):
+        """Unsaved events for (pk, student_id, course_id, completed_lessons, total_lessons, is_completed) rows."""
+        return [
+            self.model(
+                topic=topic, aggregate=f"progress:{pk}",
+                payload={
+                    'progress_id': pk, 'student_id': student_id, 'course_id': course_id,
+                    'completed_lessons': lessons, 'total_lessons': total, 'is_completed': completed,
+                },
+            )
+            for pk, student_id, course_id, lessons, total, completed in rows
+        ]
+
+
+class OutboxEvent(models.Model):
+    """
+    Transactional outbox: Enrollment, Progress and Certificate changes write an
+    event here in the same transaction as the change, and `relay_outbox`
+    delivers undelivered events to a sink in id order (see api.outbox).
+    """
+    id = models.BigAutoField(primary_key=True)
+    topic = models.CharField(max_length=50)  # e.g. enrollment.created, progress.updated, certificate.issued
+    aggregate = models.CharField(max_length=50)  # <model>:<pk>
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    delivered_at = models.DateTimeField(null=True, blank=True)
+
+    objects = OutboxEventManager()
+
+    class Meta:
+        indexes = [
+            # The relay's "next page" query only ever looks at undelivered rows
+            models.Index(fields=['id'], condition=models.Q(delivered_at__isnull=True), name='outbox_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f"#{self.id} {self.topic} {self.aggregate}"
+
+    def as_message(self):
+        return {
+            'id': self.id,
+            'topic': self.topic,
+            'aggregate': self.aggregate,
+            'created_at': self.created_at.isoformat(),
+            'payload': self.payload,
+        }
+
+
+class DailyStatsManager(models.Manager):
+    def add(self, day, enrollments=0, completions=0, **scope):
+        """Add to (or, with negative counts, take from) one day's counts (scope: course_id= or teacher_id=)."""
+        upsert_counter(
+            self.filter(day=day, **scope),
+            {
+                'enrollments': Greatest(F('enrollments') + enrollments, 0),
+                'completions': Greatest(F('completions') + completions, 0),
+            },
+            {'day': day, 'enrollments': enrollments, 'completions': completions, **scope},
+            # Nothing to take from: the day was never counted
+            create=enrollments >= 0 and completions >= 0,
+        )
+
+
+class DailyStats(models.Model):
+    """
+    Enrollments and completions on one day, so charts read one row per day.
+    The counts are of the rows that exist now: an enrollment dated that day,
+    a progress row completed that day. Deleting one takes it off again.
+    """
+    day = models.DateField()
+    enrollments = models.PositiveIntegerField(default=0)
+    completions = models.PositiveIntegerField(default=0)
+
+    objects = DailyStatsManager()
+
+    class Meta:
+        abstract = True
+
+
+class DailyCourseStats(DailyStats):
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='daily_stats')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['course', 'day'], name='unique_daily_course_stats'),
+        ]
+
+    def __str__(self):
+        return f"Course {self.course_id} on {self.day}: {self.enrollments} enrolled, {self.completions} completed"
+
+
+class DailyTeacherStats(DailyStats):
+    """All of a teacher's courses together."""
+    teacher = models.ForeignKey(Teacher, on_delete=models.CASCADE, related_name='daily_stats')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['teacher', 'day'], name='unique_daily_teacher_stats'),
+        ]
+
+    def __str__(self):
+        return f"Teacher {self.teacher_id} on {self.day}: {self.enrollments} enrolled, {self.completions} completed"
+
+
+def record_daily_activity(day, course_id, teacher_id, enrollments=0, completions=0):
+    """Count enrollments/completions of a course on `day` in both rollups (negative: uncount)."""
+    DailyCourseStats.objects.add(day, enrollments, completions, course_id=course_id)
+    DailyTeacherStats.objects.add(day, enrollments, completions, teacher_id=teacher_id)
+
+
+def rebuild_daily_stats(start=None, end=None):
+    """
+    Recount the daily rollups from Enrollment.enrollment_date and
+    Progress.completion_date for days in [start, end] (open ends: all days).
+    Archived courses keep their rows, since their enrollments are gone.
+    The rollup rows in range are locked first, so enrollments and completions
+    counted while this runs wait for it instead of being overwritten.
+    Returns the number of course rows written.
+    """
+    def in_range(queryset, field):
+        if start:
+            queryset = queryset.filter(**{f'{field}__gte': start})
+        if end:
+            queryset = queryset.filter(**{f'{field}__lte': end})
+        return queryset
+
+    with transaction.atomic(using=router.db_for_write(DailyCourseStats)):
+        list(in_range(DailyCourseStats.objects.select_for_update(), 'day').values_list('pk', flat=True))
+        list(in_range(DailyTeacherStats.objects.select_for_update(), 'day').values_list('pk', flat=True))
+
+        counts = {}
+        enrollments = (
+            in_range(Enrollment.objects.all(), 'enrollment_date')
+            .values('course_id', 'enrollment_date').annotate(n=Count('pk')).order_by()
+            .values_list('course_id', 'enrollment_date', 'n')
+        )
+        for course_id, day, n in enrollments:
+            counts.setdefault((course_id, day), [0, 0])[0] = n
+        completions = (
+            in_range(Progress.objects.filter(is_completed=True, completion_date__isnull=False), 'completion_date')
+            .values('course_id', 'completion_date').annotate(n=Count('pk')).order_by()
+            .values_list('course_id', 'completion_date', 'n')
+        )
+        for course_id, day, n in completions:
+            counts.setdefault((course_id, day), [0, 0])[1] = n
+
+        in_range(DailyCourseStats.objects.filter(course__archive__isnull=True), 'day').delete()
+        DailyCourseStats.objects.bulk_create(
+            DailyCourseStats(course_id=course_id, day=day, enrollments=enrolled, completions=completed)
+            for (course_id, day), (enrolled, completed) in counts.items()
+        )
+        # Teachers: the sum of their courses' rows, archived courses included
+        in_range(DailyTeacherStats.objects.all(), 'day').delete()
+        teacher_rows = (
+            in_range(DailyCourseStats.objects.all(), 'day')
+            .values('course__teacher_id', 'day')
+            .annotate(enrolled=models.Sum('enrollments'), completed=models.Sum('completions')).order_by()
+            .values_list('course__teacher_id', 'day', 'enrolled', 'completed')
+        )
+        DailyTeacherStats.objects.bulk_create(
+            DailyTeacherStats(teacher_id=teacher_id, day=day, enrollments=enrolled, completions=completed)
+            for teacher_id, day, enrolled, completed in teacher_rows
+        )
+    return len(counts)
@@ -0,0 +1,101 @@
+"""
+Delivery side of the transactional outbox (models.OutboxEvent).
+
+`relay()` reads undelivered events in id order, hands them to a sink one page
+of OUTBOX_BATCH_SIZE at a time, and marks the page delivered only after the
+sink returned. A relay that dies in between sends the page again on its next
+run, so delivery is at-least-once: consumers drop duplicates by event id.
+
+Run one relay per database (`manage.py relay_outbox`): two relays would send
+the same pages. Events committed by a slow transaction can arrive after events
+with a higher id; within one aggregate (e.g. progress:12) the order holds,
+since the row lock serializes its writes.
+
+A sink is any object with a `send(messages)` method that raises on failure.
+"""
+import json
+import os
+import sys
+import urllib.request
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.module_loading import import_string
+from django.utils.timezone import now
+
+from api.models import OutboxEvent
+
+
+def _dumps(message):
+    return json.dumps(message, cls=DjangoJSONEncoder, separators=(',', ':'))
+
+
+class StdoutSink:
+    """One JSON line per event on stdout."""
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+
+    def send(self, messages):
+        self.stream.write(''.join(_dumps(message) + '\n' for message in messages))
+        self.stream.flush()
+
+
+class FileSink:
+    """Appends one JSON line per event to `path`, fsynced before the page counts as delivered."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, messages):
+        with open(self.path, 'a') as file:
+            file.write(''.join(_dumps(message) + '\n' for message in messages))
+            file.flush()
+            os.fsync(file.fileno())
+
+
+class HttpSink:
+    """POSTs each page as {"events": [...]} to `url`; any non-2xx response fails the page."""
+
+    def __init__(self, url, timeout=None):
+        self.url = url
+        self.timeout = timeout or settings.OUTBOX_HTTP_TIMEOUT
+
+    def send(self, messages):
+        request = urllib.request.Request(
+            self.url, data=_dumps({'events': messages}).encode(), method='POST',
+            headers={'Content-Type': 'application/json'},
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:  # Raises HTTPError on 4xx/5xx
+            response.read()
+
+
+def get_sink(spec, stdout=None):
+    """'stdout', 'file:<path>', 'http(s)://...' or the dotted path of a sink class."""
+    if spec == 'stdout':
+        return StdoutSink(stdout)
+    if spec.startswith('file:'):
+        return FileSink(spec[len('file:'):])
+    if spec.startswith(('http://', 'https://')):
+        return HttpSink(spec)
+    return import_string(spec)()
+
+
+def relay(sink, batch_size=None, max_batches=None, events=None):
+    """
+    Deliver pending events (of the `events` queryset, default all) to `sink`
+    page by page; returns how many were sent.
+    """
+    batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+    pending = (OutboxEvent.objects.all() if events is None else events).filter(delivered_at__isnull=True)
+    sent = batches = 0
+    while max_batches is None or batches < max_batches:
+        page = list(pending.order_by('id')[:batch_size])
+        if not page:
+            break
+        sink.send([event.as_message() for event in page])
+        OutboxEvent.objects.filter(pk__in=[event.pk for event in page]).update(delivered_at=now())
+        sent += len(page)
+        batches += 1
+    return sent
+
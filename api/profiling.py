@@ -0,0 +1,161 @@
+"""
+Request profiling and slow-query logging.
+
+ProfilingMiddleware logs every query slower than SLOW_QUERY_MS (a sample of
+them, SLOW_QUERY_SAMPLE_RATE) with the line of app code that ran it.
+
+Staff can profile a single request by sending the PROFILE_HEADER header: the
+request runs under cProfile with every query traced, and the results are saved
+in PROFILE_ROOT as <id>.pstats (open with `python -m pstats`) and <id>.json
+(SQL trace and hottest functions). The response carries the download URLs.
+"""
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import sys
+import time
+import uuid
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.urls import reverse
+
+logger = logging.getLogger('api.slow_queries')
+
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+_PROJECT_DIR = os.path.dirname(_APP_DIR)
+
+
+def query_origin():
+    """file:line (function) of the innermost project frame that ran the query."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(_PROJECT_DIR) and not filename.startswith(_APP_DIR + os.sep + 'profiling'):
+            path = os.path.relpath(filename, _PROJECT_DIR)
+            return f"{path}:{frame.f_lineno} ({frame.f_code.co_name})"
+        frame = frame.f_back
+    return None
+
+
+class SlowQueryLogger:
+    """execute_wrapper that logs queries slower than SLOW_QUERY_MS."""
+
+    def __init__(self, request):
+        self.request = request
+        self.threshold = settings.SLOW_QUERY_MS
+        self.sample_rate = settings.SLOW_QUERY_SAMPLE_RATE
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = (time.perf_counter() - start) * 1000
+            if duration >= self.threshold and random.random() < self.sample_rate:
+                logger.warning(
+                    "Slow query (%.1f ms) on %s %s from %s: %s",
+                    duration, self.request.method, self.request.path, query_origin(), sql,
+                )
+
+
+class QueryTracer:
+    """execute_wrapper that records every query with its timing and origin."""
+
+    def __init__(self, alias):
+        self.alias = alias
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'alias': self.alias,
+                'sql': sql,
+                'params': repr(params)[:500],
+                'many': many,
+                'ms': round((time.perf_counter() - start) * 1000, 3),
+                'origin': query_origin(),
+            })
+
+
+def is_staff_request(request):
+    """Staff check that also accepts a JWT, since DRF authenticates after middleware."""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user.is_staff
+    from rest_framework.exceptions import AuthenticationFailed
+    from rest_framework_simplejwt.authentication import JWTAuthentication
+    try:
+        result = JWTAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return False
+    return bool(result and result[0].is_staff)
+
+
+def save_profile(profile_id, request, response, profiler, tracers, duration):
+    """Write <id>.pstats and <id>.json to PROFILE_ROOT."""
+    os.makedirs(settings.PROFILE_ROOT, exist_ok=True)
+    base = os.path.join(settings.PROFILE_ROOT, profile_id)
+    profiler.dump_stats(base + '.pstats')
+
+    summary = io.StringIO()
+    pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(30)
+    queries = sorted((query for tracer in tracers for query in tracer.queries), key=lambda query: -query['ms'])
+    trace = {
+        'id': profile_id,
+        'method': request.method,
+        'path': request.get_full_path(),
+        'status': response.status_code,
+        'duration_ms': round(duration * 1000, 3),
+        'query_count': len(queries),
+        'query_ms': round(sum(query['ms'] for query in queries), 3),
+        'queries': queries,
+        'functions': summary.getvalue(),
+    }
+    with open(base + '.json', 'w') as file:
+        json.dump(trace, file, indent=2)
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.headers.get(settings.PROFILE_HEADER) and is_staff_request(request):
+            return self.profile(request)
+
+        with ExitStack() as stack:
+            slow_queries = SlowQueryLogger(request)
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(slow_queries))
+            return self.get_response(request)
+
+    def profile(self, request):
+        profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        tracers = [QueryTracer(alias) for alias in connections]
+        profiler = cProfile.Profile()
+
+        with ExitStack() as stack:
+            for tracer in tracers:
+                stack.enter_context(connections[tracer.alias].execute_wrapper(tracer))
+            start = time.perf_counter()
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+            duration = time.perf_counter() - start
+
+        save_profile(profile_id, request, response, profiler, tracers, duration)
+        response['X-Profile-Id'] = profile_id
+        response['X-Profile-Pstats'] = reverse('profile-artifact', args=[profile_id + '.pstats'])
+        response['X-Profile-Trace'] = reverse('profile-artifact', args=[profile_id + '.json'])
+        return response
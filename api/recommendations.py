@@ -0,0 +1,89 @@
+"""
+Co-enrollment recommendations ("students who took this also took").
+
+Enrollments form a sparse student x course matrix, where a completed course
+(Progress.is_completed) weighs more than a plain enrollment. Item-item cosine
+similarity is one sparse matrix product over the column-normalized matrix, and
+the top-K neighbours of every course are stored in CourseRecommendation.
+
+NumPy and SciPy are only needed to build the table (`manage.py build_recommendations`),
+serving recommendations is a single indexed query.
+"""
+from itertools import chain
+
+from django.db import router, transaction
+
+from api.models import CourseRecommendation, Enrollment, Progress
+
+
+def load_pairs(queryset, chunk_size=50000):
+    """(student_id, course_id) rows as an (n, 2) int64 array, without a list of tuples in between."""
+    import numpy as np
+
+    rows = queryset.values_list('student_id', 'course_id').order_by().iterator(chunk_size=chunk_size)
+    return np.fromiter(chain.from_iterable(rows), dtype=np.int64).reshape(-1, 2)
+
+
+def similar_courses(enrolled, completed, top_k=10, completed_weight=2.0):
+    """
+    Top-K most similar courses for every course.
+
+    `enrolled` and `completed` are (n, 2) arrays of (student_id, course_id).
+    Returns (course_ids, neighbour_ids, scores): neighbour_ids and scores are
+    (courses, top_k) arrays sorted by score, with -1 / 0.0 padding.
+    """
+    import numpy as np
+    from scipy import sparse
+
+    pairs = np.concatenate([enrolled, completed])
+    weights = np.concatenate([
+        np.ones(len(enrolled)),
+        np.full(len(completed), completed_weight - 1.0),  # Adds up to completed_weight with the enrollment
+    ])
+    student_ids, rows = np.unique(pairs[:, 0], return_inverse=True)
+    course_ids, columns = np.unique(pairs[:, 1], return_inverse=True)
+    matrix = sparse.csr_matrix((weights, (rows, columns)), shape=(len(student_ids), len(course_ids)))
+
+    # Cosine similarity: normalize the course columns, then one sparse product
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0))).ravel()
+    normalized = matrix @ sparse.diags(1.0 / np.maximum(norms, 1e-12))
+    similarity = (normalized.T @ normalized).tocsr()
+    similarity.setdiag(0)
+    similarity.eliminate_zeros()
+
+    neighbours = np.full((len(course_ids), top_k), -1, dtype=np.int64)
+    scores = np.zeros((len(course_ids), top_k))
+    for row in range(len(course_ids)):
+        start, end = similarity.indptr[row], similarity.indptr[row + 1]
+        if start == end:
+            continue
+        row_scores = similarity.data[start:end]
+        row_columns = similarity.indices[start:end]
+        keep = min(top_k, len(row_scores))
+        best = np.argpartition(-row_scores, keep - 1)[:keep]
+        # Highest score first, ties broken by course id for stable output
+        best = best[np.lexsort((course_ids[row_columns[best]], -row_scores[best]))]
+        neighbours[row, :keep] = course_ids[row_columns[best]]
+        scores[row, :keep] = row_scores[best]
+    return course_ids, neighbours, scores
+
+
+def build_recommendations(top_k=10, completed_weight=2.0, batch_size=5000):
+    """Recompute CourseRecommendation from the current enrollments. Returns the rows stored."""
+    enrolled = load_pairs(Enrollment.objects.all())
+    completed = load_pairs(Progress.objects.filter(is_completed=True))
+    if not len(enrolled):
+        CourseRecommendation.objects.all().delete()
+        return 0
+
+    course_ids, neighbours, scores = similar_courses(enrolled, completed, top_k, completed_weight)
+    recommendations = (
+        CourseRecommendation(course_id=int(course_id), recommended_id=int(neighbour), rank=rank + 1, score=float(score))
+        for course_id, row_neighbours, row_scores in zip(course_ids, neighbours, scores)
+        for rank, (neighbour, score) in enumerate(zip(row_neighbours, row_scores))
+        if neighbour != -1
+    )
+    with transaction.atomic(using=router.db_for_write(CourseRecommendation)):
+        CourseRecommendation.objects.all().delete()
+        created = CourseRecommendation.objects.bulk_create(recommendations, batch_size=batch_size)
+    return len(created)
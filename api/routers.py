@@ -0,0 +1,79 @@
+"""
+Primary/replica database routing.
+
+Reads go to a replica only inside views marked with @replica_reads (and only
+for GET/HEAD). Once anything in the request writes, the rest of the request
+reads from the primary so it sees its own writes.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# (replica reads allowed, pinned to primary) for the current request
+_routing = ContextVar('db_routing', default=(False, False))
+
+
+def replica_reads(view):
+    """Mark a view (function or class) as safe to serve its GET requests from a replica."""
+    view.read_replica = True
+    return view
+
+
+@contextmanager
+def use_replicas(enabled=True):
+    """Allow replica reads for the block; a write inside it pins reads back to the primary."""
+    token = _routing.set((enabled, False))
+    try:
+        yield
+    finally:
+        _routing.reset(token)
+
+
+def pin_to_primary():
+    enabled, _ = _routing.get()
+    _routing.set((enabled, True))
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        enabled, pinned = _routing.get()
+        replicas = settings.REPLICA_DATABASES
+        if not enabled or pinned or not replicas:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS  # Reads inside a transaction must see its writes
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        pin_to_primary()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.REPLICA_DATABASES}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    """Enable replica reads for safe requests to views marked with @replica_reads."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = _routing.set((False, False))
+        try:
+            return self.get_response(request)
+        finally:
+            _routing.reset(token)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+        marked = getattr(view_func, 'read_replica', False) or getattr(view_class, 'read_replica', False)
+        if marked and request.method in ('GET', 'HEAD'):
+            _routing.set((True, False))
+        return None
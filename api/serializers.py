@@ -1,15 +1,73 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
 from .models import (
     Teacher, Student, Course, Enrollment,
     Assignment, Announcement, CourseFile,
     Progress, Certificate
 )
+from .images import ValidatedImageField, process_image_later
 
 User = get_user_model()
 
 
+def sparse_params(request):
+    """Read ?fields=a,b and ?expand=c from the request (None when not given)."""
+    params = []
+    for name in ('fields', 'expand'):
+        value = request.query_params.get(name)
+        params.append(None if value is None else {item.strip() for item in value.split(',') if item.strip()})
+    return params
+
+
+class SparseFieldsMixin:
+    """
+    Lets a serializer return only the requested fields (`fields`) and embed only
+    the requested relations (`expand`, from Meta.expandable_fields).
+    Without either argument the serializer returns everything, as before.
+
+    sparse_queryset() applies the same selection to the ORM query: only() the
+    columns that are rendered and prefetch only the expanded relations.
+    """
+
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is None and expand is None:
+            return
+        expandable = set(getattr(self.Meta, 'expandable_fields', {}))
+        keep = set(fields) if fields is not None else set(self.fields) - expandable
+        keep |= set(expand or ()) & expandable
+        for name in list(self.fields):
+            if name not in keep:
+                self.fields.pop(name)
+
+    def sparse_queryset(self, queryset):
+        model = queryset.model
+        expandable = getattr(self.Meta, 'expandable_fields', {})
+        columns, related, prefetches = {model._meta.pk.name}, set(), []
+
+        for name, field in self.fields.items():
+            if name in expandable:
+                prefetches.append(expandable[name])
+                continue
+            # Method fields (source '*') are expected to be named after the column they render
+            path = (name if field.source == '*' else field.source).split('.')
+            try:
+                model_field = model._meta.get_field(path[0])
+            except FieldDoesNotExist:
+                continue
+            if not model_field.concrete or model_field.many_to_many:
+                continue
+            if len(path) > 1 and model_field.is_relation:
+                related.add(path[0])
+                columns.add('__'.join(path[:2]))
+            columns.add(path[0])
+
+        return queryset.select_related(*related).only(*columns).prefetch_related(*prefetches)
+
+
 class UserSerializer(serializers.ModelSerializer):
     profile_pic = serializers.SerializerMethodField()
 
@@ -36,7 +94,7 @@ class StudentSerializer(serializers.ModelSerializer):
 class RegisterSerializer(serializers.ModelSerializer):
     role = serializers.ChoiceField(choices=['teacher', 'student'], write_only=True)
     password = serializers.CharField(write_only=True, style={'input_type': 'password'})
-    profile_pic = serializers.ImageField(required=False, allow_null=True)  # ✅ Add profile_pic field
+    profile_pic = ValidatedImageField(required=False, allow_null=True)  # ✅ Size/pixel limits checked from the header
 
     # Fields for teacher
     experience = serializers.IntegerField(required=False)
@@ -83,6 +141,7 @@ class RegisterSerializer(serializers.ModelSerializer):
         if profile_pic:
             user.profile_pic = profile_pic
             user.save()
+            process_image_later(user, 'profile_pic')  # EXIF strip + resize off the request
 
         # Create the Teacher or Student profile
         if role == 'teacher':
@@ -184,13 +243,13 @@ class AssignmentSerializer(serializers.ModelSerializer):
 
 
 # ✅ Serializer for basic course details
-class BasicCourseSerializer(serializers.ModelSerializer):
+class BasicCourseSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Course
         fields = ['id', 'title', 'description', 'start_date', 'end_date', 'total_lessons', 'thumbnail']
 
 # ✅ Serializer for full course details (if enrolled)
-class CourseDetailSerializer(serializers.ModelSerializer):
+class CourseDetailSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     files = serializers.SerializerMethodField()
     assignments = serializers.SerializerMethodField()
     announcements = serializers.SerializerMethodField()
@@ -198,6 +257,12 @@ class CourseDetailSerializer(serializers.ModelSerializer):
     class Meta:
         model = Course
         fields = ['id', 'title', 'description', 'start_date', 'end_date', 'total_lessons', 'thumbnail', 'files', 'assignments', 'announcements']
+        # Relations embedded only when requested with ?expand= (or when no selection is given)
+        expandable_fields = {
+            'files': Prefetch('files', queryset=CourseFile.objects.only('id', 'course', 'title', 'file')),
+            'assignments': Prefetch('assignments', queryset=Assignment.objects.only('id', 'course', 'title', 'description', 'due_date')),
+            'announcements': Prefetch('announcements', queryset=Announcement.objects.only('id', 'course', 'title', 'message', 'created_at')),
+        }
 
     def get_files(self, obj):
         request = self.context.get('request')
@@ -209,7 +274,7 @@ class CourseDetailSerializer(serializers.ModelSerializer):
     def get_announcements(self, obj):
         return [{"id": announcement.id, "title": announcement.title, "message": announcement.message, "created_at": announcement.created_at} for announcement in obj.announcements.all()]
 
-class CourseSerializer(serializers.ModelSerializer):
+class CourseSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     thumbnail = serializers.SerializerMethodField()  # ✅ Ensure full image URL
 
     class Meta:
@@ -222,7 +287,7 @@ class CourseSerializer(serializers.ModelSerializer):
             return request.build_absolute_uri(obj.thumbnail.url)  # ✅ Return full URL
         return None
     
-class TeacherCourseSerializer(serializers.ModelSerializer):
+class TeacherCourseSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     thumbnail = serializers.SerializerMethodField()
     course_id = serializers.ReadOnlyField(source='id')  
 
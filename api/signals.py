@@ -1,19 +1,101 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_delete
 from django.dispatch import receiver
-from .models import Progress
+from .cache import bump_model_version
+from .models import (
+    Progress, Enrollment, Certificate, progress_completed,
+    Course, Assignment, Announcement, CourseFile, OutboxEvent, DailyTeacherStats, record_daily_activity
+)
 
+@receiver(progress_completed, sender=Progress)
+def create_certificate(sender, student_id, course_id, **kwargs):
+    """Generate a certificate when a student who is enrolled in the course completes it."""
+    is_enrolled = Enrollment.objects.filter(student_id=student_id, course_id=course_id).exists()
+
+    if is_enrolled:
+        certificate, created = Certificate.objects.get_or_create(
+            student_id=student_id,
+            course_id=course_id
+        )
+        if created:
+            certificate.generate_certificate()
+
+
+# Daily rollups (DailyCourseStats, DailyTeacherStats) follow the rows as they are created,
+# completed and deleted; `manage.py backfill_daily_stats` recounts them from the source rows
+@receiver(post_save, sender=Enrollment)
+def count_enrollment(sender, instance, created, **kwargs):
+    if created:
+        record_daily_activity(
+            instance.enrollment_date, instance.course_id, instance.course.teacher_id, enrollments=1
+        )
+
+
+@receiver(progress_completed, sender=Progress)
+def count_completion(sender, course_id, completion_date=None, **kwargs):
+    teacher_id = Course.objects.filter(pk=course_id).values_list('teacher_id', flat=True).first()
+    if teacher_id is not None and completion_date is not None:
+        record_daily_activity(completion_date, course_id, teacher_id, completions=1)
+
+
+@receiver(post_delete, sender=Enrollment)
+def uncount_enrollment(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Course):
+        return  # uncount_course() takes the whole course off
+    teacher_id = Course.objects.filter(pk=instance.course_id).values_list('teacher_id', flat=True).first()
+    if teacher_id is not None:
+        record_daily_activity(instance.enrollment_date, instance.course_id, teacher_id, enrollments=-1)
+
+
+@receiver(post_delete, sender=Progress)
+def uncount_completion(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Course) or not instance.is_completed or instance.completion_date is None:
+        return
+    teacher_id = Course.objects.filter(pk=instance.course_id).values_list('teacher_id', flat=True).first()
+    if teacher_id is not None:
+        record_daily_activity(instance.completion_date, instance.course_id, teacher_id, completions=-1)
+
+
+@receiver(pre_delete, sender=Course)
+def uncount_course(sender, instance, **kwargs):
+    # The course rows go with the course; its teacher's rows lose what the course added
+    for day, enrolled, completed in instance.daily_stats.values_list('day', 'enrollments', 'completions'):
+        DailyTeacherStats.objects.add(day, -enrolled, -completed, teacher_id=instance.teacher_id)
+
+
+# Outbox events (see api.outbox): Progress.save() and Certificate.save() run these
+# receivers inside their transaction, so an event exists exactly when the change committed
 @receiver(post_save, sender=Progress)
-def create_certificate(sender, instance, **kwargs):
-    """Generate a certificate only if the student is enrolled in the course and has completed it."""
-    if instance.is_completed:
-        from .models import Enrollment, Certificate  # Import inside function to avoid circular import
-
-        is_enrolled = Enrollment.objects.filter(student=instance.student, course=instance.course).exists()
-        
-        if is_enrolled:
-            certificate, created = Certificate.objects.get_or_create(
-                student=instance.student,
-                course=instance.course
-            )
-            if created:
-                certificate.generate_certificate()
+def record_progress_event(sender, instance, created, **kwargs):
+    if getattr(instance, '_outbox_pending', True):
+        OutboxEvent.objects.record(
+            'progress.created' if created else 'progress.updated', instance,
+            progress_id=instance.pk, student_id=instance.student_id, course_id=instance.course_id,
+            completed_lessons=instance.completed_lessons, total_lessons=instance.total_lessons,
+            is_completed=instance.is_completed,
+        )
+
+
+@receiver(post_save, sender=Certificate)
+def record_certificate_event(sender, instance, created, **kwargs):
+    if created:
+        OutboxEvent.objects.record(
+            'certificate.issued', instance,
+            certificate_id=instance.pk, student_id=instance.student_id,
+            course_id=instance.course_id, date_issued=instance.date_issued,
+        )
+
+
+# Models whose changes invalidate cached API reads (see cache.cached_read)
+CACHED_MODELS = (Course, Enrollment, Assignment, Announcement, CourseFile)
+
+def bump_cache_version(sender, instance, **kwargs):
+    bump_model_version(sender)
+    # Again on commit: a read cached by another request while this transaction was open saw the old rows
+    using = instance._state.db
+    if transaction.get_connection(using).in_atomic_block:
+        transaction.on_commit(lambda: bump_model_version(sender), using=using)
+
+for model in CACHED_MODELS:
+    post_save.connect(bump_cache_version, sender=model, dispatch_uid=f"cache-version-save-{model.__name__}")
+    post_delete.connect(bump_cache_version, sender=model, dispatch_uid=f"cache-version-delete-{model.__name__}")
@@ -0,0 +1,139 @@
+"""
+Multi-school tenancy.
+
+Each school (tenant) listed in settings.TENANTS has its own database alias,
+which can be a separate database or a Postgres schema (search_path in the
+URL). TenantMiddleware resolves the tenant of a request from its hostname
+(TENANT_HOSTS) or, on shared hostnames, from the TENANT_CLAIM claim of the
+JWT; LoginView writes that claim into the tokens it issues. While a tenant is
+active, TenantRouter sends the TENANT_APPS models to its database and cache
+keys get the tenant as a prefix. Requests without a tenant use 'default'.
+
+Management commands: `migrate_tenants` creates or updates the tenant
+databases, `move_tenant` moves a school's rows to another database and
+`tenant_command` runs any command for one school.
+"""
+import json
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.http import JsonResponse
+from django.urls import reverse
+
+# (tenant slug, database alias) for the current request or command
+_tenant = ContextVar('tenant', default=(None, None))
+
+
+def current_tenant():
+    return _tenant.get()[0]
+
+
+def tenant_database(tenant):
+    return settings.TENANTS.get(tenant, DEFAULT_DB_ALIAS) if tenant else DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def use_tenant(tenant, database=None):
+    """Route the block to `tenant`'s database (or `database`, e.g. while moving it)."""
+    token = _tenant.set((tenant, database or tenant_database(tenant)))
+    try:
+        yield
+    finally:
+        _tenant.reset(token)
+
+
+class TenantRouter:
+    """Goes before PrimaryReplicaRouter: tenant reads and writes both use the tenant's database."""
+
+    def _database(self, model):
+        tenant, database = _tenant.get()
+        if tenant and model._meta.app_label in settings.TENANT_APPS:
+            return database
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self._database(model)
+
+    def db_for_write(self, model, **hints):
+        return self._database(model)
+
+
+def make_cache_key(key, key_prefix, version):
+    """Cache KEY_FUNCTION: the default key format, with the tenant in front of the key."""
+    tenant = current_tenant()
+    return f"{key_prefix}:{version}:{tenant}:{key}" if tenant else f"{key_prefix}:{version}:{key}"
+
+
+def token_tenant(request):
+    """
+    (has_token, tenant claim) of the request's JWT: the Authorization header,
+    or the refresh token posted to the token refresh endpoint. Invalid tokens
+    count as none, DRF rejects them later.
+    """
+    from rest_framework_simplejwt.authentication import JWTAuthentication
+    from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+    from rest_framework_simplejwt.tokens import RefreshToken
+
+    authentication = JWTAuthentication()
+    header = authentication.get_header(request)
+    raw = authentication.get_raw_token(header) if header else None
+    try:
+        if raw is not None:
+            token = authentication.get_validated_token(raw)
+        elif request.method == 'POST' and request.path == reverse('token_refresh'):
+            raw = request.POST.get('refresh') or _json_field(request, 'refresh')
+            if not raw:
+                return False, None
+            token = RefreshToken(raw)
+        else:
+            return False, None
+    except (InvalidToken, TokenError):
+        return False, None
+    return True, token.get(settings.TENANT_CLAIM)
+
+
+def _json_field(request, name):
+    if request.content_type != 'application/json':
+        return None
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return None
+    return data.get(name) if isinstance(data, dict) else None
+
+
+def resolve_tenant(request):
+    """The request's tenant slug (None: no tenant). Raises PermissionError when host and token disagree."""
+    host_tenant = settings.TENANT_HOSTS.get(request.get_host().split(':')[0].lower())
+    has_token, claim = token_tenant(request) if settings.TENANTS else (False, None)
+    if has_token and host_tenant and claim != host_tenant:
+        raise PermissionError("This token belongs to another school.")
+    tenant = host_tenant or claim
+    if tenant and tenant not in settings.TENANTS:
+        raise PermissionError("Unknown school.")
+    return tenant
+
+
+class TenantMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            tenant = resolve_tenant(request)
+        except PermissionError as exc:
+            return JsonResponse({"error": str(exc)}, status=403)
+        request.tenant = tenant
+        with use_tenant(tenant):
+            response = self.get_response(request)
+        if response.streaming:
+            # Streamed bodies (zips, archives) are produced after this returns
+            response.streaming_content = _stream_in_tenant(tenant, response.streaming_content)
+        return response
+
+
+def _stream_in_tenant(tenant, content):
+    with use_tenant(tenant):
+        yield from content
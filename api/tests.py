@@ -1,3 +1,1790 @@
-from django.test import TestCase
+import gzip
+import importlib.util
+import json
+import os
+import pstats
+import re
+import tempfile
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import BytesIO, StringIO
+import threading
+import urllib.error
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import CommandError, call_command
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, connection, connections, transaction
+from django.db.models import F, QuerySet
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.contrib.sessions.models import Session
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.translation import gettext_lazy
+from PIL import Image
+from rest_framework.exceptions import Throttled
+from rest_framework.renderers import JSONRenderer
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import urls as api_urls
+from .archive import ARCHIVED_MODELS, ArchivedRowError, archive_course, archived_rows, table_sizes
+from .cache import LRUMemoryCache, bump_model_version, cached_read, check_shared_cache, model_versions
+from .idempotency import record_key, request_fingerprint
+from .images import normalize_image, process_image_later, submit_image
+from .outbox import FileSink, HttpSink, relay
+from .recommendations import build_recommendations
+from .tenants import TenantRouter, current_tenant, use_tenant
+from .views import can_access_media
+from .management.commands.startup_profile import profile_imports
+from .routers import PrimaryReplicaRouter, use_replicas
+from .renderers import FastJSONParser, FastJSONRenderer
+from .models import (
+    User, Teacher, Student, Course, Enrollment, Assignment,
+    Announcement, CourseFile, Progress, Certificate, LessonCompletion,
+    RateLimitCounter, CourseRecommendation, ProgressBucket, CourseArchive, IdempotencyRecord,
+    OutboxEvent, DailyCourseStats, DailyTeacherStats, WaitlistEntry, enroll_student, upsert_counter
+)
+
+
+def make_user(username, password=None, **kwargs):
+    return User.objects.create_user(
+        username=username, email=f"{username}@example.com",
+        mobile_number=username[-15:], password=password, **kwargs
+    )
+
+
+def make_teacher(username):
+    return Teacher.objects.create(user=make_user(username))
+
+
+def make_student(username):
+    return Student.objects.create(user=make_user(username), enrollment_year=2024, grade="10")
+
+
+def make_course(teacher, title="Course", total_lessons=10):
+    return Course.objects.create(
+        teacher=teacher, title=title, start_date=date(2024, 1, 1),
+        end_date=date(2024, 12, 31), total_lessons=total_lessons
+    )
+
+
+def auth_header(user):
+    return {"HTTP_AUTHORIZATION": f"Bearer {RefreshToken.for_user(user).access_token}"}
+
+
+def seed_courses(count, prefix="seed"):
+    """Create `count` courses, each with its own teacher, student, enrollment and course content."""
+    for i in range(count):
+        teacher = make_teacher(f"{prefix}t{i}")
+        student = make_student(f"{prefix}s{i}")
+        course = make_course(teacher, title=f"{prefix} course {i}")
+        Enrollment.objects.create(student=student, course=course)
+        Assignment.objects.create(course=course, title="Homework", description="Read", due_date=date(2024, 6, 1))
+        Announcement.objects.create(course=course, title="Welcome", message="Hello")
+        CourseFile.objects.create(course=course, title="Notes", file=f"course_files/{prefix}{i}.pdf")
+        Certificate.objects.create(student=student, course=course)
+        LessonCompletion.objects.create(progress=Progress.objects.get(student=student, course=course), lesson_number=1)
+
+
+class AdminChangelistQueryCountTests(TestCase):
+    """Admin changelists must not run extra queries per row."""
+
+    models = [
+        User, Teacher, Student, Course, Enrollment, Assignment,
+        Announcement, CourseFile, Progress, Certificate, LessonCompletion
+    ]
+
+    def setUp(self):
+        admin_user = make_user("admin", is_staff=True, is_superuser=True)
+        self.client.force_login(admin_user)
+
+    def changelist_queries(self, model):
+        url = reverse(f"admin:api_{model._meta.model_name}_changelist")
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx)
+
+    def test_changelist_query_count_is_constant(self):
+        seed_courses(2, prefix="a")
+        before = {model: self.changelist_queries(model) for model in self.models}
+        seed_courses(8, prefix="b")
+        for model in self.models:
+            with self.subTest(model=model.__name__):
+                self.assertEqual(self.changelist_queries(model), before[model])
+
+    def test_prefix_search(self):
+        seed_courses(2)
+        url = reverse("admin:api_enrollment_changelist")
+        response = self.client.get(url, {"q": "seeds1"})
+        self.assertEqual(response.context["cl"].result_count, 1)
+
+
+@mock.patch.object(Certificate, "generate_certificate")
+class ProgressCompletionTests(TestCase):
+    """Completion work only happens on the incomplete -> complete transition."""
+
+    def setUp(self):
+        self.course = make_course(make_teacher("teacher"), total_lessons=3)
+        self.student = make_student("student")
+        Enrollment.objects.create(student=self.student, course=self.course)
+        self.progress = Progress.objects.get(student=self.student, course=self.course)
+
+    def test_completion_date_is_kept(self, generate_certificate):
+        self.progress.completed_lessons = 3
+        self.progress.save()
+        Progress.objects.filter(pk=self.progress.pk).update(completion_date=date(2024, 1, 1))
+
+        progress = Progress.objects.get(pk=self.progress.pk)
+        progress.completed_lessons = 3
+        progress.save()
+        progress.refresh_from_db()
+        self.assertEqual(progress.completion_date, date(2024, 1, 1))
+        self.assertEqual(Certificate.objects.count(), 1)
+        generate_certificate.assert_called_once()
+
+    def test_ordinary_save_runs_no_extra_queries(self, generate_certificate):
+        self.progress.completed_lessons = 3
+        self.progress.save()
+        self.progress.completion_date = date(2024, 1, 1)
+        with self.assertNumQueries(1):
+            self.progress.save()
+
+    def test_lesson_edit_moves_histogram_without_completion_work(self, generate_certificate):
+        self.progress.completed_lessons = 3
+        self.progress.save()
+        self.progress.completed_lessons = 4
+        self.progress.save()
+        # Past completion, between existing buckets: the locked read of the old bucket, the row,
+        # its outbox event and the two buckets, in a savepoint; no certificate or completion queries
+        self.progress.completed_lessons = 3
+        with CaptureQueriesContext(connection) as queries:
+            self.progress.save()
+        self.assertEqual(len(queries), 7)
+        self.assertFalse(any("api_certificate" in query["sql"] for query in queries))
+        generate_certificate.assert_called_once()
+
+    def test_bulk_update_completes_and_issues_certificate(self, generate_certificate):
+        Progress.objects.filter(course=self.course).update(completed_lessons=F("completed_lessons") + 3)
+        self.progress.refresh_from_db()
+        self.assertTrue(self.progress.is_completed)
+        self.assertIsNotNone(self.progress.completion_date)
+        self.assertTrue(Certificate.objects.filter(student=self.student, course=self.course).exists())
+
+        # A second bulk update is not a new transition
+        Progress.objects.filter(course=self.course).update(completed_lessons=5)
+        generate_certificate.assert_called_once()
+
+    def test_bulk_update_only_completes_the_rows_it_updated(self, generate_certificate):
+        other = make_course(self.course.teacher, title="Other", total_lessons=1)
+        Enrollment.objects.create(student=self.student, course=other)
+        # Left pending by a write that skipped the completion hooks
+        QuerySet.update(Progress.objects.filter(course=other), completed_lessons=1)
+
+        Progress.objects.filter(course=self.course).update(completed_lessons=1)
+        self.assertFalse(Progress.objects.get(course=other).is_completed)
+        generate_certificate.assert_not_called()
+
+
+class CacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_lru_evicts_least_recently_used_by_size(self):
+        lru = LRUMemoryCache("test-lru", {"OPTIONS": {"MAX_BYTES": 300}})
+        lru.clear()
+        lru.set("a", "x" * 100)
+        lru.set("b", "x" * 100)
+        lru.get("a")  # "b" is now the least recently used
+        lru.set("c", "x" * 100)
+        self.assertIsNone(lru.get("b"))
+        self.assertIsNotNone(lru.get("a"))
+        stats = lru.stats()
+        self.assertEqual(stats["evictions"], 1)
+        self.assertLessEqual(stats["bytes"], 300)
+        self.assertEqual(stats["hits"], 2)
+        self.assertEqual(stats["misses"], 1)
+
+    def test_course_list_is_cached_until_a_course_changes(self):
+        teacher = make_teacher("teacher")
+        make_course(teacher, title="First")
+        self.assertEqual(len(self.client.get(reverse("all-courses")).json()), 1)
+        with self.assertNumQueries(0):
+            self.client.get(reverse("all-courses"))
+
+        make_course(teacher, title="Second")
+        self.assertEqual(len(self.client.get(reverse("all-courses")).json()), 2)
+
+    def test_versions_are_bumped_again_when_the_write_commits(self):
+        teacher = make_teacher("teacher")
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                make_course(teacher)
+                during = model_versions(Course)  # What a concurrent read would have cached under
+        self.assertNotEqual(model_versions(Course), during)
+
+    def test_fill_is_not_stored_when_a_write_lands_during_compute(self):
+        def compute_during_write():
+            bump_model_version(Course)
+            return "old"
+
+        self.assertEqual(cached_read("test-fill", [Course], compute_during_write), "old")
+        self.assertEqual(cached_read("test-fill", [Course], lambda: "new"), "new")
+        self.assertEqual(cached_read("test-fill", [Course], lambda: "newer"), "new")
+
+    def test_deploy_check_warns_about_a_per_process_cache(self):
+        self.assertEqual([warning.id for warning in check_shared_cache(None)], ["api.W001"])
+
+
+class RecordingVersions:
+    """Records every value written to a model version key."""
+
+    def set(self, key, value, *args, **kwargs):
+        if key.startswith("model-version:"):
+            self.written.append(value)
+        return super().set(key, value, *args, **kwargs)
+
+
+class RecordingFileCache(RecordingVersions, FileBasedCache):
+    pass
+
+
+class RedisStandInCache(RecordingVersions, LocMemCache):
+    """
+    Stands in for Redis: every instance with the same LOCATION shares one store,
+    like workers talking to one Redis server.
+    """
+
+
+class CacheVersionTests(SimpleTestCase):
+    """Version bumps from workers sharing one cache must each leave a new version behind."""
+
+    threads = 8
+
+    def assert_concurrent_bumps_are_distinct(self, make_worker):
+        workers = [make_worker(), make_worker()]
+        written = []
+        for worker in workers:
+            worker.written = written
+        barrier = threading.Barrier(self.threads)
+
+        def bump():
+            barrier.wait()
+            bump_model_version(Course)
+
+        with mock.patch("api.cache.cache", workers[0]):
+            before = model_versions(Course)
+            self.assertEqual(cached_read("test-workers", [Course], lambda: "old"), "old")
+            written.clear()
+            # Each thread bumps through the module-level cache, as request handlers do
+            threads = [threading.Thread(target=bump) for _ in range(self.threads)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(len(written), self.threads)
+            self.assertEqual(len(set(written)), self.threads)
+            self.assertNotIn(before[0], written)
+            self.assertEqual(cached_read("test-workers", [Course], lambda: "new"), "new")
+            after = model_versions(Course)
+
+        # A second worker on the same store sees the same version
+        with mock.patch("api.cache.cache", workers[1]):
+            self.assertEqual(model_versions(Course), after)
+        self.assertIn(after[0], written)
+
+    def test_file_backend(self):
+        location = tempfile.mkdtemp()
+        self.assert_concurrent_bumps_are_distinct(lambda: RecordingFileCache(location, {}))
+
+    def test_redis_stand_in(self):
+        self.assert_concurrent_bumps_are_distinct(lambda: RedisStandInCache("test-redis-stand-in", {}))
+
+
+@override_settings(REPLICA_DATABASES=["replica_0"])
+class ReplicaRouterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.router = PrimaryReplicaRouter()
+
+    def test_reads_use_primary_outside_marked_views(self):
+        self.assertEqual(self.router.db_for_read(Course), "default")
+
+    def test_reads_stick_to_primary_after_a_write(self):
+        with use_replicas():
+            # TestCase wraps each test in a transaction; routing ignores that here
+            with mock.patch.object(connection, "in_atomic_block", False):
+                self.assertEqual(self.router.db_for_read(Course), "replica_0")
+                self.assertEqual(self.router.db_for_write(Course), "default")
+                self.assertEqual(self.router.db_for_read(Course), "default")
+        with use_replicas(), mock.patch.object(connection, "in_atomic_block", False):
+            self.assertEqual(self.router.db_for_read(Course), "replica_0")
+
+    def test_middleware_enables_replicas_for_marked_get_views(self):
+        seen = []
+        original = PrimaryReplicaRouter.db_for_read
+
+        def record(router, model, **hints):
+            with mock.patch.object(connection, "in_atomic_block", False):
+                seen.append(original(router, model, **hints))
+            return "default"
+
+        with mock.patch.object(PrimaryReplicaRouter, "db_for_read", record):
+            self.client.get(reverse("course-recommendations", args=[1]))
+            self.assertIn("replica_0", seen)
+            seen.clear()
+            self.client.get(reverse("all-courses"))  # A cache fill
+            self.assertIn("replica_0", seen)
+            seen.clear()
+            self.client.post(reverse("login"), {"username": "nobody", "password": "x"})
+            self.assertNotIn("replica_0", seen)
+
+
+@skipUnless(settings.REPLICA_DATABASES, "set DATABASE_REPLICA_URLS to read from a real replica alias")
+class ReplicaDatabaseTests(TransactionTestCase):
+    """Run with e.g. DATABASE_REPLICA_URLS=sqlite:////tmp/r.db (in tests the replica mirrors 'default')."""
+    databases = "__all__"
+
+    def test_catalog_is_read_from_the_replica(self):
+        cache.clear()
+        make_course(make_teacher("teacher"), title="Algebra")
+        replica = settings.REPLICA_DATABASES[0]
+        with override_settings(REPLICA_DATABASES=[replica]), CaptureQueriesContext(connections[replica]) as queries:
+            response = self.client.get(reverse("all-courses"))
+        self.assertEqual([course["title"] for course in response.json()], ["Algebra"])
+        self.assertTrue(any('FROM "api_course"' in query["sql"] for query in queries))
+
+
+class StartupImportTests(SimpleTestCase):
+    """Cold start: the WSGI app and its first request stay within budget and skip rarely used dependencies."""
+
+    def test_first_request_imports_within_budget_and_defers_rare_modules(self):
+        then = "from django.urls import resolve; resolve(%r)" % reverse("token_refresh")
+        wall_ms, imports, loaded = profile_imports("cms_backend.wsgi", then)
+        self.assertIn("api.views", loaded)  # The URLconf really was loaded
+        self.assertLess(wall_ms, settings.STARTUP_IMPORT_BUDGET_MS)
+        # Certificates, the refresh endpoint's first call and build_recommendations import these
+        for module in ("PIL", "rest_framework_simplejwt.views", "numpy"):
+            self.assertNotIn(module, loaded)
+
+
+class SparseFieldsetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.teacher = make_teacher("teacher")
+        self.course = make_course(self.teacher, title="Algebra")
+        Assignment.objects.create(course=self.course, title="Homework", description="Read", due_date=date(2024, 6, 1))
+        Announcement.objects.create(course=self.course, title="Welcome", message="Hello")
+
+    def test_course_list_fields(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("all-courses"), {"fields": "id,title,thumbnail"})
+        self.assertEqual(response.json(), [{"id": self.course.id, "title": "Algebra", "thumbnail": None}])
+        course_query = next(q["sql"] for q in ctx if 'FROM "api_course"' in q["sql"])
+        self.assertNotIn("description", course_query)
+
+    def test_course_detail_expand(self):
+        url = reverse("course-detail", args=[self.course.id])
+        headers = auth_header(self.teacher.user)
+
+        full = self.client.get(url, **headers).json()
+        self.assertIn("assignments", full)
+        self.assertIn("files", full)
+
+        with CaptureQueriesContext(connection) as ctx:
+            sparse = self.client.get(url, {"fields": "id,title", "expand": "announcements"}, **headers).json()
+        self.assertEqual(set(sparse), {"id", "title", "announcements", "edit", "is_enrolled"})
+        self.assertEqual(sparse["announcements"][0]["title"], "Welcome")
+        self.assertFalse(any("api_assignment" in q["sql"] or "api_coursefile" in q["sql"] for q in ctx))
+
+
+class RenderingAndCompressionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_fast_renderer_matches_drf_renderer(self):
+        data = {
+            "when": datetime(2024, 5, 1, 12, 30, tzinfo=dt_timezone.utc),
+            "day": date(2024, 5, 1),
+            "price": Decimal("9.50"),
+            "label": gettext_lazy("Course"),
+            "text": "line\u2028break",
+            1: [None, True, 1.5],
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_parser_round_trip(self):
+        body = b'{"title": "Algebra", "tags": ["math"]}'
+        self.assertEqual(FastJSONParser().parse(BytesIO(body)), {"title": "Algebra", "tags": ["math"]})
+
+    def test_large_json_is_gzipped(self):
+        teacher = make_teacher("teacher")
+        for i in range(30):
+            make_course(teacher, title=f"Course {i}")
+
+        response = self.client.get(reverse("all-courses"), HTTP_ACCEPT_ENCODING="gzip, br;q=0")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response["Vary"])
+        self.assertEqual(len(json.loads(gzip.decompress(response.content))), 30)
+
+        response = self.client.get(reverse("all-courses"), HTTP_ACCEPT_ENCODING="identity")
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+    def test_small_json_is_not_compressed(self):
+        response = self.client.get(reverse("all-courses"), HTTP_ACCEPT_ENCODING="gzip")
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+
+@mock.patch.object(Certificate, "generate_certificate")
+class CompleteLessonTests(TestCase):
+    def setUp(self):
+        self.course = make_course(make_teacher("teacher"), total_lessons=2)
+        self.student = make_student("student")
+        Enrollment.objects.create(student=self.student, course=self.course)
+        self.headers = auth_header(self.student.user)
+
+    def complete(self, lesson):
+        url = reverse("complete-lesson", args=[self.course.id, lesson])
+        return self.client.post(url, **self.headers)
+
+    def test_completion_is_idempotent_and_clamped(self, generate_certificate):
+        self.assertEqual(self.complete(1).status_code, 201)
+        again = self.complete(1)
+        self.assertEqual(again.status_code, 200)
+        self.assertFalse(again.json()["recorded"])
+        self.assertEqual(again.json()["completed_lessons"], 1)
+
+        last = self.complete(2).json()
+        self.assertEqual(last["completed_lessons"], 2)
+        self.assertTrue(last["is_completed"])
+        self.assertTrue(Certificate.objects.filter(student=self.student, course=self.course).exists())
+
+        self.assertEqual(self.complete(3).status_code, 400)
+
+    def test_only_enrolled_students(self, generate_certificate):
+        other = make_student("other")
+        url = reverse("complete-lesson", args=[self.course.id, 1])
+        self.assertEqual(self.client.post(url, **auth_header(other.user)).status_code, 404)
+
+
+@mock.patch.object(Certificate, "generate_certificate")
+class CompleteLessonConcurrencyTests(TransactionTestCase):
+    """Many threads completing lessons at once must not lose or double count increments."""
+
+    threads = 8
+
+    def test_concurrent_completions(self, generate_certificate):
+        course = make_course(make_teacher("teacher"), total_lessons=20)
+        student = make_student("student")
+        Enrollment.objects.create(student=student, course=course)
+        headers = auth_header(student.user)
+        # Every lesson is sent by two threads, plus one lesson past the end
+        lessons = [n for n in range(1, 22) for _ in range(2)]
+        statuses, errors = [], []
+        barrier = threading.Barrier(self.threads)
+
+        def worker(chunk):
+            client = Client()
+            try:
+                barrier.wait()
+                for lesson in chunk:
+                    url = reverse("complete-lesson", args=[course.id, lesson])
+                    statuses.append(client.post(url, **headers).status_code)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker, args=(lessons[i::self.threads],)) for i in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        progress = Progress.objects.get(student=student, course=course)
+        self.assertEqual(progress.completed_lessons, 20)
+        self.assertTrue(progress.is_completed)
+        self.assertEqual(LessonCompletion.objects.filter(progress=progress).count(), 20)
+        self.assertEqual(statuses.count(201), 20)
+        generate_certificate.assert_called_once()
+
+
+class CapacityEnrollmentTests(TestCase):
+    def setUp(self):
+        self.course = make_course(make_teacher("teacher"))
+        self.course.seat_limit = 1
+        self.course.save()
+
+    def enroll(self, student):
+        return self.client.post(reverse("enroll-course"), {"course": self.course.id}, **auth_header(student.user))
+
+    def test_full_course_returns_waitlist_position(self):
+        first, second, third = (make_student(name) for name in ("first", "second", "third"))
+        self.assertEqual(self.enroll(first).status_code, 201)
+        self.assertEqual(self.enroll(first).status_code, 400)
+
+        response = self.enroll(second)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()["waitlist_position"], 1)
+        self.assertEqual(self.enroll(third).json()["waitlist_position"], 2)
+        self.assertEqual(self.enroll(second).json()["waitlist_position"], 1)
+
+        self.course.refresh_from_db()
+        self.assertEqual(self.course.seats_taken, 1)
+        self.assertEqual(Enrollment.objects.filter(course=self.course).count(), 1)
+
+    def test_freed_seat_goes_to_the_head_of_the_waitlist(self):
+        first, second, third = (make_student(name) for name in ("first", "second", "third"))
+        for student in (first, second, third):
+            self.enroll(student)
+        Enrollment.objects.filter(student=first).delete()
+
+        self.assertTrue(Enrollment.objects.filter(student=second, course=self.course).exists())
+        self.assertFalse(WaitlistEntry.objects.filter(student=second).exists())
+        self.assertEqual(self.enroll(third).json()["waitlist_position"], 1)
+        self.assertEqual(self.enroll(make_student("fourth")).json()["waitlist_position"], 2)
+        self.course.refresh_from_db()
+        self.assertEqual(self.course.seats_taken, 1)
+
+    def test_enrolling_takes_the_student_off_the_waitlist(self):
+        first, second = make_student("first"), make_student("second")
+        self.enroll(first)
+        self.enroll(second)
+        Course.objects.filter(pk=self.course.pk).update(seat_limit=2)
+        self.assertEqual(self.enroll(second).status_code, 201)
+        self.assertFalse(WaitlistEntry.objects.exists())
+
+    def test_unenrolling_frees_the_seat(self):
+        student = make_student("student")
+        self.enroll(student)
+        Enrollment.objects.filter(student=student).delete()
+        self.course.refresh_from_db()
+        self.assertEqual(self.course.seats_taken, 0)
+
+    def test_saving_a_course_keeps_seat_counter(self):
+        stale = Course.objects.get(pk=self.course.pk)
+        self.enroll(make_student("student"))
+        stale.title = "Renamed"
+        stale.save()
+        self.course.refresh_from_db()
+        self.assertEqual((self.course.title, self.course.seats_taken), ("Renamed", 1))
+
+    def test_recount_seats_backfills_the_counter(self):
+        other = make_course(self.course.teacher, title="Other")
+        # Enrolled before seats were counted
+        for name in ("first", "second"):
+            Enrollment.objects.create(student=make_student(name), course=self.course)
+        out = StringIO()
+        call_command("recount_seats", stdout=out)
+        self.assertIn("Corrected seats_taken on 1 courses", out.getvalue())
+        self.assertEqual(
+            dict(Course.objects.values_list("title", "seats_taken")), {self.course.title: 2, other.title: 0}
+        )
+
+
+class BatchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.teacher = make_teacher("teacher")
+        self.course = make_course(self.teacher, title="Algebra")
+        self.student = make_student("student")
+        Enrollment.objects.create(student=self.student, course=self.course)
+
+    def batch(self, requests):
+        return self.client.post(
+            reverse("batch"), {"requests": requests}, content_type="application/json", **auth_header(self.student.user)
+        )
+
+    def test_runs_sub_requests_as_the_same_user(self):
+        detail = reverse("course-detail", args=[self.course.id])
+        response = self.batch([
+            {"path": reverse("profile")},
+            {"path": reverse("enrolled-courses")},
+            {"path": detail + "?fields=id,title"},
+            {"path": "/no-such-route/"},
+            {"path": reverse("enroll-course"), "method": "POST"},
+        ])
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["responses"]
+        self.assertEqual([result["status"] for result in results], [200, 200, 200, 404, 405])
+        self.assertEqual(results[0]["body"]["role"], "Student")
+        self.assertEqual(results[1]["body"][0]["course_title"], "Algebra")
+        self.assertEqual(results[2]["body"]["title"], "Algebra")
+
+    def test_identity_map_shares_loaded_objects(self):
+        detail = {"path": reverse("course-detail", args=[self.course.id])}
+        self.batch([detail])  # Warm the course detail cache
+        with CaptureQueriesContext(connection) as ctx:
+            self.batch([detail, detail, detail])
+        course_lookups = [q for q in ctx if 'FROM "api_course"' in q["sql"] and "JOIN" not in q["sql"]]
+        self.assertEqual(len(course_lookups), 1)
+
+    def test_rejects_oversized_batches(self):
+        with self.settings(BATCH_MAX_REQUESTS=2):
+            self.assertEqual(self.batch([{"path": "/courses/"}] * 3).status_code, 400)
+
+
+class StudentHomeTests(TestCase):
+    def setUp(self):
+        self.student = make_student("student")
+
+    def enroll_in_new_courses(self, count):
+        for i in range(count):
+            course = make_course(make_teacher(f"home{Course.objects.count()}"), total_lessons=4)
+            Enrollment.objects.create(student=self.student, course=course)
+            Assignment.objects.create(course=course, title=f"Homework {i}", description="Read", due_date=date(2999, 1, 1 + i))
+            Announcement.objects.create(course=course, title=f"News {i}", message="Hello")
+
+    def home_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("student-home"), **auth_header(self.student.user))
+        self.assertEqual(response.status_code, 200)
+        return response.json(), len(ctx)
+
+    def test_query_budget_does_not_grow_with_courses(self):
+        self.enroll_in_new_courses(1)
+        _, few = self.home_queries()
+        self.enroll_in_new_courses(9)
+        data, many = self.home_queries()
+        self.assertEqual(few, many)
+        self.assertLessEqual(many, 6)
+        self.assertEqual(len(data["courses"]), 10)
+        self.assertEqual(len(data["upcoming_assignments"]), 5)
+        self.assertEqual(data["upcoming_assignments"][0]["title"], "Homework 0")
+
+    def test_progress_percent(self):
+        self.enroll_in_new_courses(1)
+        Progress.objects.filter(student=self.student).update(completed_lessons=1)
+        data, _ = self.home_queries()
+        self.assertEqual(data["courses"][0]["progress_percent"], 25.0)
+
+
+def png_upload(name="image.png"):
+    buffer = BytesIO()
+    Image.new("RGB", (4, 4)).save(buffer, format="PNG")
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/png")
+
+
+@override_settings(
+    MEDIA_ROOT=tempfile.mkdtemp(),
+    PROFILE_ROOT=tempfile.mkdtemp(),
+    PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"],
+)
+@mock.patch.object(Certificate, "generate_certificate")
+class EndpointQueryCountTests(TestCase):
+    """
+    Every route in api/urls.py must run the same number of queries with N and 10N
+    rows behind it (courses per teacher, enrollments per student, files,
+    assignments, announcements and students per course).
+    """
+
+    N = 2
+
+    def setUp(self):
+        self.teacher = make_teacher("teacher")
+        self.student = make_user("student", password="pass1234")
+        self.student = Student.objects.create(user=self.student, enrollment_year=2024, grade="10")
+        self.course = make_course(self.teacher, title="Main")
+        Enrollment.objects.create(student=self.student, course=self.course)
+        self.progress = Progress.objects.get(student=self.student, course=self.course)
+        self.file = CourseFile.objects.create(course=self.course, title="Notes", file="course_files/notes.pdf")
+        self.assignment = Assignment.objects.create(course=self.course, title="Homework", description="Read", due_date=date(2999, 1, 1))
+        self.announcement = Announcement.objects.create(course=self.course, title="Welcome", message="Hello")
+        self.open_course = make_course(make_teacher("other"), title="Open")
+        self.staff = make_user("staff", is_staff=True)
+        self.ended = make_course(self.teacher, title="Ended")
+        archive_course(self.ended)
+        with open(os.path.join(settings.PROFILE_ROOT, "run.json"), "w") as file:
+            file.write("{}")
+        self.rows = 0
+
+    def grow(self, rows):
+        """Add rows until every dimension has `rows` entries."""
+        for i in range(self.rows, rows):
+            course = make_course(self.teacher, title=f"Course {i}")
+            Enrollment.objects.create(student=self.student, course=course)
+            classmate = make_student(f"classmate{i}")
+            Enrollment.objects.create(student=classmate, course=self.course)
+            CourseFile.objects.create(course=self.course, title=f"File {i}", file=f"course_files/{i}.pdf")
+            Assignment.objects.create(course=self.course, title=f"Task {i}", description="Do", due_date=date(2999, 2, 1))
+            Announcement.objects.create(course=self.course, title=f"News {i}", message="Hi")
+            CourseRecommendation.objects.create(course=self.course, recommended=course, rank=i + 1, score=1.0)
+            certificate = Certificate.objects.create(student=classmate, course=self.course)
+            certificate.certificate_file.save(f"{i}.png", ContentFile(b"png"))
+        self.rows = rows
+
+    def endpoints(self):
+        teacher, student = self.teacher.user, self.student.user
+        course_detail = reverse("course-detail", args=[self.course.id])
+        return {
+            "course detail (teacher)": (teacher, "get", course_detail, None),
+            "course detail (student)": (student, "get", course_detail, None),
+            "course detail (not enrolled)": (student, "get", reverse("course-detail", args=[self.open_course.id]), None),
+            "register": (None, "post", reverse("register"), {
+                "username": "newbie", "email": "newbie@example.com", "password": "pass1234",
+                "mobile_number": "555", "role": "student", "enrollment_year": 2024, "grade": "9",
+            }),
+            "login": (None, "post", reverse("login"), {"username": "student", "password": "pass1234"}),
+            "token refresh": (None, "post", reverse("token_refresh"), {"refresh": str(RefreshToken.for_user(student))}),
+            "profile": (student, "get", reverse("profile"), None),
+            "upload course": (teacher, "post", reverse("upload-course"), {
+                "title": "New", "start_date": "2024-01-01", "end_date": "2024-02-01", "total_lessons": 3,
+                "thumbnail": png_upload(),
+            }),
+            "enroll": (student, "post", reverse("enroll-course"), {"course": self.open_course.id}),
+            "upload course file": (teacher, "post", reverse("upload-course-file"), {
+                "course": self.course.id, "title": "Slides", "file": SimpleUploadedFile("slides.pdf", b"%PDF"),
+            }),
+            "edit course": (teacher, "patch", reverse("edit-course", args=[self.course.id]), {"title": "Renamed"}),
+            "delete course file": (teacher, "delete", reverse("delete-course-file", args=[self.file.id]), None),
+            "delete course": (teacher, "delete", reverse("delete-course", args=[self.course.id]), None),
+            "create assignment": (teacher, "post", reverse("assignment-create"), {
+                "course_id": self.course.id, "title": "Quiz", "description": "Answer", "due_date": "2999-03-01",
+            }),
+            "get assignment": (teacher, "get", reverse("assignment-edit-delete", args=[self.assignment.id]), None),
+            "edit assignment": (teacher, "patch", reverse("assignment-edit-delete", args=[self.assignment.id]), {"title": "Quiz 2"}),
+            "delete assignment": (teacher, "delete", reverse("assignment-edit-delete", args=[self.assignment.id]), None),
+            "enrolled courses": (student, "get", reverse("enrolled-courses"), None),
+            "my courses": (teacher, "get", reverse("my-courses"), None),
+            "get announcement": (teacher, "get", reverse("announcement-detail", args=[self.announcement.id]), None),
+            "delete announcement": (teacher, "delete", reverse("announcement-detail", args=[self.announcement.id]), None),
+            "get progress": (teacher, "get", reverse("progress-detail", args=[self.progress.id]), None),
+            "update progress": (teacher, "patch", reverse("progress-detail", args=[self.progress.id]), {"completed_lessons": 3}),
+            "complete lesson": (student, "post", reverse("complete-lesson", args=[self.course.id, 1]), None),
+            "create announcement": (teacher, "post", reverse("create-announcement"), {
+                "course": self.course.id, "title": "Exam", "message": "Friday",
+            }),
+            "all courses": (None, "get", reverse("all-courses"), None),
+            "course archive": (teacher, "get", reverse("course-archive", args=[self.ended.id]), None),
+            "ranking (teacher)": (teacher, "get", reverse("course-ranking", args=[self.course.id]), None),
+            "ranking (student)": (student, "get", reverse("course-ranking", args=[self.course.id]), None),
+            "recommendations": (None, "get", reverse("course-recommendations", args=[self.course.id]), None),
+            "daily stats (course)": (teacher, "get", reverse("daily-stats"), {"course": self.course.id}),
+            "daily stats (teacher)": (self.staff, "get", reverse("daily-stats"), {"teacher": self.teacher.id}),
+            "batch": (student, "post", reverse("batch"), {"requests": [
+                {"path": reverse("profile")}, {"path": reverse("enrolled-courses")}, {"path": course_detail},
+            ]}),
+            "student home": (student, "get", reverse("student-home"), None),
+            "profile artifact": (self.staff, "get", reverse("profile-artifact", args=["run.json"]), None),
+            "certificates zip": (teacher, "get", reverse("course-certificates-zip", args=[self.course.id]), None),
+        }
+
+    def count_queries(self, user, method, url, data):
+        headers = auth_header(user) if user else {}
+        if method in ("patch", "put") or (method == "post" and "batch" in url):
+            kwargs = {"data": json.dumps(data), "content_type": "application/json"}
+        else:
+            kwargs = {"data": data} if data is not None else {}
+        cache.clear()
+        savepoint = transaction.savepoint()
+        try:
+            with CaptureQueriesContext(connection) as ctx:
+                response = getattr(self.client, method)(url, **kwargs, **headers)
+                body = b"".join(response.streaming_content) if response.streaming else response.content
+        finally:
+            transaction.savepoint_rollback(savepoint)
+        self.assertLess(response.status_code, 400, f"{method.upper()} {url}: {body[:300]}")
+        return len(ctx)
+
+    def test_every_route_is_covered(self, generate_certificate):
+        covered = {url for _, _, url, _ in self.endpoints().values()}
+        for pattern in api_urls.urlpatterns:
+            route = str(pattern.pattern)
+            with self.subTest(route=route):
+                self.assertTrue(any(re.fullmatch(re.sub(r"<[^>]+>", "[^/]+", route), url.lstrip("/")) for url in covered))
+
+    def test_query_count_is_constant(self, generate_certificate):
+        self.grow(self.N)
+        small = {name: self.count_queries(*spec) for name, spec in self.endpoints().items()}
+        self.grow(self.N * 10)
+        large = {name: self.count_queries(*spec) for name, spec in self.endpoints().items()}
+        for name in small:
+            with self.subTest(endpoint=name):
+                self.assertEqual(large[name], small[name])
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), IMAGE_MAX_PIXELS=10_000, IMAGE_MAX_SIDE=50)
+class ImageUploadTests(TestCase):
+    def setUp(self):
+        self.teacher = make_teacher("teacher")
+        self.url = reverse("upload-course")
+
+    def upload(self, image, format="PNG", **save_kwargs):
+        buffer = BytesIO()
+        image.save(buffer, format=format, **save_kwargs)
+        data = {
+            "title": "Photos", "start_date": "2024-01-01", "end_date": "2024-02-01", "total_lessons": 3,
+            "thumbnail": SimpleUploadedFile(f"photo.{format.lower()}", buffer.getvalue()),
+        }
+        return self.client.post(self.url, data, **auth_header(self.teacher.user))
+
+    def test_rejects_too_many_pixels_before_decoding(self):
+        with mock.patch("PIL.ImageFile.ImageFile.load") as load:
+            response = self.upload(Image.new("RGB", (200, 200)))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("thumbnail", response.json())
+        load.assert_not_called()
+        self.assertFalse(Course.objects.exists())
+
+    @override_settings(IMAGE_UPLOAD_MAX_BYTES=100)
+    def test_rejects_large_files(self):
+        response = self.upload(Image.effect_noise((90, 90), 50).convert("RGB"))
+        self.assertEqual(response.status_code, 400)
+
+    def test_full_queue_keeps_the_upload_instead_of_decoding_in_the_request(self):
+        course = make_course(self.teacher)
+        with mock.patch("api.images._pool_slots") as slots, mock.patch("api.images._pool", object()), \
+                mock.patch("api.images.normalize_image") as normalize, self.assertLogs("api.images", "WARNING"):
+            slots.acquire.return_value = False
+            submit_image(Course, course.id, "thumbnail")
+        normalize.assert_not_called()
+
+    def test_normalized_after_commit(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Orientation: rotate 90° clockwise
+        exif[0x010F] = "Camera Maker"
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.upload(Image.new("RGB", (80, 40)), format="JPEG", exif=exif)
+        self.assertEqual(response.status_code, 201)
+        course = Course.objects.get()
+        original = course.thumbnail.name
+
+        with mock.patch("api.images.submit_image", side_effect=lambda *args, tenant, using: normalize_image(*args, using=using)) as submit:
+            for callback in callbacks:
+                callback()
+        submit.assert_called_once_with(Course, course.id, "thumbnail", tenant=None, using="default")
+
+        course.refresh_from_db()
+        self.assertNotEqual(course.thumbnail.name, original)
+        self.assertFalse(course.thumbnail.storage.exists(original))
+        with Image.open(course.thumbnail.path) as image:
+            self.assertEqual(image.size, (25, 50))  # Rotated upright, then fit into 50x50
+            self.assertFalse(image.getexif())
+
+
+class CertificateZipTests(TestCase):
+    def setUp(self):
+        media = self.settings(MEDIA_ROOT=tempfile.mkdtemp())
+        media.enable()
+        self.addCleanup(media.disable)
+        self.teacher = make_teacher("teacher")
+        self.course = make_course(self.teacher, title="Algebra")
+        self.url = reverse("course-certificates-zip", args=[self.course.id])
+        self.stored = Certificate.objects.create(student=make_student("ada"), course=self.course)
+        self.stored.certificate_file.save("cert_ada_algebra.png", ContentFile(b"ada" * 50000))
+        self.missing = Certificate.objects.create(student=make_student("alan"), course=self.course)
+
+    def render(self, certificate):
+        """Stand-in for generate_certificate (the real one needs arial.ttf)."""
+        certificate.certificate_file.save("cert_alan_algebra.png", ContentFile(b"alan"))
+
+    def test_streams_stored_and_missing_certificates(self):
+        with mock.patch.object(Certificate, "generate_certificate", autospec=True, side_effect=self.render) as generate:
+            response = self.client.get(self.url, **auth_header(self.teacher.user))
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.streaming)
+            self.assertEqual(response["Content-Type"], "application/zip")
+            generate.assert_not_called()  # Rendering happens while the body streams
+            chunks = list(response.streaming_content)
+
+        self.assertEqual(generate.call_count, 1)
+        self.assertGreater(len(chunks), 2)
+        self.assertLessEqual(max(len(chunk) for chunk in chunks), 64 * 1024 + 1024)
+        with zipfile.ZipFile(BytesIO(b"".join(chunks))) as archive:
+            self.assertEqual(archive.namelist(), ["cert_ada_algebra.png", "cert_alan_algebra.png"])
+            self.assertEqual(archive.read("cert_ada_algebra.png"), b"ada" * 50000)
+            self.assertEqual(archive.read("cert_alan_algebra.png"), b"alan")
+
+    def test_other_teachers_are_refused(self):
+        response = self.client.get(self.url, **auth_header(make_teacher("other").user))
+        self.assertEqual(response.status_code, 403)
+
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        profiles = self.settings(PROFILE_ROOT=tempfile.mkdtemp())
+        profiles.enable()
+        self.addCleanup(profiles.disable)
+        self.staff = make_user("staff", is_staff=True)
+        self.student = make_student("student")
+        make_course(make_teacher("teacher"), title="Algebra")
+
+    def test_staff_header_saves_pstats_and_sql_trace(self):
+        response = self.client.get(reverse("all-courses"), HTTP_X_PROFILE="1", **auth_header(self.staff))
+        self.assertEqual(response.status_code, 200)
+        profile_id = response["X-Profile-Id"]
+
+        trace = self.client.get(response["X-Profile-Trace"], **auth_header(self.staff))
+        self.assertEqual(trace.status_code, 200)
+        trace = json.loads(b"".join(trace.streaming_content))
+        self.assertEqual(trace["path"], reverse("all-courses"))
+        self.assertEqual(trace["query_count"], len(trace["queries"]))
+        self.assertTrue(any("api_course" in query["sql"] for query in trace["queries"]))
+        self.assertTrue(any(query["origin"].startswith("api/views.py:") for query in trace["queries"]))
+
+        stats = pstats.Stats(os.path.join(settings.PROFILE_ROOT, profile_id + ".pstats"))
+        self.assertTrue(any(name == "get_all_courses" for _, _, name in stats.stats))
+
+    def test_header_is_ignored_for_other_users(self):
+        response = self.client.get(reverse("all-courses"), HTTP_X_PROFILE="1", **auth_header(self.student.user))
+        self.assertNotIn("X-Profile-Id", response)
+        self.assertEqual(os.listdir(settings.PROFILE_ROOT), [])
+
+    def test_artifacts_are_staff_only(self):
+        with open(os.path.join(settings.PROFILE_ROOT, "run.json"), "w") as file:
+            file.write("{}")
+        url = reverse("profile-artifact", args=["run.json"])
+        self.assertEqual(self.client.get(url, **auth_header(self.student.user)).status_code, 403)
+        self.assertEqual(self.client.get(url, **auth_header(self.staff)).status_code, 200)
+
+    @override_settings(SLOW_QUERY_MS=0, SLOW_QUERY_SAMPLE_RATE=1.0)
+    def test_slow_queries_are_logged_with_their_origin(self):
+        with self.assertLogs("api.slow_queries", "WARNING") as logs:
+            self.client.get(reverse("all-courses"))
+        self.assertTrue(any("api/views.py:" in line and "api_course" in line for line in logs.output))
+
+    @override_settings(SLOW_QUERY_MS=0, SLOW_QUERY_SAMPLE_RATE=0.0)
+    def test_slow_query_sampling(self):
+        with self.assertNoLogs("api.slow_queries", "WARNING"):
+            self.client.get(reverse("all-courses"))
+
+
+def throttle_rates(**rates):
+    """REST_FRAMEWORK settings with only the given throttle rates ('login_ip' -> 'login.ip')."""
+    return dict(settings.REST_FRAMEWORK, DEFAULT_THROTTLE_RATES={
+        "{}.{}".format(*name.rsplit("_", 1)): rate for name, rate in rates.items()
+    })
+
+
+@override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class RateLimitTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        make_user("student", password="pass1234")
+        self.url = reverse("login")
+
+    def login(self, username="student", ip="10.0.0.1"):
+        return self.client.post(self.url, {"username": username, "password": "wrong"}, REMOTE_ADDR=ip)
+
+    @override_settings(REST_FRAMEWORK=throttle_rates(login_ip="3/min"))
+    def test_limits_per_ip(self):
+        self.assertEqual([self.login().status_code for _ in range(4)], [400, 400, 400, 429])
+        self.assertEqual(self.login(ip="10.0.0.2").status_code, 400)
+
+    @override_settings(REST_FRAMEWORK=throttle_rates(login_ip="3/min"))
+    def test_spoofed_forwarded_for_does_not_reset_the_ip_limit(self):
+        codes = [
+            self.client.post(self.url, {"username": f"user{i}", "password": "wrong"},
+                             REMOTE_ADDR="10.0.0.1", HTTP_X_FORWARDED_FOR=f"192.0.2.{i}").status_code
+            for i in range(4)
+        ]
+        self.assertEqual(codes, [400, 400, 400, 429])
+
+    @override_settings(REST_FRAMEWORK=throttle_rates(login_user="2/min"))
+    def test_limits_per_username_across_ips(self):
+        codes = [self.login(ip=f"10.0.0.{i}").status_code for i in range(3)]
+        self.assertEqual(codes, [400, 400, 429])
+        self.assertEqual(self.login(username="someone-else").status_code, 400)
+
+    @override_settings(REST_FRAMEWORK=throttle_rates(login_route="2/min"))
+    def test_limits_whole_route(self):
+        codes = [self.login(username=f"user{i}", ip=f"10.0.0.{i}").status_code for i in range(3)]
+        self.assertEqual(codes, [400, 400, 429])
+
+    @override_settings(REST_FRAMEWORK=throttle_rates(login_ip="3/min"))
+    def test_rejection_only_reads_counters(self):
+        for _ in range(3):
+            self.login()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.login()
+        self.assertEqual(response.status_code, 429)
+        self.assertIn("Retry-After", response)
+        self.assertEqual(len(queries), 1)
+
+    @override_settings(REST_FRAMEWORK=throttle_rates(login_ip="10/min"))
+    def test_sliding_window(self):
+        with mock.patch("api.throttling.SharedRateThrottle.timer", return_value=60 * 1000 + 50):
+            self.assertEqual([self.login().status_code for _ in range(11)][-2:], [400, 429])
+        # A quarter into the next window, 3/4 of the previous 10 requests still count
+        with mock.patch("api.throttling.SharedRateThrottle.timer", return_value=60 * 1001 + 15):
+            self.assertEqual([self.login().status_code for _ in range(4)], [400, 400, 400, 429])
+        self.assertEqual(RateLimitCounter.objects.count(), 2)
+
+    @override_settings(REST_FRAMEWORK=throttle_rates(login_ip="10/min"))
+    def test_clear_rate_limits_deletes_windows_that_no_longer_count(self):
+        with mock.patch("api.throttling.SharedRateThrottle.timer", return_value=60 * 1000):
+            self.login(ip="10.0.0.1")  # A key that went quiet long ago
+        self.login(ip="10.0.0.2")
+        out = StringIO()
+        call_command("clear_rate_limits", stdout=out)
+        self.assertIn("Deleted 1 expired", out.getvalue())
+        self.assertEqual(RateLimitCounter.objects.count(), 1)
+
+    @override_settings(REST_FRAMEWORK=throttle_rates(login_ip="2/min"), THROTTLE_STORE="cache")
+    def test_cache_store(self):
+        self.assertEqual([self.login().status_code for _ in range(3)], [400, 400, 429])
+        self.assertFalse(RateLimitCounter.objects.exists())
+
+    @override_settings(REST_FRAMEWORK=throttle_rates(upload_course_user="1/hour"))
+    def test_upload_course_limited_per_user(self):
+        teacher = make_teacher("teacher")
+        data = {"title": "New", "start_date": "2024-01-01", "end_date": "2024-02-01", "total_lessons": 3}
+        url = reverse("upload-course")
+        self.assertEqual(self.client.post(url, data, **auth_header(teacher.user)).status_code, 201)
+        self.assertEqual(self.client.post(url, data, **auth_header(teacher.user)).status_code, 429)
+
+
+@skipUnless(importlib.util.find_spec("scipy"), "build_recommendations needs numpy and scipy")
+class RecommendationTests(TestCase):
+    def setUp(self):
+        teacher = make_teacher("teacher")
+        self.algebra, self.geometry, self.poetry, self.drama = (
+            make_course(teacher, title=title) for title in ("Algebra", "Geometry", "Poetry", "Drama")
+        )
+        enrollments = {
+            "ann": [self.algebra, self.geometry],
+            "bob": [self.algebra, self.poetry],
+            "cyd": [self.poetry, self.drama],
+        }
+        for username, courses in enrollments.items():
+            student = make_student(username)
+            for course in courses:
+                Enrollment.objects.create(student=student, course=course)
+        # bob finished both his courses, which ties Algebra closer to Poetry than to Geometry
+        Progress.objects.filter(student__user__username="bob").update(is_completed=True)
+
+    def test_build_and_serve(self):
+        self.assertEqual(build_recommendations(top_k=2), 6)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("course-recommendations", args=[self.algebra.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item["title"] for item in response.json()], ["Poetry", "Geometry"])
+        self.assertGreater(response.json()[0]["score"], response.json()[1]["score"])
+
+        drama = self.client.get(reverse("course-recommendations", args=[self.drama.id])).json()
+        self.assertEqual([item["title"] for item in drama], ["Poetry"])
+
+    def test_rebuild_replaces_previous_rows(self):
+        build_recommendations(top_k=1)
+        build_recommendations(top_k=1)
+        self.assertEqual(CourseRecommendation.objects.count(), 4)
+        self.assertFalse(CourseRecommendation.objects.filter(course=F("recommended")).exists())
+
+
+@mock.patch.object(Certificate, "generate_certificate")
+class ProgressRankingTests(TestCase):
+    def setUp(self):
+        self.teacher = make_teacher("teacher")
+        self.course = make_course(self.teacher, title="Algebra", total_lessons=10)
+        self.students = [make_student(name) for name in ("ann", "bob", "cyd", "dan")]
+        for student in self.students:
+            Enrollment.objects.create(student=student, course=self.course)
+        self.url = reverse("course-ranking", args=[self.course.id])
+
+    def histogram(self):
+        return dict(ProgressBucket.objects.filter(course=self.course, count__gt=0).values_list("completed_lessons", "count"))
+
+    def recount(self):
+        rows = Progress.objects.filter(course=self.course).values_list("completed_lessons", flat=True)
+        counts = {}
+        for lessons in rows:
+            counts[lessons] = counts.get(lessons, 0) + 1
+        return counts
+
+    def set_lessons(self, student, lessons):
+        progress = Progress.objects.get(student=student, course=self.course)
+        progress.completed_lessons = lessons
+        progress.save()
+
+    def test_histogram_follows_every_write_path(self, generate_certificate):
+        self.assertEqual(self.histogram(), {0: 4})
+        self.set_lessons(self.students[0], 5)
+        Progress.objects.filter(student=self.students[1]).add_completed_lesson()
+        Progress.objects.filter(student__in=self.students[2:]).update(completed_lessons=F("completed_lessons") + 2)
+        self.assertEqual(self.histogram(), {5: 1, 1: 1, 2: 2})
+        self.assertEqual(self.histogram(), self.recount())
+
+        self.students[3].delete()  # Cascades to Progress
+        self.assertEqual(self.histogram(), {5: 1, 1: 1, 2: 1})
+        self.assertEqual(ProgressBucket.objects.rebuild([self.course.id]), 3)
+        self.assertEqual(self.histogram(), self.recount())
+
+    def test_stale_instance_keeps_the_histogram_right(self, generate_certificate):
+        stale = Progress.objects.get(student=self.students[0], course=self.course)
+        Progress.objects.filter(pk=stale.pk).add_completed_lesson()  # Another request, after the load
+
+        stale.save()  # Unchanged here: the other request's value stays
+        stale.refresh_from_db()
+        self.assertEqual(stale.completed_lessons, 1)
+        self.assertEqual(self.histogram(), self.recount())
+
+        stale = Progress.objects.get(pk=stale.pk)
+        Progress.objects.filter(pk=stale.pk).add_completed_lesson()
+        stale.completed_lessons = 5
+        stale.save()  # Moves the row out of the bucket it is in now, not the one it was loaded from
+        self.assertEqual(self.histogram(), {0: 3, 5: 1})
+        self.assertEqual(self.histogram(), self.recount())
+
+    def test_student_rank_and_percentile(self, generate_certificate):
+        for student, lessons in zip(self.students, (5, 3, 3, 0)):
+            self.set_lessons(student, lessons)
+        with self.assertNumQueries(4):  # User, course, histogram, own progress
+            response = self.client.get(self.url, **auth_header(self.students[1].user))
+        self.assertEqual(response.status_code, 200)
+        ranking = response.json()
+        self.assertEqual((ranking["rank"], ranking["students"]), (2, 4))
+        self.assertEqual((ranking["percentile"], ranking["top_percent"]), (50.0, 50.0))
+
+    def test_teacher_class_view(self, generate_certificate):
+        for student, lessons in zip(self.students, (0, 3, 5, 3)):
+            self.set_lessons(student, lessons)
+        response = self.client.get(self.url, {"limit": 3}, **auth_header(self.teacher.user))
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["histogram"], [
+            {"completed_lessons": 0, "count": 1}, {"completed_lessons": 3, "count": 2}, {"completed_lessons": 5, "count": 1},
+        ])
+        self.assertEqual([(row["username"], row["rank"]) for row in data["results"]], [("cyd", 1), ("bob", 2), ("dan", 2)])
+
+    def test_outsiders_are_refused(self, generate_certificate):
+        response = self.client.get(self.url, **auth_header(make_student("eve").user))
+        self.assertEqual(response.status_code, 403)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), MEDIA_SENDFILE_BACKEND="")
+class MediaServingTests(TestCase):
+    def setUp(self):
+        self.teacher = make_teacher("teacher")
+        self.course = make_course(self.teacher)
+        self.student = make_student("student")
+        Enrollment.objects.create(student=self.student, course=self.course)
+        course_file = CourseFile.objects.create(course=self.course, title="Notes", file=ContentFile(b"%PDF-1.4", name="notes.pdf"))
+        self.url = f"/media/{course_file.file.name}"
+
+    def get(self, url=None, user=None, **headers):
+        headers = {**(auth_header(user.user) if user else {}), **headers}
+        return self.client.get(url or self.url, **headers)
+
+    def test_file_response_for_any_accept_header(self):
+        response = self.get(user=self.student, HTTP_ACCEPT="application/pdf")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), b"%PDF-1.4")
+        self.assertIn("Authorization", response["Vary"])
+
+        thumbnail = default_storage.save("course_thumbnails/cover.png", ContentFile(b"png"))
+        self.assertEqual(self.get(f"/media/{thumbnail}", HTTP_ACCEPT="image/png").status_code, 200)
+
+    def test_matching_etag_is_not_modified(self):
+        etag = self.get(user=self.student)["ETag"]
+        response = self.get(user=self.student, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_sendfile_backends_hand_the_file_to_the_web_server(self):
+        with self.settings(MEDIA_SENDFILE_BACKEND="nginx", MEDIA_ACCEL_REDIRECT_PREFIX="/protected-media/"):
+            response = self.get(user=self.teacher)
+        self.assertEqual(response["X-Accel-Redirect"], "/protected-media/" + self.url[len("/media/"):])
+        self.assertEqual(response.content, b"")
+        with self.settings(MEDIA_SENDFILE_BACKEND="apache"):
+            response = self.get(user=self.teacher)
+        self.assertEqual(response["X-Sendfile"], os.path.join(settings.MEDIA_ROOT, self.url[len("/media/"):]))
+        self.assertEqual(response["Content-Type"], "application/pdf")
+
+    def test_student_outside_the_course_is_refused(self):
+        self.assertEqual(self.get(user=make_student("outsider")).status_code, 403)
+        self.assertEqual(self.get().status_code, 403)
+        # Same answer whether or not the file exists
+        self.assertEqual(self.get("/media/course_files/missing.pdf", user=make_student("other")).status_code, 403)
+
+    def test_protected_files_are_looked_up_by_an_indexed_path(self):
+        for model, column in ((CourseFile, "file"), (Certificate, "certificate_file")):
+            with connection.cursor() as cursor:
+                constraints = connection.introspection.get_constraints(cursor, model._meta.db_table)
+            self.assertTrue(any(c["index"] and c["columns"] == [column] for c in constraints.values()), model)
+
+    def test_path_traversal_is_not_found(self):
+        for url in ("/media/course_thumbnails/../../manage.py", "/media/course_thumbnails/%2e%2e/%2e%2e/manage.py"):
+            self.assertEqual(self.get(url, user=self.teacher).status_code, 404)
+
+    def test_course_archives_are_not_served(self):
+        archive = default_storage.save("course_archives/course.jsonl.gz", ContentFile(b"rows"))
+        self.assertEqual(self.get(f"/media/{archive}", user=self.teacher).status_code, 404)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+@mock.patch.object(Certificate, "generate_certificate")
+class CourseArchiveTests(TestCase):
+    def setUp(self):
+        self.teacher = make_teacher("teacher")
+        self.old = make_course(self.teacher, title="Latin 2015", total_lessons=2)
+        Course.objects.filter(pk=self.old.pk).update(start_date=date(2015, 1, 1), end_date=date(2015, 6, 30))
+        self.current = make_course(self.teacher, title="Latin")
+        self.student = make_student("ann")
+        for course in (self.old, self.current):
+            Enrollment.objects.create(student=self.student, course=course)
+            Assignment.objects.create(course=course, title="Essay", description="Write", due_date=date(2015, 3, 1))
+            Announcement.objects.create(course=course, title="Welcome", message="Salve")
+        Progress.objects.filter(course=self.old).add_completed_lesson()
+        progress = Progress.objects.get(course=self.old)
+        LessonCompletion.objects.create(progress=progress, lesson_number=1)
+        self.certificate = Certificate.objects.create(student=self.student, course=self.old, certificate_file="certificates/ann.png")
+
+    def archive(self):
+        out = StringIO()
+        call_command("archive_courses", stdout=out)
+        return out.getvalue()
+
+    def test_moves_ended_courses_out_of_hot_tables(self, generate_certificate):
+        output = self.archive()
+        self.assertIn("1 course(s) to archive", output)
+        self.assertIn("api_progress", output)
+
+        course_archive = CourseArchive.objects.get()
+        self.assertEqual(course_archive.course, self.old)
+        self.assertEqual(course_archive.row_counts, {
+            "api.lessoncompletion": 1, "api.progress": 1, "api.enrollment": 1,
+            "api.waitlistentry": 0, "api.assignment": 1, "api.announcement": 1,
+        })
+        self.assertLess(course_archive.data.size, course_archive.raw_bytes)
+        for model in (Enrollment, Progress, Assignment, Announcement, LessonCompletion, ProgressBucket):
+            self.assertFalse(model.objects.filter(**{"progress__course" if model is LessonCompletion else "course": self.old}).exists())
+            self.assertTrue(model is LessonCompletion or model.objects.filter(course=self.current).exists())
+
+        # Certificates (and access to their files) are untouched
+        self.assertTrue(Certificate.objects.filter(pk=self.certificate.pk, course__title="Latin 2015").exists())
+        self.assertTrue(can_access_media(self.student.user, "certificates/ann.png"))
+        self.assertIn("0 course(s) to archive", self.archive())
+
+    def test_deletes_each_table_in_one_statement(self, generate_certificate):
+        for name in ("bob", "cyd", "dan"):
+            Enrollment.objects.create(student=make_student(name), course=self.old)
+        with CaptureQueriesContext(connection) as queries:
+            self.archive()
+        deletes = [query["sql"] for query in queries if query["sql"].startswith("DELETE")]
+        self.assertEqual(len(deletes), len(ARCHIVED_MODELS) + 1)  # And the histogram
+        self.assertEqual(CourseArchive.objects.get().row_counts["api.enrollment"], 4)
+
+    def test_rehydrate_is_read_only(self, generate_certificate):
+        self.archive()
+        course_archive = CourseArchive.objects.get()
+        progress, = archived_rows(course_archive, Progress)
+        self.assertEqual((progress.student_id, progress.course_id, progress.completed_lessons), (self.student.id, self.old.id, 1))
+        self.assertEqual(progress.student, self.student)
+        with self.assertRaises(ArchivedRowError):
+            progress.save()
+
+        response = self.client.get(reverse("course-archive", args=[self.old.id]), {"model": "assignment"}, **auth_header(self.teacher.user))
+        self.assertEqual(response.status_code, 200)
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual([(row["model"], row["fields"]["title"]) for row in rows], [("api.assignment", "Essay")])
+
+        denied = self.client.get(reverse("course-archive", args=[self.old.id]), **auth_header(self.student.user))
+        self.assertEqual(denied.status_code, 403)
+
+
+class IdempotencyKeyTests(TestCase):
+    def setUp(self):
+        self.teacher = make_teacher("teacher")
+        self.course = make_course(self.teacher)
+        self.url = reverse("create-announcement")
+
+    def post(self, title="Exam", key="retry-1", user=None):
+        data = json.dumps({"course": self.course.id, "title": title, "message": "Friday"})
+        headers = auth_header(user or self.teacher.user)
+        return self.client.post(self.url, data, content_type="application/json", HTTP_IDEMPOTENCY_KEY=key, **headers)
+
+    def test_retry_replays_stored_response(self):
+        first = self.post()
+        self.assertEqual(first.status_code, 201)
+        with self.assertNumQueries(1):  # The stored record, no view and no body
+            retry = self.post()
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(retry["Content-Type"], first["Content-Type"])
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(Announcement.objects.count(), 1)
+
+    def test_keys_are_scoped_per_user_and_checked_against_the_request(self):
+        self.post()
+        other = make_teacher("other")
+        self.assertEqual(self.post(user=other.user).status_code, 403)  # Runs its own view
+        self.assertEqual(self.post(title="A different title").status_code, 422)
+        self.assertEqual(self.post(key="retry-2").status_code, 201)
+        self.assertEqual(Announcement.objects.count(), 2)
+
+    def test_server_errors_are_not_stored(self):
+        with mock.patch("api.views.AnnouncementCreateView.perform_create", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.post()
+        self.assertEqual(self.post().status_code, 201)
+
+    def test_throttled_and_denied_responses_are_not_stored(self):
+        with mock.patch("api.views.AnnouncementCreateView.perform_create", side_effect=Throttled(wait=1)):
+            self.assertEqual(self.post().status_code, 429)
+        self.assertEqual(self.post(user=make_teacher("other").user, key="retry-2").status_code, 403)
+        self.assertFalse(IdempotencyRecord.objects.exclude(status_code=201).exists())
+        self.assertEqual(self.post().status_code, 201)
+        self.assertEqual(self.post(key="retry-2").status_code, 201)
+
+    @override_settings(IDEMPOTENCY_TTL=0)
+    def test_expired_keys_run_again(self):
+        self.post()
+        self.assertEqual(self.post().status_code, 201)
+        self.assertEqual(Announcement.objects.count(), 2)
+
+    def test_duplicate_waits_for_the_request_in_progress(self):
+        data = json.dumps({"course": self.course.id, "title": "Exam", "message": "Friday"})
+        first = RequestFactory().post(self.url, data, content_type="application/json", **auth_header(self.teacher.user))
+        in_progress = IdempotencyRecord.objects.create(
+            key=record_key(first, "retry-1"), fingerprint=request_fingerprint(first),
+            expires_at=datetime(2999, 1, 1, tzinfo=dt_timezone.utc),
+        )
+
+        with override_settings(IDEMPOTENCY_WAIT_SECONDS=0):
+            self.assertEqual(self.post().status_code, 409)
+
+        def first_request_finishes(seconds):
+            IdempotencyRecord.objects.filter(pk=in_progress.pk).update(
+                completed=True, status_code=201, body=b'{"id": 7}', headers={"Content-Type": "application/json"},
+            )
+
+        with mock.patch("api.idempotency.time.sleep", side_effect=first_request_finishes) as sleep:
+            response = self.post()
+        sleep.assert_called_once()
+        self.assertEqual((response.status_code, response.json()), (201, {"id": 7}))
+        self.assertFalse(Announcement.objects.exists())
+
+    def test_retry_takes_over_an_expired_lease(self):
+        data = json.dumps({"course": self.course.id, "title": "Exam", "message": "Friday"})
+        first = RequestFactory().post(self.url, data, content_type="application/json", **auth_header(self.teacher.user))
+        # The first request's worker was killed: its record stays in progress until the lease ends
+        IdempotencyRecord.objects.create(
+            key=record_key(first, "retry-1"), fingerprint=request_fingerprint(first),
+            expires_at=datetime(2000, 1, 1, tzinfo=dt_timezone.utc),
+        )
+        self.assertEqual(self.post().status_code, 201)
+        record = IdempotencyRecord.objects.get()
+        self.assertTrue(record.completed)
+        # Completed responses are kept for the TTL, not the lease
+        self.assertGreater(record.expires_at - record.created_at, timedelta(seconds=settings.IDEMPOTENCY_LEASE_SECONDS))
+
+
+class RecordingSink:
+    def __init__(self, fail_on_page=None):
+        self.pages = []
+        self.fail_on_page = fail_on_page
+
+    def send(self, messages):
+        if len(self.pages) + 1 == self.fail_on_page:
+            self.fail_on_page = None
+            raise ConnectionError("sink unavailable")
+        self.pages.append([message["id"] for message in messages])
+
+
+@mock.patch.object(Certificate, "generate_certificate")
+class OutboxTests(TestCase):
+    def setUp(self):
+        self.course = make_course(make_teacher("teacher"), total_lessons=2)
+        self.student = make_student("student")
+
+    def enroll(self):
+        Enrollment.objects.create(student=self.student, course=self.course)
+        return Progress.objects.get(student=self.student, course=self.course)
+
+    def test_changes_write_events(self, generate_certificate):
+        progress = self.enroll()
+        Progress.objects.filter(pk=progress.pk).add_completed_lesson()
+        progress = Progress.objects.get(pk=progress.pk)
+        progress.save()  # Nothing changed: no event
+        progress.completed_lessons = 2
+        progress.save()
+
+        events = list(OutboxEvent.objects.order_by("id"))
+        self.assertEqual([event.topic for event in events], [
+            "enrollment.created", "progress.created", "progress.updated", "progress.updated", "certificate.issued",
+        ])
+        self.assertEqual(events[0].payload["enrollment_date"], date.today().isoformat())
+        self.assertEqual(events[2].payload["completed_lessons"], 1)
+        self.assertEqual(events[3].aggregate, f"progress:{progress.pk}")
+        self.assertTrue(events[3].payload["is_completed"])
+
+    def test_bulk_updates_write_events(self, generate_certificate):
+        progress = self.enroll()
+        Progress.objects.filter(course=self.course).update(completed_lessons=2)
+        topics = list(OutboxEvent.objects.filter(aggregate=f"progress:{progress.pk}").values_list("topic", "payload"))
+        self.assertEqual(topics[1][1]["completed_lessons"], 2)
+        self.assertFalse(topics[1][1]["is_completed"])
+        self.assertTrue(topics[2][1]["is_completed"])  # From complete_pending()
+
+    def test_bulk_total_lessons_change_writes_events(self, generate_certificate):
+        progress = self.enroll()
+        Progress.objects.filter(pk=progress.pk).add_completed_lesson()
+        OutboxEvent.objects.all().delete()
+
+        Progress.objects.filter(course=self.course).update(total_lessons=1)
+        events = list(OutboxEvent.objects.filter(topic="progress.updated").values_list("payload", flat=True))
+        self.assertEqual([(event["total_lessons"], event["is_completed"]) for event in events], [(1, False), (1, True)])
+
+        OutboxEvent.objects.all().delete()
+        Progress.objects.filter(course=self.course).update(total_lessons=1)  # No change: no event
+        self.assertFalse(OutboxEvent.objects.filter(topic="progress.updated").exists())
+
+    def test_rolled_back_change_writes_no_event(self, generate_certificate):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            self.enroll()
+            raise RuntimeError
+        with mock.patch("api.models.Progress.objects.create", side_effect=IntegrityError):
+            with self.assertRaises(IntegrityError):
+                self.enroll()  # A failing receiver takes the enrollment and its event with it
+        self.assertFalse(Enrollment.objects.exists())
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def make_events(self, count):
+        OutboxEvent.objects.bulk_create(
+            OutboxEvent(topic="test", aggregate=f"test:{i}", payload={"i": i}) for i in range(count)
+        )
+        return list(OutboxEvent.objects.order_by("id").values_list("id", flat=True))
+
+    def test_failed_page_is_sent_again(self, generate_certificate):
+        ids = self.make_events(5)
+        sink = RecordingSink(fail_on_page=2)
+        with self.assertRaises(ConnectionError):
+            relay(sink, batch_size=2)
+        self.assertEqual(OutboxEvent.objects.filter(delivered_at__isnull=True).count(), 3)
+
+        self.assertEqual(relay(sink, batch_size=2), 3)
+        self.assertEqual(sink.pages, [ids[:2], ids[2:4], ids[4:]])
+        self.assertEqual(relay(sink, batch_size=2), 0)
+
+    def test_crash_before_marking_redelivers(self, generate_certificate):
+        ids = self.make_events(3)
+        sink = RecordingSink()
+        with mock.patch("api.outbox.now", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                relay(sink, batch_size=2)
+        relay(sink, batch_size=2)
+        # At-least-once: the first page arrives twice, nothing is lost
+        self.assertEqual(sink.pages, [ids[:2], ids[:2], ids[2:]])
+
+    def test_http_sink(self, generate_certificate):
+        ids = self.make_events(3)
+        received, statuses = [], [500]
+
+        class Stub(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                status = statuses.pop() if statuses else 204
+                if status == 204:
+                    received.append([event["id"] for event in body["events"]])
+                self.send_response(status)
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Stub)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        sink = HttpSink(f"http://127.0.0.1:{server.server_address[1]}/events")
+
+        with self.assertRaises(urllib.error.HTTPError):
+            relay(sink)
+        self.assertFalse(OutboxEvent.objects.filter(delivered_at__isnull=False).exists())
+        self.assertEqual(relay(sink), 3)
+        self.assertEqual(received, [ids])
+
+    def test_relay_command_sinks(self, generate_certificate):
+        ids = self.make_events(3)
+        out = StringIO()
+        call_command("relay_outbox", "--sink", "stdout", "--batch-size", "2", stdout=out, stderr=StringIO())
+        self.assertEqual([json.loads(line)["id"] for line in out.getvalue().splitlines()], ids)
+
+        OutboxEvent.objects.update(delivered_at=None)
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "outbox.jsonl")
+        self.addCleanup(os.rmdir, directory)
+        self.addCleanup(os.remove, path)
+        FileSink(path).send([{"id": 0}])
+        call_command("relay_outbox", "--sink", f"file:{path}", stderr=StringIO())
+        with open(path) as file:
+            self.assertEqual([json.loads(line)["id"] for line in file], [0, *ids])
+
+
+class DailyStatsTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(Certificate, "generate_certificate")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.teacher = make_teacher("teacher")
+        self.course = make_course(self.teacher, total_lessons=1)
+        self.other_course = make_course(self.teacher, title="Other", total_lessons=1)
+        self.students = [make_student(f"student{i}") for i in range(3)]
+        for student in self.students:
+            Enrollment.objects.create(student=student, course=self.course)
+        Enrollment.objects.create(student=self.students[0], course=self.other_course)
+        Progress.objects.filter(course=self.course, student__in=self.students[:2]).update(completed_lessons=1)
+
+    def rollups(self):
+        return (
+            list(DailyCourseStats.objects.order_by("course_id", "day").values_list("course_id", "day", "enrollments", "completions")),
+            list(DailyTeacherStats.objects.order_by("teacher_id", "day").values_list("teacher_id", "day", "enrollments", "completions")),
+        )
+
+    def test_events_are_counted(self):
+        today = date.today()
+        self.assertEqual(self.rollups(), (
+            [(self.course.id, today, 3, 2), (self.other_course.id, today, 1, 0)],
+            [(self.teacher.id, today, 4, 2)],
+        ))
+
+    def test_counter_row_is_created_once_then_updated(self):
+        day = date(2024, 1, 1)
+        rows = DailyCourseStats.objects.filter(course=self.course, day=day)
+        changes = {"enrollments": F("enrollments") + 1}
+        values = {"course": self.course, "day": day, "enrollments": 1}
+        self.assertFalse(upsert_counter(rows, changes, values, create=False))
+        self.assertFalse(rows.exists())
+        self.assertTrue(upsert_counter(rows, changes, values))
+        self.assertFalse(upsert_counter(rows, changes, values))
+        self.assertEqual(rows.get().enrollments, 2)
+
+    def test_deletes_are_uncounted_like_the_backfill(self):
+        today = date.today()
+        Enrollment.objects.filter(student=self.students[2], course=self.course).delete()
+        Progress.objects.filter(student=self.students[0], course=self.course).delete()
+        self.other_course.delete()
+        live = self.rollups()
+        self.assertEqual(live, ([(self.course.id, today, 2, 1)], [(self.teacher.id, today, 2, 1)]))
+        call_command("backfill_daily_stats", stdout=StringIO())
+        self.assertEqual(self.rollups(), live)
+
+    def test_backfill_matches_incremental_counts(self):
+        Enrollment.objects.filter(course=self.other_course).update(enrollment_date=date(2024, 5, 1))
+        Progress.objects.filter(course=self.course).update(completion_date=date(2024, 5, 2))
+        archived = make_course(self.teacher, title="Archived")
+        DailyCourseStats.objects.create(course=archived, day=date(2024, 5, 1), enrollments=7)
+        CourseArchive.objects.create(course=archived, data="")
+
+        call_command("backfill_daily_stats", stdout=StringIO())
+        course_rows, teacher_rows = self.rollups()
+        self.assertEqual(course_rows, [
+            (self.course.id, date(2024, 5, 2), 0, 2),
+            (self.course.id, date.today(), 3, 0),
+            (self.other_course.id, date(2024, 5, 1), 1, 0),
+            (archived.id, date(2024, 5, 1), 7, 0),  # Kept: its enrollments live in the archive
+        ])
+        self.assertEqual(teacher_rows, [
+            (self.teacher.id, date(2024, 5, 1), 8, 0),
+            (self.teacher.id, date(2024, 5, 2), 0, 2),
+            (self.teacher.id, date.today(), 3, 0),
+        ])
+
+        # A range only touches its own days
+        DailyCourseStats.objects.filter(day=date.today()).delete()
+        call_command("backfill_daily_stats", "--from", "2024-05-02", "--to", "2024-05-02", stdout=StringIO())
+        self.assertEqual(len(self.rollups()[0]), 3)
+        call_command("backfill_daily_stats", "--from", date.today().isoformat(), stdout=StringIO())
+        self.assertEqual(self.rollups()[0][1], (self.course.id, date.today(), 3, 0))
+
+    def test_endpoint_returns_zero_filled_series(self):
+        today = date.today()
+        url = reverse("daily-stats")
+        params = {"course": self.course.id, "start": "2024-01-01", "end": "2024-01-03"}
+        response = self.client.get(url, params, **auth_header(self.teacher.user))
+        self.assertEqual(response.json()["series"], [
+            {"date": f"2024-01-0{day}", "enrollments": 0, "completions": 0} for day in (1, 2, 3)
+        ])
+
+        with self.assertNumQueries(3):  # User, ownership, rollup rows
+            response = self.client.get(url, {"teacher": self.teacher.id}, **auth_header(self.teacher.user))
+        body = response.json()
+        self.assertEqual(len(body["series"]), 30)
+        self.assertEqual(body["series"][-1], {"date": today.isoformat(), "enrollments": 4, "completions": 2})
+        self.assertEqual(body["totals"], {"enrollments": 4, "completions": 2})
+
+    def test_endpoint_checks_access_and_params(self):
+        url = reverse("daily-stats")
+        student = auth_header(self.students[0].user)
+        self.assertEqual(self.client.get(url, {"course": self.course.id}, **student).status_code, 403)
+        staff = auth_header(make_user("staff", is_staff=True))
+        self.assertEqual(self.client.get(url, {"course": self.course.id}, **staff).status_code, 200)
+        self.assertEqual(self.client.get(url, **staff).status_code, 400)
+        self.assertEqual(self.client.get(url, {"course": 1, "teacher": 1}, **staff).status_code, 400)
+        self.assertEqual(self.client.get(url, {"course": 1, "start": "May"}, **staff).status_code, 400)
+        self.assertEqual(self.client.get(url, {"course": 1, "start": "2020-01-01"}, **staff).status_code, 400)
+
+
+TENANT_HOSTS = {"north.example.com": "north", "south.example.com": "south"}
+
+
+@override_settings(
+    TENANTS={"north": "default", "south": "default"}, TENANT_HOSTS=TENANT_HOSTS,
+    ALLOWED_HOSTS=["testserver", *TENANT_HOSTS],
+)
+class TenantResolutionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        with use_tenant("north"):
+            self.user = make_user("pupil", password="pass1234")
+
+    def login(self, host):
+        response = self.client.post(reverse("login"), {"username": "pupil", "password": "pass1234"}, HTTP_HOST=host)
+        return response.json()
+
+    def test_router_and_cache_keys_follow_the_tenant(self):
+        router = TenantRouter()
+        self.assertIsNone(router.db_for_read(Course))
+        with override_settings(TENANTS={"north": "tenant_north"}), use_tenant("north"):
+            self.assertEqual(router.db_for_read(Course), "tenant_north")
+            self.assertEqual(router.db_for_write(User), "tenant_north")
+            self.assertIsNone(router.db_for_read(Session))
+
+        cache.set("key", "shared")
+        with use_tenant("north"):
+            self.assertIsNone(cache.get("key"))
+            cache.set("key", "north")
+        self.assertEqual(cache.get("key"), "shared")
+
+    def test_image_workers_run_in_the_tenant(self):
+        seen = threading.Event()
+        calls = []
+
+        def record(model, pk, field_name, using):
+            calls.append((current_tenant(), using))
+            seen.set()
+
+        with mock.patch("api.images.normalize_image", side_effect=record), use_tenant("north"):
+            self.user.profile_pic = "profile_pics/pupil.png"
+            with self.captureOnCommitCallbacks(execute=True):
+                process_image_later(self.user, "profile_pic")
+        self.assertTrue(seen.wait(5))
+        self.assertEqual(calls, [("north", "default")])
+
+    def test_users_belong_to_the_tenant_they_were_created_in(self):
+        self.assertEqual(self.user.tenant, "north")
+        self.assertEqual(make_user("shared").tenant, "")
+
+    def test_tokens_carry_the_tenant_and_are_checked_against_the_host(self):
+        tokens = self.login("north.example.com")
+        bearer = {"HTTP_AUTHORIZATION": f"Bearer {tokens['access']}"}
+        self.assertEqual(RefreshToken(tokens["refresh"])["tenant"], "north")
+
+        seen = []
+        with mock.patch("api.views.UserProfileView.get", side_effect=lambda request: seen.append(request.tenant) or HttpResponse()):
+            self.assertEqual(self.client.get(reverse("profile"), HTTP_HOST="north.example.com", **bearer).status_code, 200)
+            self.assertEqual(self.client.get(reverse("profile"), **bearer).status_code, 200)  # Claim on a shared host
+        self.assertEqual(seen, ["north", "north"])
+
+        self.assertEqual(self.client.get(reverse("profile"), HTTP_HOST="south.example.com", **bearer).status_code, 403)
+        self.assertEqual(
+            self.client.get(reverse("profile"), HTTP_HOST="north.example.com", **auth_header(self.user)).status_code, 403
+        )  # Issued without a tenant
+        response = self.client.post(
+            reverse("token_refresh"), json.dumps({"refresh": tokens["refresh"]}),
+            content_type="application/json", HTTP_HOST="south.example.com",
+        )
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.client.post(reverse("token_refresh"), {"refresh": tokens["refresh"]}).status_code, 200)
+
+
+@skipUnless(len(settings.TENANTS) >= 2, "set TENANT_DATABASES to two or more databases")
+class TenantDatabaseTests(TestCase):
+    """Run with e.g. TENANT_DATABASES=north=sqlite:////tmp/north.db,south=sqlite:////tmp/south.db"""
+    databases = "__all__"
+
+    def setUp(self):
+        self.first, self.second = list(settings.TENANTS)[:2]
+        self.hosts = {f"{self.first}.example.com": self.first, f"{self.second}.example.com": self.second}
+        self.enterContext(override_settings(TENANT_HOSTS=self.hosts, ALLOWED_HOSTS=["testserver", *self.hosts]))
+
+    def test_each_school_has_its_own_tables(self):
+        for host in self.hosts:
+            response = self.client.post(reverse("register"), {
+                "username": "same", "email": "same@example.com", "password": "pass1234",
+                "mobile_number": "555", "role": "student", "enrollment_year": 2024, "grade": "9",
+            }, HTTP_HOST=host)
+            self.assertEqual(response.status_code, 201, response.content)
+        for tenant, alias in settings.TENANTS.items():
+            if tenant in (self.first, self.second):
+                self.assertEqual(list(User.objects.using(alias).values_list("username", "tenant")), [("same", tenant)])
+        self.assertFalse(User.objects.exists())
+
+        for host in self.hosts:
+            tokens = self.client.post(reverse("login"), {"username": "same", "password": "pass1234"}, HTTP_HOST=host).json()
+            profile = self.client.get(reverse("profile"), HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+            self.assertEqual(profile.status_code, 200)
+
+    def test_enrollment_is_atomic_in_the_tenant_database(self):
+        alias = settings.TENANTS[self.first]
+        with use_tenant(self.first):
+            course = make_course(make_teacher("teacher"))
+            student = make_student("student")
+            enroll_student(student, course.id)
+            with self.assertRaises(IntegrityError):
+                enroll_student(student, course.id)  # Already enrolled: the seat goes back
+        self.assertEqual(Course.objects.using(alias).get(pk=course.pk).seats_taken, 1)
+        self.assertEqual(Enrollment.objects.using(alias).count(), 1)
+
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+    @mock.patch.object(Certificate, "generate_certificate")
+    def test_archive_courses_runs_in_the_tenant_database(self, generate_certificate):
+        alias = settings.TENANTS[self.first]
+        make_course(make_teacher("default-teacher"))  # Not archived: it lives in 'default'
+        with use_tenant(self.first):
+            course = make_course(make_teacher("teacher"))
+            Course.objects.filter(pk=course.pk).update(start_date=date(2015, 1, 1), end_date=date(2015, 6, 30))
+            Enrollment.objects.create(student=make_student("student"), course=course)
+            self.assertEqual(table_sizes([Enrollment])["api_enrollment"][0], 1)
+            out = StringIO()
+            call_command("archive_courses", stdout=out)
+        self.assertIn("1 course(s) to archive", out.getvalue())
+        self.assertEqual(CourseArchive.objects.using(alias).get().row_counts["api.enrollment"], 1)
+        self.assertFalse(Enrollment.objects.using(alias).exists())
+        self.assertFalse(CourseArchive.objects.exists())
+
+    @mock.patch.object(Certificate, "generate_certificate")
+    def test_move_tenant_keeps_rows_and_keys(self, generate_certificate):
+        source = settings.TENANTS[self.first]
+        with use_tenant(self.first):
+            course = make_course(make_teacher("teacher"), total_lessons=1)
+            student = make_student("student")
+            Enrollment.objects.create(student=student, course=course)
+            Progress.objects.filter(course=course).add_completed_lesson()
+            course.students.add(student)
+            # Group memberships point into the auth app, which isn't moved
+            student.user.groups.add(Group.objects.create(name="pupils"))
+        with use_tenant(self.second):
+            make_student("outsider")
+
+        # The membership would be lost with the source rows
+        with self.assertRaisesMessage(CommandError, "1 rows can't be copied"):
+            call_command("move_tenant", self.first, "--to", "default", stdout=StringIO())
+        self.assertFalse(User.objects.exists())
+        self.assertEqual(User.objects.using(source).count(), 2)
+
+        out = StringIO()
+        call_command("move_tenant", self.first, "--to", "default", "--force", stdout=out)
+        self.assertEqual(User.objects.filter(tenant=self.first).count(), 2)
+        self.assertEqual(Course.objects.get().pk, course.pk)
+        self.assertEqual(list(Course.objects.get().students.all()), [Student.objects.get(pk=student.pk)])
+        self.assertTrue(Progress.objects.get(course_id=course.pk).is_completed)
+        self.assertTrue(Certificate.objects.filter(course_id=course.pk).exists())
+        buckets = ProgressBucket.objects.filter(course_id=course.pk, count__gt=0)
+        self.assertEqual(list(buckets.values_list("completed_lessons", flat=True)), [1])
+        self.assertFalse(User.objects.using(source).exists())
+        self.assertFalse(Course.objects.using(source).exists())
+        self.assertEqual(User.objects.using(settings.TENANTS[self.second]).count(), 1)
+        self.assertRegex(out.getvalue(), r"api.User_groups +1 skipped")
@@ -0,0 +1,145 @@
+"""
+Rate limits shared by all gunicorn workers.
+
+Each throttle scope (login, register, upload_course, upload_file) can be limited
+per client IP, per user and for the whole route, with rates configured in
+REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'] as '<scope>.ip', '<scope>.user' and
+'<scope>.route'. Requests are counted in fixed windows and the limit is applied
+to a sliding window estimate: the current window's count plus the previous
+window's count weighted by how much of it still overlaps the sliding window.
+Client IPs are REMOTE_ADDR, or the X-Forwarded-For entry added by the outermost
+of REST_FRAMEWORK['NUM_PROXIES'] trusted proxies.
+
+Counters live in the database (THROTTLE_STORE='database', shared by every
+worker and host) or in the cache (THROTTLE_STORE='cache', shared when
+CACHE_BACKEND is 'file' or 'redis'). A rejection only reads the counters.
+`manage.py clear_rate_limits` deletes database counters of keys that went quiet.
+"""
+import hashlib
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+from api.models import RateLimitCounter, upsert_counter
+
+
+def parse_rate(rate):
+    """'10/min' -> (10, 60), same format as DRF's throttles."""
+    count, period = rate.split('/')
+    return int(count), {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}[period[0]]
+
+
+class DatabaseCounterStore:
+    def counts(self, key, window):
+        rows = RateLimitCounter.objects.filter(key=key, window__in=(window - 1, window)).values_list('window', 'count')
+        counts = dict(rows)
+        return counts.get(window - 1, 0), counts.get(window, 0)
+
+    def increment(self, key, window, period):
+        created = upsert_counter(
+            RateLimitCounter.objects.filter(key=key, window=window),
+            {'count': F('count') + 1},
+            {
+                'key': key, 'window': window, 'count': 1,
+                'expires_at': datetime.fromtimestamp((window + 2) * period, tz=timezone.utc),
+            },
+        )
+        if created:
+            # First request of a new window: drop windows that can no longer count
+            RateLimitCounter.objects.filter(key=key, window__lt=window - 1).delete()
+
+
+class CacheCounterStore:
+    def _cache_key(self, key, window):
+        return f"throttle:{key}:{window}"
+
+    def counts(self, key, window):
+        keys = [self._cache_key(key, window - 1), self._cache_key(key, window)]
+        counts = cache.get_many(keys)
+        return counts.get(keys[0], 0), counts.get(keys[1], 0)
+
+    def increment(self, key, window, period):
+        cache_key = self._cache_key(key, window)
+        cache.add(cache_key, 0, timeout=period * 2)
+        try:
+            cache.incr(cache_key)
+        except ValueError:  # Expired between add() and incr()
+            cache.set(cache_key, 1, timeout=period * 2)
+
+
+COUNTER_STORES = {
+    'database': DatabaseCounterStore(),
+    'cache': CacheCounterStore(),
+}
+
+
+class SharedRateThrottle(BaseThrottle):
+    """Sliding window limits per IP, user and route for the subclass's `scope`."""
+    scope = None
+    timer = time.time
+
+    def get_limits(self, request, view):
+        """(kind, key, rate) for every configured limit of this scope."""
+        rates = api_settings.DEFAULT_THROTTLE_RATES
+        idents = {
+            'ip': self.get_ident(request),
+            'user': self.get_user_ident(request),
+            'route': 'all',
+        }
+        for kind, ident in idents.items():
+            rate = rates.get(f"{self.scope}.{kind}")
+            if rate and ident is not None:
+                yield kind, f"{self.scope}:{kind}:{ident}", rate
+
+    def get_user_ident(self, request):
+        if request.user and request.user.is_authenticated:
+            return request.user.pk
+        # Anonymous (login/register): limit attempts on one account, whoever sends them
+        username = request.data.get('username') if hasattr(request, 'data') else None
+        if isinstance(username, str) and username:
+            return hashlib.sha1(username.lower().encode()).hexdigest()
+        return None
+
+    def allow_request(self, request, view):
+        store = COUNTER_STORES[settings.THROTTLE_STORE]
+        now = self.timer()
+        self.wait_seconds = None
+        accepted = []
+
+        for kind, key, rate in self.get_limits(request, view):
+            limit, period = parse_rate(rate)
+            window, elapsed = divmod(now, period)
+            previous, current = store.counts(key, int(window))
+            estimate = previous * (1 - elapsed / period) + current
+            if estimate >= limit:
+                self.wait_seconds = period - elapsed
+                return False
+            accepted.append((key, int(window), period))
+
+        for key, window, period in accepted:
+            store.increment(key, window, period)
+        return True
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class LoginRateThrottle(SharedRateThrottle):
+    scope = 'login'
+
+
+class RegisterRateThrottle(SharedRateThrottle):
+    scope = 'register'
+
+
+class UploadCourseRateThrottle(SharedRateThrottle):
+    scope = 'upload_course'
+
+
+class UploadFileRateThrottle(SharedRateThrottle):
+    scope = 'upload_file'
@@ -1,17 +1,35 @@
 from django.urls import path
-from rest_framework_simplejwt.views import TokenRefreshView
+from django.utils.module_loading import import_string
+from django.views.decorators.csrf import csrf_exempt
 from .views import(
     RegisterView, LoginView, UserProfileView,upload_course,
     AssignmentCreateView,AssignmentEditDeleteView,EnrollCourseView,
     UploadCourseFileView,EditCourseView,DeleteCourseFileView,DeleteCourseView,
     AnnouncementCreateView,AnnouncementDetailView,EnrolledCoursesView,
-    ProgressDetailView,MyCoursesView,CourseDetailView,AnnouncementUpdateDeleteView,get_all_courses)
+    ProgressDetailView,MyCoursesView,CourseDetailView,AnnouncementUpdateDeleteView,get_all_courses,
+    CompleteLessonView,BatchView,StudentHomeView,CourseCertificatesZipView,
+    ProfileArtifactView,course_recommendations,CourseRankingView,CourseArchiveView,
+    DailyStatsView)
+
+
+def lazy_view(dotted_path):
+    """Import a class-based view on its first request instead of when the URLconf loads."""
+    view = None
+
+    @csrf_exempt
+    def load_and_dispatch(request, *args, **kwargs):
+        nonlocal view
+        if view is None:
+            view = import_string(dotted_path).as_view()
+        return view(request, *args, **kwargs)
+
+    return load_and_dispatch
 
 urlpatterns = [
     path('courses/<int:course_id>/', CourseDetailView.as_view(), name='course-detail'),
     path('register/', RegisterView.as_view(), name='register'),
     path('login/', LoginView.as_view(), name='login'),
-    path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('token/refresh/', lazy_view('rest_framework_simplejwt.views.TokenRefreshView'), name='token_refresh'),
     path('profile/', UserProfileView.as_view(), name='profile'),
     path('upload-course/', upload_course, name='upload-course'),
     path('enroll/', EnrollCourseView.as_view(), name='enroll-course'),
@@ -25,8 +43,17 @@ urlpatterns = [
     path('my-courses/', MyCoursesView.as_view(), name='my-courses'),
     path('announcements/<int:pk>/', AnnouncementDetailView.as_view(), name='announcement-detail'),
     path('progress/<int:pk>/', ProgressDetailView.as_view(), name='progress-detail'),
+    path('courses/<int:course_id>/lessons/<int:lesson_number>/complete/', CompleteLessonView.as_view(), name='complete-lesson'),
     path('announcements/create/', AnnouncementCreateView.as_view(), name='create-announcement'),
     path('announcements/<int:pk>/', AnnouncementUpdateDeleteView.as_view(), name='announcement-detail'),
-    path('courses/', get_all_courses, name="all-courses")
+    path('courses/', get_all_courses, name="all-courses"),
+    path('courses/<int:course_id>/archive/', CourseArchiveView.as_view(), name='course-archive'),
+    path('courses/<int:course_id>/ranking/', CourseRankingView.as_view(), name='course-ranking'),
+    path('courses/<int:course_id>/recommendations/', course_recommendations, name='course-recommendations'),
+    path('analytics/daily/', DailyStatsView.as_view(), name='daily-stats'),
+    path('batch/', BatchView.as_view(), name='batch'),
+    path('home/', StudentHomeView.as_view(), name='student-home'),
+    path('profiles/<str:name>', ProfileArtifactView.as_view(), name='profile-artifact'),
+    path('courses/<int:course_id>/certificates.zip', CourseCertificatesZipView.as_view(), name='course-certificates-zip'),
 ]
 
@@ -1,7 +1,29 @@
 # Python & Django imports
-from datetime import date
+import json
+import logging
+import mimetypes
+import os
+import posixpath
+import re
+import zipfile
+from datetime import date, timedelta
+from io import BytesIO
+from urllib.parse import quote, urlsplit
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import IntegrityError, router, transaction
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.urls import Resolver404, resolve
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from django.utils.text import slugify
+from django.views.decorators.http import require_safe
 from rest_framework import serializers
 
 
@@ -9,17 +31,28 @@ from rest_framework import serializers
 from rest_framework import generics, permissions, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
 from rest_framework.permissions import IsAuthenticated, AllowAny
-from rest_framework.exceptions import PermissionDenied
-
-# JWT for authentication
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework.exceptions import AuthenticationFailed, PermissionDenied
+from rest_framework.settings import api_settings
+
+# App cache helpers, database routing, batching, image uploads, rate limits and archives
+from api.archive import ARCHIVED_MODELS, archived_rows
+from api.batch import get_object, identity_map
+from api.cache import cached_read
+from api.images import process_image_later, validate_image
+from api.routers import replica_reads
+from api.tenants import current_tenant
+from api.throttling import (
+    LoginRateThrottle, RegisterRateThrottle, UploadCourseRateThrottle, UploadFileRateThrottle
+)
 
 # App models
 from api.models import (
     Course, Student, Progress, Enrollment,
-    Announcement, Assignment, CourseFile, Teacher
+    Announcement, Assignment, CourseFile, Teacher, Certificate, LessonCompletion,
+    WaitlistEntry, CourseRecommendation, ProgressBucket, CourseArchive,
+    DailyCourseStats, DailyTeacherStats, enroll_student
 )
 
 # App serializers
@@ -28,20 +61,23 @@ from api.serializers import (
     AssignmentSerializer, CourseFileSerializer, CourseSerializer,
     UserSerializer, TeacherSerializer, StudentSerializer, RegisterSerializer,
     EnrolledCourseSerializer, TeacherCourseSerializer,
-    CourseDetailSerializer, BasicCourseSerializer
+    CourseDetailSerializer, BasicCourseSerializer, sparse_params
 )
 
 User = get_user_model()
+logger = logging.getLogger(__name__)
 
 # Register API
 class RegisterView(generics.CreateAPIView):
     queryset = User.objects.all()
     serializer_class = RegisterSerializer
     permission_classes = [permissions.AllowAny]
+    throttle_classes = [RegisterRateThrottle]  # Password hashing is expensive
 
 # Login API (JWT Token)
 class LoginView(APIView):
     permission_classes = [permissions.AllowAny]
+    throttle_classes = [LoginRateThrottle]  # check_password is expensive
 
     def post(self, request):
         username = request.data.get("username")
@@ -49,7 +85,12 @@ class LoginView(APIView):
         user = User.objects.filter(username=username).first()
 
         if user and user.check_password(password):
+            from rest_framework_simplejwt.tokens import RefreshToken  # Loaded on first login, not at startup
+
             refresh = RefreshToken.for_user(user)
+            tenant = current_tenant()
+            if tenant:
+                refresh[settings.TENANT_CLAIM] = tenant  # Copied into the access token
             return Response({
                 "refresh": str(refresh),
                 "access": str(refresh.access_token),
@@ -66,9 +107,9 @@ class UserProfileView(APIView):
         # ✅ Pass `request` in context for absolute URLs
         user_data = UserSerializer(user, context={'request': request}).data
 
-        # Check if the user is a teacher
+        # Check if the user is a teacher (reverse relations are cached on the user)
         try:
-            teacher = Teacher.objects.get(user=user)
+            teacher = user.teacher
             user_data['role'] = "Teacher"
             user_data['teacher_details'] = TeacherSerializer(teacher).data
         except Teacher.DoesNotExist:
@@ -76,19 +117,18 @@ class UserProfileView(APIView):
 
         # Check if the user is a student
         try:
-            student = Student.objects.get(user=user)
+            student = user.student_profile
             user_data['role'] = "Student"
             user_data['student_details'] = StudentSerializer(student).data
         except Student.DoesNotExist:
             pass
 
-        # ✅ Optional: remove print in production
-        print(user_data)
         return Response(user_data)
 
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])  # Only logged-in users can access
+@throttle_classes([UploadCourseRateThrottle])
 def upload_course(request):
     try:
         user = request.user
@@ -105,10 +145,17 @@ def upload_course(request):
         print("Received Data:", data)  # ✅ Debug request data
         print("Received Files:", request.FILES)
 
+        # ✅ Check the thumbnail's size and dimensions from its header before anything decodes it
+        try:
+            thumbnail = validate_image(request.FILES.get('thumbnail'))
+        except serializers.ValidationError as e:
+            return Response({"thumbnail": e.detail}, status=status.HTTP_400_BAD_REQUEST)
+
         # ✅ Pass both `data` and `FILES` to serializer
         serializer = CourseSerializer(data=data, context={'request': request})
         if serializer.is_valid():
-            course = serializer.save(thumbnail=request.FILES.get('thumbnail'))  # ✅ Store file
+            course = serializer.save(thumbnail=thumbnail)  # ✅ Store file
+            process_image_later(course, 'thumbnail')  # EXIF strip + resize off the request
 
             # ✅ Print stored course data after saving
             print("Stored Course Data:", serializer.data)
@@ -134,17 +181,22 @@ class EnrollCourseView(APIView):
             return Response({"error": "Only students can enroll in courses."}, status=403)
 
         course_id = request.data.get("course")
-        try:
-            course = Course.objects.get(id=course_id)
-        except Course.DoesNotExist:
+        if not Course.objects.filter(id=course_id).exists():
             return Response({"error": "Course not found."}, status=404)
 
-        # Create enrollment
-        enrollment, created = Enrollment.objects.get_or_create(student=student, course=course)
+        if Enrollment.objects.filter(student=student, course_id=course_id).exists():
+            return Response({"message": "Already enrolled in this course."}, status=400)
 
-        if not created:
+        # Claim a seat (or a waitlist spot when the course is full)
+        try:
+            result = enroll_student(student, course_id)
+        except IntegrityError:  # A parallel request enrolled the same student
             return Response({"message": "Already enrolled in this course."}, status=400)
 
+        if isinstance(result, WaitlistEntry):
+            position = WaitlistEntry.objects.filter(course_id=course_id, position__lte=result.position).count()
+            return Response({"message": "Course is full, added to the waitlist.", "waitlist_position": position}, status=202)
+
         return Response({"message": "Successfully enrolled!"}, status=201)
 
 
@@ -152,6 +204,7 @@ class UploadCourseFileView(generics.CreateAPIView):
     queryset = CourseFile.objects.all()
     serializer_class = CourseFileSerializer
     permission_classes = [IsAuthenticated]
+    throttle_classes = [UploadFileRateThrottle]
 
     def create(self, request, *args, **kwargs):
         user = request.user
@@ -357,33 +410,180 @@ class ProgressDetailView(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = ProgressSerializer
     permission_classes = [permissions.IsAuthenticated, IsCourseTeacher]
 
+class CompleteLessonView(APIView):
+    """
+    Mark lesson N of a course as completed by the logged-in student.
+    Idempotent: completing the same lesson again changes nothing.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, course_id, lesson_number):
+        try:
+            student = request.user.student_profile
+        except Student.DoesNotExist:
+            return Response({"error": "Only students can complete lessons."}, status=status.HTTP_403_FORBIDDEN)
+
+        progress = Progress.objects.filter(student=student, course_id=course_id).only('id', 'total_lessons').first()
+        if not progress:
+            return Response({"error": "You are not enrolled in this course."}, status=status.HTTP_404_NOT_FOUND)
+        if not 1 <= lesson_number <= progress.total_lessons:
+            return Response({"error": "Lesson not found in this course."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            with transaction.atomic(using=router.db_for_write(LessonCompletion)):
+                LessonCompletion.objects.create(progress=progress, lesson_number=lesson_number)
+                Progress.objects.filter(pk=progress.pk).add_completed_lesson()
+            recorded = True
+        except IntegrityError:
+            recorded = False  # Already completed earlier
+
+        progress.refresh_from_db(fields=['completed_lessons', 'total_lessons', 'is_completed', 'completion_date'])
+        return Response({
+            "lesson": lesson_number,
+            "recorded": recorded,
+            "completed_lessons": progress.completed_lessons,
+            "total_lessons": progress.total_lessons,
+            "is_completed": progress.is_completed,
+            "completion_date": progress.completion_date,
+        }, status=status.HTTP_201_CREATED if recorded else status.HTTP_200_OK)
+
+@replica_reads
+class StudentHomeView(APIView):
+    """
+    Everything the student home screen needs in one call: profile, enrolled
+    courses with progress, next due assignments and recent announcements.
+    Runs a fixed number of queries however many courses the student has.
+    """
+    permission_classes = [IsAuthenticated]
+    upcoming_assignments = 5
+    recent_announcements = 5
+
+    def get(self, request):
+        user = request.user
+        try:
+            student = user.student_profile
+        except Student.DoesNotExist:
+            return Response({"error": "Only students have a home screen."}, status=status.HTTP_403_FORBIDDEN)
+
+        profile = UserSerializer(user, context={'request': request}).data
+        profile['role'] = "Student"
+        profile['student_details'] = StudentSerializer(student).data
+
+        enrollments = (
+            Enrollment.objects.filter(student=student)
+            .select_related('course')
+            .only('enrollment_date', 'course__id', 'course__title', 'course__thumbnail', 'course__total_lessons')
+            .order_by('-enrollment_date', '-id')
+        )
+        progress = {
+            row['course_id']: row
+            for row in Progress.objects.filter(student=student)
+            .values('course_id', 'completed_lessons', 'total_lessons', 'is_completed')
+        }
+
+        courses = []
+        for enrollment in enrollments:
+            course = enrollment.course
+            course_progress = progress.get(course.id, {})
+            completed = course_progress.get('completed_lessons', 0)
+            total = course_progress.get('total_lessons', course.total_lessons)
+            courses.append({
+                "course_id": course.id,
+                "title": course.title,
+                "thumbnail": request.build_absolute_uri(course.thumbnail.url) if course.thumbnail else None,
+                "enrollment_date": enrollment.enrollment_date,
+                "completed_lessons": completed,
+                "total_lessons": total,
+                "progress_percent": round(min(completed, total) * 100 / total, 1) if total else 100.0,
+                "is_completed": course_progress.get('is_completed', False),
+            })
+
+        assignments = list(
+            Assignment.objects.filter(course__enrollments__student=student, due_date__gte=date.today())
+            .order_by('due_date', 'id')
+            .values('id', 'course_id', 'course__title', 'title', 'due_date')[:self.upcoming_assignments]
+        )
+        announcements = list(
+            Announcement.objects.filter(course__enrollments__student=student)
+            .order_by('-created_at', '-id')
+            .values('id', 'course_id', 'course__title', 'title', 'message', 'created_at')[:self.recent_announcements]
+        )
+
+        return Response({
+            "profile": profile,
+            "courses": courses,
+            "upcoming_assignments": [
+                {"id": a['id'], "course_id": a['course_id'], "course_title": a['course__title'],
+                 "title": a['title'], "due_date": a['due_date']}
+                for a in assignments
+            ],
+            "recent_announcements": [
+                {"id": a['id'], "course_id": a['course_id'], "course_title": a['course__title'],
+                 "title": a['title'], "message": a['message'], "created_at": a['created_at']}
+                for a in announcements
+            ],
+        })
+
+
+@replica_reads
 class EnrolledCoursesView(generics.ListAPIView):
     serializer_class = EnrolledCourseSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return Enrollment.objects.filter(student=self.request.user.student_profile)
+        # One query for the page, not one per enrollment for course.title
+        return (
+            Enrollment.objects.filter(student=self.request.user.student_profile)
+            .select_related('course')
+            .only('enrollment_date', 'course__id', 'course__title')
+        )
 
 
 
+@replica_reads
 class MyCoursesView(generics.ListAPIView):
     serializer_class = TeacherCourseSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return Course.objects.filter(teacher__user=self.request.user)
+        fields, expand = sparse_params(self.request)
+        queryset = Course.objects.filter(teacher__user=self.request.user)
+        return TeacherCourseSerializer(fields=fields, expand=expand).sparse_queryset(queryset)
 
     def list(self, request, *args, **kwargs):
         queryset = self.get_queryset()
-        serializer = self.get_serializer(queryset, many=True, context={'request': request}) 
+        fields, expand = sparse_params(request)
+        serializer = self.get_serializer(queryset, many=True, context={'request': request}, fields=fields, expand=expand)
         return Response(serializer.data)
 
+def course_detail_data(course_id, request):
+    """Full course details (files, assignments, announcements), cached until any of them change."""
+    fields, expand = sparse_params(request)
+
+    def build():
+        queryset = CourseDetailSerializer(fields=fields, expand=expand).sparse_queryset(Course.objects.filter(id=course_id))
+        return CourseDetailSerializer(queryset.get(), context={'request': request}, fields=fields, expand=expand).data
+
+    return cached_read(
+        'course-detail', [Course, CourseFile, Assignment, Announcement], build,
+        course_id, request.build_absolute_uri('/'), request.query_params.get('fields'), request.query_params.get('expand')
+    )
+
+
+def basic_course_data(course_id, request):
+    """Public course details for users who aren't enrolled / don't own the course."""
+    fields, expand = sparse_params(request)
+    queryset = BasicCourseSerializer(fields=fields, expand=expand).sparse_queryset(Course.objects.filter(id=course_id))
+    return BasicCourseSerializer(queryset.get(), fields=fields, expand=expand).data
+
+@replica_reads
 class CourseDetailView(APIView):
     permission_classes = [IsAuthenticated]  # Ensure only logged-in users can access
 
     def get(self, request, course_id):
         user = request.user
-        course = Course.objects.filter(id=course_id).first()
+        # Only what the access checks need; the response data is loaded below
+        course = get_object(Course.objects.only('id', 'teacher'), course_id)
 
         if not course:
             return Response({"error": "Course not found"}, status=404)
@@ -394,25 +594,19 @@ class CourseDetailView(APIView):
             is_enrolled = Enrollment.objects.filter(student=student, course=course).exists()
 
             if is_enrolled:
-                serializer = CourseDetailSerializer(course, context={'request': request})
-                print(serializer.data)  # Full details
-                return Response({**serializer.data, "edit": False, "is_enrolled": True})  # No edit access
+                return Response({**course_detail_data(course.id, request), "edit": False, "is_enrolled": True})  # No edit access
             else:
-                serializer = BasicCourseSerializer(course) 
-                print(serializer.data)   # Basic details
-                return Response({**serializer.data, "edit": False, "is_enrolled": False})  # No edit access
+                return Response({**basic_course_data(course.id, request), "edit": False, "is_enrolled": False})  # No edit access
 
         # If user is a teacher, check if they are the course owner
         if hasattr(user, 'teacher'):
-            is_teacher = course.teacher == user.teacher  # Check if the logged-in user is the course teacher
+            is_teacher = course.teacher_id == user.teacher.id  # Check if the logged-in user is the course teacher
             if is_teacher:
-                serializer = CourseDetailSerializer(course) 
-                print(serializer.data)  # Use full details
+                data = course_detail_data(course.id, request)  # Use full details
             else:
-                serializer = BasicCourseSerializer(course)  
-                print(serializer.data) # Use basic details if not their course
+                data = basic_course_data(course.id, request)  # Use basic details if not their course
 
-            return Response({**serializer.data, "edit": is_teacher, "is_enrolled": True})  
+            return Response({**data, "edit": is_teacher, "is_enrolled": True})
 
         # If neither student nor teacher, return error
         return Response({"error": "Access denied"}, status=403)
@@ -454,9 +648,443 @@ class AnnouncementUpdateDeleteView(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = AnnouncementSerializer
     permission_classes = [IsTeacherOwner]
 
+@replica_reads
 @api_view(['GET'])
 @permission_classes([AllowAny])  # ✅ Allow all users (students & teachers) to see courses
 def get_all_courses(request):
-    courses = Course.objects.all()
-    serializer = CourseSerializer(courses, many=True, context={"request": request})
-    return Response(serializer.data)
+    # ?fields=id,title,thumbnail limits both the response and the columns fetched
+    fields, expand = sparse_params(request)
+
+    def build():
+        courses = CourseSerializer(fields=fields, expand=expand).sparse_queryset(Course.objects.all())
+        return CourseSerializer(courses, many=True, context={"request": request}, fields=fields, expand=expand).data
+
+    # Thumbnail URLs are absolute, so the host is part of the key
+    data = cached_read(
+        'courses', [Course], build,
+        request.build_absolute_uri('/'), request.query_params.get('fields'), request.query_params.get('expand')
+    )
+    return Response(data)
+
+
+@replica_reads
+class CourseRankingView(APIView):
+    """
+    Where students stand in a course, read from the ProgressBucket histogram
+    (at most total_lessons + 1 rows, however many students there are).
+    Enrolled students get their own rank and percentile; the course teacher
+    gets the histogram and the class sorted by completed lessons (?offset=&limit=).
+    """
+    permission_classes = [IsAuthenticated]
+    max_limit = 200
+
+    def get(self, request, course_id):
+        user = request.user
+        course = get_object_or_404(
+            Course.objects.select_related('teacher').only('id', 'total_lessons', 'teacher__user'), id=course_id
+        )
+        histogram = list(
+            ProgressBucket.objects.filter(course_id=course_id, count__gt=0)
+            .order_by('-completed_lessons')
+            .values_list('completed_lessons', 'count')
+        )
+        students = sum(count for _, count in histogram)
+        # Rank = 1 + students with more completed lessons (ties share a rank)
+        ranks, above = {}, 0
+        for lessons, count in histogram:
+            ranks[lessons] = above + 1
+            above += count
+
+        if course.teacher.user_id == user.id:
+            return self.class_view(request, course, histogram, students, ranks)
+
+        progress = Progress.objects.filter(course_id=course_id, student__user=user).only('completed_lessons', 'total_lessons').first()
+        if progress is None:
+            return Response({"error": "Only enrolled students and the course teacher can see rankings."}, status=403)
+
+        lessons = progress.completed_lessons
+        below = sum(count for completed, count in histogram if completed < lessons)
+        equal = sum(count for completed, count in histogram if completed == lessons)
+        rank = ranks.get(lessons, 1)
+        return Response({
+            "course_id": course.id,
+            "completed_lessons": lessons,
+            "total_lessons": progress.total_lessons,
+            "rank": rank,
+            "students": students,
+            # Share of the class below you (ties count half), and the top-N% you are in
+            "percentile": round(100 * (below + equal / 2) / students, 1) if students else None,
+            "top_percent": round(100 * rank / students, 1) if students else None,
+        })
+
+    def class_view(self, request, course, histogram, students, ranks):
+        try:
+            offset = max(int(request.query_params.get('offset', 0)), 0)
+            limit = min(max(int(request.query_params.get('limit', 50)), 1), self.max_limit)
+        except ValueError:
+            return Response({"error": "offset and limit must be integers."}, status=400)
+
+        page = (
+            Progress.objects.filter(course_id=course.id)
+            .select_related('student__user')
+            .only('completed_lessons', 'is_completed', 'student__id', 'student__user__username')
+            .order_by('-completed_lessons', 'pk')[offset:offset + limit]
+        )
+        return Response({
+            "course_id": course.id,
+            "total_lessons": course.total_lessons,
+            "students": students,
+            "histogram": [{"completed_lessons": lessons, "count": count} for lessons, count in reversed(histogram)],
+            "results": [
+                {
+                    "student_id": progress.student.id,
+                    "username": progress.student.user.username,
+                    "completed_lessons": progress.completed_lessons,
+                    "is_completed": progress.is_completed,
+                    "rank": ranks.get(progress.completed_lessons),
+                }
+                for progress in page
+            ],
+        })
+
+
+@replica_reads
+class DailyStatsView(APIView):
+    """
+    Enrollments and completions per day for ?course=<id> or ?teacher=<id>,
+    between ?start= and ?end= (YYYY-MM-DD, default the last 30 days). Read from
+    the daily rollups: one indexed row per day, days without activity are zeros.
+    Staff can see any course or teacher, teachers their own.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        params = request.query_params
+        try:
+            end = date.fromisoformat(params['end']) if 'end' in params else date.today()
+            start = date.fromisoformat(params['start']) if 'start' in params else end - timedelta(days=29)
+            course_id = int(params['course']) if 'course' in params else None
+            teacher_id = int(params['teacher']) if 'teacher' in params else None
+        except ValueError:
+            return Response({"error": "start and end must be YYYY-MM-DD, course and teacher integers."}, status=400)
+        if (course_id is None) == (teacher_id is None):
+            return Response({"error": "Pass exactly one of course or teacher."}, status=400)
+        days = (end - start).days + 1
+        if not 0 < days <= settings.ANALYTICS_MAX_DAYS:
+            return Response({"error": f"The range must cover 1 to {settings.ANALYTICS_MAX_DAYS} days."}, status=400)
+
+        if course_id is not None:
+            owner = Course.objects.filter(pk=course_id, teacher__user=request.user)
+            rows = DailyCourseStats.objects.filter(course_id=course_id)
+        else:
+            owner = Teacher.objects.filter(pk=teacher_id, user=request.user)
+            rows = DailyTeacherStats.objects.filter(teacher_id=teacher_id)
+        if not request.user.is_staff and not owner.exists():
+            raise PermissionDenied("Only staff and the teacher can see these statistics.")
+
+        counts = {
+            day: (enrollments, completions)
+            for day, enrollments, completions in rows.filter(day__range=(start, end)).values_list('day', 'enrollments', 'completions')
+        }
+        series = []
+        for offset in range(days):
+            day = start + timedelta(days=offset)
+            enrollments, completions = counts.get(day, (0, 0))
+            series.append({"date": day, "enrollments": enrollments, "completions": completions})
+        return Response({
+            "course_id": course_id,
+            "teacher_id": teacher_id,
+            "start": start,
+            "end": end,
+            "totals": {
+                "enrollments": sum(enrollments for enrollments, _ in counts.values()),
+                "completions": sum(completions for _, completions in counts.values()),
+            },
+            "series": series,
+        })
+
+
+@replica_reads
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def course_recommendations(request, course_id):
+    """Students who took this course also took... (precomputed by `build_recommendations`)."""
+    recommendations = (
+        CourseRecommendation.objects.filter(course_id=course_id)
+        .select_related('recommended')
+        .only('score', 'recommended__id', 'recommended__title', 'recommended__thumbnail')
+        .order_by('rank')
+    )
+    return Response([
+        {
+            "course_id": recommendation.recommended.id,
+            "title": recommendation.recommended.title,
+            "thumbnail": request.build_absolute_uri(recommendation.recommended.thumbnail.url) if recommendation.recommended.thumbnail else None,
+            "score": round(recommendation.score, 4),
+        }
+        for recommendation in recommendations
+    ])
+
+
+class BatchView(APIView):
+    """
+    Run several read-only API calls in one request:
+    {"requests": [{"path": "/profile/"}, {"path": "/courses/3/?fields=id,title"}]}
+
+    The JWT is checked once, every sub-request shares the same user (with its
+    teacher/student profile preloaded) and a per-batch identity map, and
+    middleware doesn't run again for each call.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        items = request.data.get("requests") if isinstance(request.data, dict) else None
+        if not isinstance(items, list) or not items:
+            return Response({"error": "requests must be a non-empty list."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > settings.BATCH_MAX_REQUESTS:
+            return Response({"error": f"At most {settings.BATCH_MAX_REQUESTS} requests per batch."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # One query for the user and both profiles; the sub-requests reuse it
+        user = User.objects.select_related('teacher', 'student_profile').get(pk=request.user.pk)
+
+        with identity_map():
+            responses = [self.run_one(request, user, item) for item in items]
+        return Response({"responses": responses})
+
+    def run_one(self, request, user, item):
+        path = item.get("path") if isinstance(item, dict) else None
+        method = (item.get("method") or "GET").upper() if isinstance(item, dict) else "GET"
+        if not isinstance(path, str) or not path.startswith("/"):
+            return {"path": path, "status": 400, "body": {"error": "path must be an absolute API path."}}
+        if method != "GET":
+            return {"path": path, "status": 405, "body": {"error": "Only GET requests can be batched."}}
+
+        url = urlsplit(path)
+        try:
+            match = resolve(url.path, urlconf='api.urls')
+        except Resolver404:
+            return {"path": path, "status": 404, "body": {"error": "Not found."}}
+        if getattr(match.func, 'cls', None) is BatchView:
+            return {"path": path, "status": 400, "body": {"error": "Batches can't be nested."}}
+
+        environ = {
+            **request._request.META,
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': url.path, 'QUERY_STRING': url.query,
+            'CONTENT_LENGTH': '0', 'wsgi.input': BytesIO(b''),
+        }
+        environ.pop('CONTENT_TYPE', None)
+        sub_request = WSGIRequest(environ)
+        # DRF's forced authentication: skip decoding the JWT again
+        sub_request._force_auth_user = user
+        sub_request._force_auth_token = request.auth
+
+        response = match.func(sub_request, *match.args, **match.kwargs)
+        body = getattr(response, 'data', None)
+        return {"path": path, "status": response.status_code, "body": body}
+
+
+# Media files (course files, thumbnails, certificates, profile pictures)
+# Public folders are served to anyone, protected ones need the course relationship.
+PUBLIC_MEDIA_DIRS = ('course_thumbnails/', 'profile_pics/')
+PROTECTED_MEDIA_DIRS = ('course_files/', 'certificates/')
+
+
+def can_access_media(user, path):
+    """Check if the user may download the media file stored at `path`."""
+    if path.startswith(PUBLIC_MEDIA_DIRS):
+        return True
+    if not user.is_authenticated:
+        return False
+    if user.is_staff:
+        return True
+
+    if path.startswith('course_files/'):
+        course_file = CourseFile.objects.select_related('course__teacher').filter(file=path).first()
+        if not course_file:
+            return False
+        course = course_file.course
+        if course.teacher.user_id == user.id:
+            return True
+        return Enrollment.objects.filter(student__user=user, course=course).exists()
+
+    if path.startswith('certificates/'):
+        certificate = Certificate.objects.select_related('student', 'course__teacher').filter(certificate_file=path).first()
+        if not certificate:
+            return False
+        return user.id in (certificate.student.user_id, certificate.course.teacher.user_id)
+
+    return False
+
+
+def media_cache_control(path):
+    """Uploads never change under the same name, certificates are re-rendered in place."""
+    scope = 'public' if path.startswith(PUBLIC_MEDIA_DIRS) else 'private'
+    if path.startswith('certificates/'):
+        return f"{scope}, no-cache"
+    return f"{scope}, max-age={settings.MEDIA_CACHE_MAX_AGE}, immutable"
+
+
+def media_user(request):
+    """The user of the request's API token (JWT), or of its session when it sends none."""
+    for authentication_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        try:
+            result = authentication_class().authenticate(request)
+        except AuthenticationFailed:
+            return AnonymousUser()
+        if result is not None:
+            return result[0]
+    return getattr(request, 'user', AnonymousUser())
+
+
+# A plain Django view, not @api_view: browsers and <img> tags send Accept: image/*
+# and the like, which DRF's content negotiation would answer with 406
+@require_safe
+def serve_media(request, path):
+    """
+    Serve a file from MEDIA_ROOT after checking access.
+    With MEDIA_SENDFILE_BACKEND set, the web server streams the file itself.
+    """
+    path = posixpath.normpath(path).lstrip('/')
+    if not path.startswith(PUBLIC_MEDIA_DIRS + PROTECTED_MEDIA_DIRS):
+        raise Http404("File not found.")
+
+    # Checked before the file is looked up, so a refusal doesn't tell whether it exists
+    if not can_access_media(media_user(request), path):
+        return JsonResponse({"error": "You don't have access to this file."}, status=403)
+
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        stat = os.stat(full_path)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404("File not found.")
+
+    etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+    not_modified = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if not_modified is not None:
+        response = not_modified
+    elif settings.MEDIA_SENDFILE_BACKEND == 'nginx':
+        response = HttpResponse(content_type=mimetypes.guess_type(full_path)[0] or 'application/octet-stream')
+        response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_REDIRECT_PREFIX + quote(path)
+    elif settings.MEDIA_SENDFILE_BACKEND == 'apache':
+        response = HttpResponse(content_type=mimetypes.guess_type(full_path)[0] or 'application/octet-stream')
+        response['X-Sendfile'] = full_path
+    else:
+        # FileResponse hands the file to wsgi.file_wrapper, so gunicorn uses sendfile()
+        response = FileResponse(open(full_path, 'rb'))
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Cache-Control'] = media_cache_control(path)
+    if path.startswith(PROTECTED_MEDIA_DIRS):
+        patch_vary_headers(response, ['Authorization'])
+    return response
+
+
+class _ZipStream:
+    """Write-only file for zipfile: what it writes is handed to the response chunk by chunk."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def certificate_zip_chunks(certificates, chunk_size=64 * 1024):
+    """
+    Yield a ZIP of the certificate PNGs, reading each file in chunks so memory
+    stays constant. Certificates without a stored file are rendered on the way.
+    """
+    stream = _ZipStream()
+    # PNGs are already compressed, storing them saves the CPU
+    with zipfile.ZipFile(stream, mode='w', compression=zipfile.ZIP_STORED) as archive:
+        for certificate in certificates:
+            stored = certificate.certificate_file
+            if not stored or not stored.storage.exists(stored.name):
+                try:
+                    certificate.generate_certificate()
+                except OSError:
+                    logger.exception("Rendering certificate %s failed", certificate.pk)
+                    continue
+                stored = certificate.certificate_file
+                if not stored:
+                    continue
+
+            with stored.storage.open(stored.name, 'rb') as source:
+                with archive.open(posixpath.basename(stored.name), mode='w') as target:
+                    for chunk in iter(lambda: source.read(chunk_size), b''):
+                        target.write(chunk)
+                        yield stream.drain()
+            yield stream.drain()
+    yield stream.drain()  # Central directory
+
+
+class CourseCertificatesZipView(APIView):
+    """Download every certificate of a course as one ZIP (course teacher or staff)."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, course_id):
+        user = request.user
+        course = get_object_or_404(Course.objects.select_related('teacher').only('id', 'title', 'teacher__user'), id=course_id)
+        if not user.is_staff and course.teacher.user_id != user.id:
+            return Response({"error": "Only the course teacher can download its certificates."}, status=status.HTTP_403_FORBIDDEN)
+
+        certificates = (
+            Certificate.objects.filter(course=course)
+            .select_related('student__user', 'course')
+            .order_by('id')
+            .iterator(chunk_size=200)
+        )
+        response = StreamingHttpResponse(certificate_zip_chunks(certificates), content_type='application/zip')
+        filename = f"certificates-{slugify(course.title) or course.id}.zip"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
+class CourseArchiveView(APIView):
+    """Read-only JSONL of an archived course's rows (?model=progress etc.), course teacher or staff."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, course_id):
+        user = request.user
+        course_archive = get_object_or_404(
+            CourseArchive.objects.select_related('course__teacher'), course_id=course_id
+        )
+        if not user.is_staff and course_archive.course.teacher.user_id != user.id:
+            return Response({"error": "Only the course teacher can read its archive."}, status=status.HTTP_403_FORBIDDEN)
+
+        model = None
+        if request.query_params.get('model'):
+            model = next((m for m in ARCHIVED_MODELS if m._meta.model_name == request.query_params['model']), None)
+            if model is None:
+                return Response({"error": "Unknown model."}, status=status.HTTP_400_BAD_REQUEST)
+
+        def lines():
+            for instance in archived_rows(course_archive, model):
+                fields = {field.attname: getattr(instance, field.attname) for field in instance._meta.concrete_fields}
+                yield json.dumps({"model": instance._meta.label_lower, "fields": fields}, cls=DjangoJSONEncoder) + "\n"
+
+        return StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+
+
+class ProfileArtifactView(APIView):
+    """Download a .pstats or .json file saved by api.profiling (staff only)."""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, name):
+        if not re.fullmatch(r'[\w-]+\.(pstats|json)', name):
+            raise Http404("Profile not found.")
+        path = os.path.join(settings.PROFILE_ROOT, name)
+        if not os.path.exists(path):
+            raise Http404("Profile not found.")
+        content_type = 'application/json' if name.endswith('.json') else 'application/octet-stream'
+        return FileResponse(open(path, 'rb'), as_attachment=True, filename=name, content_type=content_type)
@@ -11,7 +11,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
 import dj_database_url
-from decouple import config
+from decouple import config, Csv
 
 from pathlib import Path
 import os
@@ -46,7 +46,8 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'api',
     'rest_framework',
-    'rest_framework_simplejwt',
+    # rest_framework_simplejwt isn't an installed app: it only ships translations,
+    # and installing it imports its settings and token modules at startup
      'corsheaders',
      
     
@@ -54,11 +55,16 @@ INSTALLED_APPS = [
 AUTH_USER_MODEL = 'api.User' 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'api.tenants.TenantMiddleware',
+    'api.middleware.CompressionMiddleware',
     'corsheaders.middleware.CorsMiddleware', 
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'api.routers.ReplicaRoutingMiddleware',
+    'api.profiling.ProfilingMiddleware',
+    'api.idempotency.IdempotencyMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware'
@@ -91,10 +97,105 @@ WSGI_APPLICATION = 'cms_backend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# Persistent connections, checked before reuse so a dropped connection is reopened
+DB_CONN_MAX_AGE = config('DB_CONN_MAX_AGE', default=60, cast=int)
+
 DATABASES = {
-     'default': dj_database_url.parse(config("DATABASE_URL"))
+     'default': dj_database_url.parse(config("DATABASE_URL"), conn_max_age=DB_CONN_MAX_AGE, conn_health_checks=True)
+}
+
+# SQLite tests use a file instead of shared in-memory cache, which fails concurrent
+# writers with "table is locked" instead of waiting (see the threaded tests)
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    DATABASES['default']['TEST'] = {'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3')}
+
+# Optional read replicas (comma separated URLs), used by views marked @replica_reads.
+# In tests they mirror 'default'.
+REPLICA_DATABASES = []
+for index, replica_url in enumerate(config('DATABASE_REPLICA_URLS', default='', cast=Csv())):
+    alias = f'replica_{index}'
+    DATABASES[alias] = dj_database_url.parse(replica_url, conn_max_age=DB_CONN_MAX_AGE, conn_health_checks=True)
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+    REPLICA_DATABASES.append(alias)
+
+# Schools hosted on this deployment (api.tenants). TENANT_DATABASES maps a school's slug
+# to the URL of its database (for a Postgres schema, add ?options=-c%20search_path%3D<schema>),
+# TENANT_HOSTS maps hostnames to slugs; other hosts find the school in the JWT claim:
+#   TENANT_DATABASES=north=sqlite:////srv/north.db,south=postgres://cms@db/cms
+#   TENANT_HOSTS=north.example.com=north,south.example.com=south
+# Create or update their tables with `manage.py migrate_tenants`.
+TENANTS = {}
+for entry in config('TENANT_DATABASES', default='', cast=Csv()):
+    slug, tenant_url = entry.split('=', 1)
+    alias = f'tenant_{slug}'
+    DATABASES[alias] = dj_database_url.parse(tenant_url, conn_max_age=DB_CONN_MAX_AGE, conn_health_checks=True)
+    if DATABASES[alias]['ENGINE'] == 'django.db.backends.sqlite3':
+        DATABASES[alias]['TEST'] = {'NAME': os.path.join(BASE_DIR, f'test_{alias}.sqlite3')}
+    TENANTS[slug] = alias
+TENANT_HOSTS = dict(entry.split('=', 1) for entry in config('TENANT_HOSTS', default='', cast=Csv()))
+ALLOWED_HOSTS += list(TENANT_HOSTS)
+TENANT_CLAIM = 'tenant'
+# Apps whose tables live in the tenant's database; sessions and messages stay in 'default'
+TENANT_APPS = ['api', 'auth', 'admin', 'contenttypes']
+
+DATABASE_ROUTERS = ['api.tenants.TenantRouter', 'api.routers.PrimaryReplicaRouter']
+
+
+# Cache
+# CACHE_BACKEND: 'locmem' (per process, bounded LRU), 'file' (shared by all
+# gunicorn workers on the host) or 'redis' (shared by all hosts, needs redis-py)
+# Cached reads are invalidated through version tokens kept in this cache, so
+# 'locmem' is only right for a single process: other workers would serve stale
+# reads for up to API_CACHE_TIMEOUT (`manage.py check --deploy` warns about it)
+CACHE_BACKEND = config('CACHE_BACKEND', default='locmem')
+
+CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'api.cache.LRUMemoryCache',
+        'LOCATION': 'cms-api',
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+            'MAX_BYTES': config('CACHE_MAX_BYTES', default=32 * 1024 * 1024, cast=int),
+        },
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': config('CACHE_LOCATION', default=os.path.join(BASE_DIR, '.cache')),
+    },
+    'redis': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': config('REDIS_URL', default='redis://127.0.0.1:6379/0'),
+    },
+}
+
+CACHES = {
+    'default': {**CACHE_BACKENDS[CACHE_BACKEND], 'KEY_FUNCTION': 'api.tenants.make_cache_key'},
 }
 
+# Seconds an API read stays cached (entries are also invalidated by model version bumps)
+API_CACHE_TIMEOUT = config('API_CACHE_TIMEOUT', default=300, cast=int)
+
+
+# Cold start: max milliseconds to import cms_backend.wsgi and load the URLconf, as the
+# first request does (checked by the test suite, profile with
+# `python manage.py startup_profile --first-request`)
+STARTUP_IMPORT_BUDGET_MS = config('STARTUP_IMPORT_BUDGET_MS', default=1500, cast=int)
+
+
+# Profiling (api.profiling): staff requests sending PROFILE_HEADER are run under
+# cProfile with a full SQL trace, saved to PROFILE_ROOT and downloadable from
+# /profiles/<id>.pstats|json. Queries slower than SLOW_QUERY_MS are always
+# logged to 'api.slow_queries' (a SLOW_QUERY_SAMPLE_RATE fraction of them).
+PROFILE_HEADER = config('PROFILE_HEADER', default='X-Profile')
+PROFILE_ROOT = config('PROFILE_ROOT', default=os.path.join(BASE_DIR, '.profiles'))
+SLOW_QUERY_MS = config('SLOW_QUERY_MS', default=200, cast=float)
+SLOW_QUERY_SAMPLE_RATE = config('SLOW_QUERY_SAMPLE_RATE', default=1.0, cast=float)
+
+
+# Courses that ended at least this many days ago are moved to CourseArchive
+# by `manage.py archive_courses`
+ARCHIVE_AFTER_DAYS = config('ARCHIVE_AFTER_DAYS', default=2 * 365, cast=int)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -144,7 +245,26 @@ import os
 # Media files settings
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
-DEBUG = True 
+
+# Media delivery: Django checks access, the web server sends the bytes.
+# '' -> FileResponse (sendfile via wsgi.file_wrapper), 'nginx' -> X-Accel-Redirect,
+# 'apache' -> X-Sendfile
+MEDIA_SENDFILE_BACKEND = config('MEDIA_SENDFILE_BACKEND', default='')
+MEDIA_ACCEL_REDIRECT_PREFIX = config('MEDIA_ACCEL_REDIRECT_PREFIX', default='/protected-media/')
+MEDIA_CACHE_MAX_AGE = config('MEDIA_CACHE_MAX_AGE', default=60 * 60 * 24 * 365, cast=int)
+
+# Uploads above this size are streamed to a temp file instead of held in memory
+FILE_UPLOAD_MAX_MEMORY_SIZE = config('FILE_UPLOAD_MAX_MEMORY_SIZE', default=512 * 1024, cast=int)
+
+# Image uploads (api.images): limits are checked from the header before any decode,
+# normalization (EXIF strip, orientation, resize) runs after commit in a thread pool
+IMAGE_UPLOAD_MAX_BYTES = config('IMAGE_UPLOAD_MAX_BYTES', default=10 * 1024 * 1024, cast=int)
+IMAGE_MAX_PIXELS = config('IMAGE_MAX_PIXELS', default=40_000_000, cast=int)
+IMAGE_MAX_SIDE = config('IMAGE_MAX_SIDE', default=2048, cast=int)
+IMAGE_FORMATS = config('IMAGE_FORMATS', default='JPEG,PNG,GIF,WEBP', cast=Csv())
+IMAGE_WORKERS = config('IMAGE_WORKERS', default=2, cast=int)
+IMAGE_QUEUE_SIZE = config('IMAGE_QUEUE_SIZE', default=32, cast=int)
+DEBUG = True
 
 from datetime import timedelta
 
@@ -154,8 +274,69 @@ REST_FRAMEWORK = {
     ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
-    ]
+    ],
+    # orjson when installed, stdlib json otherwise
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'api.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+    # Proxies in front of the app that append to X-Forwarded-For. 0 keys per-IP throttles on
+    # REMOTE_ADDR; anything higher than the real number lets clients spoof their IP.
+    'NUM_PROXIES': config('NUM_PROXIES', default=0, cast=int),
+    # api.throttling: '<scope>.ip', '<scope>.user' (or username tried) and '<scope>.route' (all clients)
+    'DEFAULT_THROTTLE_RATES': {
+        'login.ip': config('THROTTLE_LOGIN_IP', default='20/min'),
+        'login.user': config('THROTTLE_LOGIN_USER', default='10/min'),
+        'login.route': config('THROTTLE_LOGIN_ROUTE', default='600/min'),
+        'register.ip': config('THROTTLE_REGISTER_IP', default='10/hour'),
+        'register.route': config('THROTTLE_REGISTER_ROUTE', default='300/min'),
+        'upload_course.user': config('THROTTLE_UPLOAD_COURSE_USER', default='30/hour'),
+        'upload_course.route': config('THROTTLE_UPLOAD_COURSE_ROUTE', default='300/min'),
+        'upload_file.user': config('THROTTLE_UPLOAD_FILE_USER', default='120/hour'),
+        'upload_file.route': config('THROTTLE_UPLOAD_FILE_ROUTE', default='600/min'),
+    },
 }
+
+# Where throttle counters live: 'database' (shared by all workers and hosts) or
+# 'cache' (shared when CACHE_BACKEND is 'file' or 'redis')
+THROTTLE_STORE = config('THROTTLE_STORE', default='database')
+
+# Idempotency-Key on POST (api.idempotency): responses are replayed for IDEMPOTENCY_TTL
+# seconds; a duplicate waits up to IDEMPOTENCY_WAIT_SECONDS for the first request, which
+# holds the key for at most IDEMPOTENCY_LEASE_SECONDS.
+# Expired rows are removed by `manage.py clear_idempotency_keys`.
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_TTL = config('IDEMPOTENCY_TTL', default=24 * 60 * 60, cast=int)
+IDEMPOTENCY_WAIT_SECONDS = config('IDEMPOTENCY_WAIT_SECONDS', default=10, cast=float)
+# How long a request in progress holds its key; keep it above the worker timeout
+IDEMPOTENCY_LEASE_SECONDS = config('IDEMPOTENCY_LEASE_SECONDS', default=40, cast=int)
+IDEMPOTENCY_POLL_INTERVAL = 0.05
+
+# Transactional outbox (api.outbox): `manage.py relay_outbox` sends pending events to
+# OUTBOX_SINK (stdout, file:<path>, http(s)://<url> or a sink class) in pages of
+# OUTBOX_BATCH_SIZE, and deletes delivered events after OUTBOX_RETENTION_DAYS
+OUTBOX_SINK = config('OUTBOX_SINK', default='stdout')
+OUTBOX_BATCH_SIZE = config('OUTBOX_BATCH_SIZE', default=500, cast=int)
+OUTBOX_POLL_INTERVAL = config('OUTBOX_POLL_INTERVAL', default=1.0, cast=float)
+OUTBOX_HTTP_TIMEOUT = config('OUTBOX_HTTP_TIMEOUT', default=5.0, cast=float)
+OUTBOX_RETENTION_DAYS = config('OUTBOX_RETENTION_DAYS', default=7, cast=int)
+
+# Longest date range (in days) one GET /analytics/daily/ may ask for
+ANALYTICS_MAX_DAYS = config('ANALYTICS_MAX_DAYS', default=366, cast=int)
+
+# Max sub-requests in one POST /batch/
+BATCH_MAX_REQUESTS = config('BATCH_MAX_REQUESTS', default=20, cast=int)
+
+# Response compression (api.middleware.CompressionMiddleware); brotli needs the `brotli` package
+COMPRESSION_MIN_SIZE = config('COMPRESSION_MIN_SIZE', default=1024, cast=int)
+COMPRESSION_GZIP_LEVEL = config('COMPRESSION_GZIP_LEVEL', default=6, cast=int)
+COMPRESSION_BROTLI_QUALITY = config('COMPRESSION_BROTLI_QUALITY', default=5, cast=int)
+COMPRESSION_CONTENT_TYPES = ['application/json']
 # JWT Settings
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),  # Token valid for 1 hour